@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+"""Offline benchmarks of the savers and the scrape commands against the mock Bugzilla server."""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import subprocess
+import multiprocessing
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_bugzilla import MockBugzilla, MockConfig, MockCorpus  # noqa: E402
+
+
+# Runs the command line against the mock server, registered like any custom subdomain
+CLI_ENTRY = '''
+import sys
+from bugscraper import bugscraper, cli
+bugscraper.custom_subdomains['bench'] = sys.argv[1]
+sys.exit(cli.main(sys.argv[2:]))
+'''
+
+SUBDOMAIN = 'bench'
+
+
+@dataclass
+class Result:
+    name: str
+    seconds: float
+    bugs: int
+    requests: int
+    bytes_written: int
+    peak_rss: int
+    statuses: Dict[str, int]
+
+    @property
+    def bugs_per_sec(self) -> float:
+        return self.bugs / self.seconds if self.seconds else 0.0
+
+    @property
+    def requests_per_sec(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    @property
+    def write_mb_per_sec(self) -> float:
+        return self.bytes_written / 1e6 / self.seconds if self.seconds else 0.0
+
+    def report(self) -> Dict[str, Any]:
+        report = asdict(self)
+        report.update(bugs_per_sec=self.bugs_per_sec, requests_per_sec=self.requests_per_sec,
+                      write_mb_per_sec=self.write_mb_per_sec)
+        return report
+
+
+def dir_size(path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def existing_bugs(config: MockConfig) -> int:
+    corpus = MockCorpus(config)
+    return sum(1 for bug_id in range(1, config.bugs + 1) if corpus.exists(bug_id))
+
+
+def run_saver(name: str, config: MockConfig, save_dir: str, backend: str, compression: str,
+              chunk_size: int) -> Dict[str, Any]:
+    """
+    Save the whole synthetic corpus through the savers, runs in a fresh process to measure its peak rss
+    """
+    from bugscraper.bugscraper import BugSaver, CommentSaver, HistorySaver
+
+    corpus = MockCorpus(config)
+    bug_ids = [bug_id for bug_id in range(1, config.bugs + 1) if corpus.exists(bug_id)]
+    start = time.perf_counter()
+    if name == 'bugs':
+        saver = BugSaver(save_dir, backend, compression)
+        for pos in range(0, len(bug_ids), chunk_size):
+            saver.save([corpus.bug(bug_id) for bug_id in bug_ids[pos:pos + chunk_size]])
+    else:
+        saver_class = CommentSaver if name == 'comments' else HistorySaver
+        records = corpus.comments if name == 'comments' else corpus.history
+        saver = saver_class(save_dir, backend, compression)
+        for bug_id in bug_ids:
+            saver.save(saver.bug_metadata.index_of(bug_id), records(bug_id))
+    saver.flush()
+    saver.save_metadata()
+    saver.storage.close()
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'bugs': len(bug_ids),
+            'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def bench_savers(config: MockConfig, work_dir: str, chunk_size: int) -> List[Result]:
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for backend, compression in (('jsonl', 'none'), ('jsonl', 'gzip'), ('jsonl', 'zstd'), ('sqlite', 'none')):
+        save_dir = os.path.join(work_dir, f'savers-{backend}-{compression}')
+        os.makedirs(save_dir)
+        # Comments and history savers need the metadata the bug saver leaves behind
+        for name in ('bugs', 'comments', 'history'):
+            before = dir_size(save_dir)
+            with context.Pool(1) as pool:
+                run = pool.apply(run_saver, (name, config, save_dir, backend, compression, chunk_size))
+            results.append(Result(
+                f'{name}-saver/{backend}/{compression}', run['seconds'], run['bugs'], 0,
+                dir_size(save_dir) - before, run['peak_rss'], {}
+            ))
+    return results
+
+
+def run_command(mock: MockBugzilla, name: str, args: List[str], save_root: str, bugs: int) -> Result:
+    """
+    Run one command line in a child process and collect its wall time, peak rss, requests and writes
+    """
+    save_dir = os.path.join(save_root, SUBDOMAIN + 'bugs')
+    before = dir_size(save_dir) if os.path.isdir(save_dir) else 0
+    mock.reset()
+    command = [sys.executable, '-c', CLI_ENTRY, mock.url] + args
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path[1:2] + [os.environ.get('PYTHONPATH', '')]))
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    _, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    stderr = process.stderr.read().decode('utf-8', 'replace')
+    process.stderr.close()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f'{name} exited with {process.returncode}: {stderr[-2000:]}')
+    after = dir_size(save_dir) if os.path.isdir(save_dir) else 0
+    with mock.lock:
+        statuses = {str(code): count for code, count in sorted(mock.statuses.items())}
+        requests = sum(mock.statuses.values())
+    return Result(name, seconds, bugs, requests, max(after - before, 0), rusage.ru_maxrss * 1024, statuses)
+
+
+def bench_commands(config: MockConfig, work_dir: str, workers: int, chunk_size: int,
+                   backend: str, compression: str) -> List[Result]:
+    bugs = existing_bugs(config)
+    ids = ['--init-id', '1', '--fin-id', str(config.bugs + 1)]
+    storage = ['--backend', backend] + (['--compression', compression] if compression != 'none' else [])
+    results = []
+    with MockBugzilla(config) as mock:
+        staged = os.path.join(work_dir, 'staged')
+        for name, args in (
+            ('bugscrape', ['bugscrape', SUBDOMAIN] + ids + ['-c', str(chunk_size), '-w', str(workers)]),
+            ('commentscrape', ['commentscrape', SUBDOMAIN, '-w', str(workers)]),
+            ('historyscrape', ['historyscrape', SUBDOMAIN, '-w', str(workers)]),
+        ):
+            results.append(run_command(mock, name, args + ['-s', staged] + storage, staged, bugs))
+
+        single = os.path.join(work_dir, 'single')
+        args = ['scrape', SUBDOMAIN] + ids + ['-c', str(chunk_size), '-w', str(workers), '-s', single]
+        results.append(run_command(mock, 'scrape', args + storage, single, bugs))
+
+        # Commands working on the saved corpus only
+        for name, args in (
+            ('metagen', ['metagen', SUBDOMAIN, '-s', single, '--backend', backend]),
+            ('compact', ['compact', SUBDOMAIN, '-s', single, '--backend', backend]),
+        ):
+            results.append(run_command(mock, name, args, single, bugs))
+    return results
+
+
+def print_results(results: List[Result]):
+    header = (f'{"benchmark":<32}{"seconds":>9}{"bugs/s":>11}{"req/s":>9}{"write MB/s":>12}'
+              f'{"peak MB":>9}  statuses')
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        statuses = ' '.join(f'{code}:{count}' for code, count in result.statuses.items())
+        print(f'{result.name:<32}{result.seconds:>9.2f}{result.bugs_per_sec:>11.0f}'
+              f'{result.requests_per_sec:>9.0f}{result.write_mb_per_sec:>12.1f}'
+              f'{result.peak_rss / 1e6:>9.0f}  {statuses}')
+
+
+def compare(results: List[Result], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Return the benchmarks whose throughput fell below the baseline by more than tolerance
+    """
+    with open(baseline_path) as bf:
+        baseline = {entry['name']: entry for entry in json.load(bf)}
+    regressions = []
+    for result in results:
+        if result.name not in baseline:
+            continue
+        expected = baseline[result.name]['bugs_per_sec']
+        if result.bugs_per_sec < expected * (1 - tolerance):
+            regressions.append(f'{result.name}: {result.bugs_per_sec:.0f} bugs/s, baseline {expected:.0f}')
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bugs', type=int, default=10000, help='Bug ids served by the mock server')
+    parser.add_argument('--payload-size', type=int, default=200, help='Padding bytes per bug and comment')
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds the server waits per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests failing with 500')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Requests per second the server answers before returning 429')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests of the commands')
+    parser.add_argument('--chunk-size', type=int, default=200, help='Bugs per request and per save')
+    parser.add_argument('--backend', default='jsonl', help='Storage backend of the commands')
+    parser.add_argument('--compression', default='none', help='Compression of the commands')
+    parser.add_argument('--only', choices=('savers', 'commands'), help='Run one group of benchmarks')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+    parser.add_argument('--compare', help='Fail on throughput below the results in this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against --compare')
+    parser.add_argument('--keep', action='store_true', help='Keep the scraped files')
+    args = parser.parse_args(argv)
+
+    config = MockConfig(bugs=args.bugs, payload_size=args.payload_size, latency=args.latency,
+                        error_rate=args.error_rate, rate_limit=args.rate_limit)
+    work_dir = tempfile.mkdtemp(prefix='bugscraper-bench-')
+    try:
+        results = []
+        if args.only in (None, 'savers'):
+            results += bench_savers(config, work_dir, args.chunk_size)
+        if args.only in (None, 'commands'):
+            results += bench_commands(config, work_dir, args.workers, args.chunk_size,
+                                      args.backend, args.compression)
+    finally:
+        if args.keep:
+            print(f'Kept scraped files in {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, 'w') as jf:
+            json.dump([result.report() for result in results], jf, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""Local stand-in for the Bugzilla REST api serving a synthetic corpus."""
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class MockConfig:
+    """
+    Shape and behaviour of the mock server
+    Every bug id up to bugs exists except multiples of missing_every, which leave holes like deleted bugs.
+    Payload size pads the summary of bugs and the text of comments to roughly that many bytes.
+    """
+    bugs: int = 10000
+    missing_every: int = 7
+    first_year: int = 2002
+    years: int = 5
+    comments_per_bug: int = 3
+    history_per_bug: int = 1
+    payload_size: int = 200
+    latency: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: Optional[float] = None
+    retry_after: int = 1
+    max_ids: int = 400
+    seed: int = 0
+
+
+class MockCorpus(object):
+    """
+    Deterministic synthetic bugs, comments and history
+    """
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.padding = 'x' * config.payload_size
+
+    def exists(self, bug_id: int) -> bool:
+        return 0 < bug_id <= self.config.bugs and bug_id % self.config.missing_every != 0
+
+    def year(self, bug_id: int) -> int:
+        return self.config.first_year + bug_id % self.config.years
+
+    def bug(self, bug_id: int) -> Dict[str, Any]:
+        return {
+            'id': bug_id,
+            'product': 'Core' if bug_id % 2 else 'Firefox',
+            'component': f'Component {bug_id % 13}',
+            'status': 'RESOLVED' if bug_id % 3 else 'NEW',
+            'resolution': 'FIXED' if bug_id % 3 else '',
+            'creation_time': f'{self.year(bug_id)}-01-01T00:00:00Z',
+            'last_change_time': f'{self.year(bug_id) + 1}-06-01T00:00:00Z',
+            'summary': f'Bug {bug_id} {self.padding}',
+        }
+
+    def comments(self, bug_id: int) -> List[Dict[str, Any]]:
+        return [
+            {'id': bug_id * 100 + n, 'bug_id': bug_id, 'count': n, 'creator': f'user{n}@example.com',
+             'time': f'{self.year(bug_id)}-02-01T00:00:00Z', 'text': f'Comment {n} {self.padding}'}
+            for n in range(self.config.comments_per_bug)
+        ]
+
+    def history(self, bug_id: int) -> List[Dict[str, Any]]:
+        return [
+            {'who': f'user{n}@example.com', 'when': f'{self.year(bug_id)}-03-01T00:00:00Z',
+             'changes': [{'field_name': 'status', 'removed': 'NEW', 'added': 'RESOLVED'}]}
+            for n in range(self.config.history_per_bug)
+        ]
+
+
+class MockBugzilla(object):
+    """
+    Threaded http server answering /rest/bug, /rest/bug/{id}/comment and /rest/bug/{id}/history
+    Requests are delayed by latency, fail with a 500 at error_rate and get a 429 with a Retry-After
+    header once they exceed rate_limit requests per second. Status counts are kept for reporting.
+    """
+    def __init__(self, config: MockConfig, host: str = '127.0.0.1', port: int = 0):
+        self.config = config
+        self.corpus = MockCorpus(config)
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.statuses: Counter = Counter()
+        self.bytes_sent = 0
+        self.window = (0, 0)
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/rest/bug'
+
+    def start(self) -> 'MockBugzilla':
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.statuses.clear()
+            self.bytes_sent = 0
+
+    def __enter__(self) -> 'MockBugzilla':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def throttled(self) -> bool:
+        if self.config.rate_limit is None:
+            return False
+        second = int(time.monotonic())
+        with self.lock:
+            start, count = self.window
+            self.window = (second, count + 1) if start == second else (second, 1)
+            return self.window[1] > self.config.rate_limit
+
+    def failed(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.config.error_rate
+
+    @staticmethod
+    def project(records: List[Dict[str, Any]], query: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        """
+        Apply the include_fields and exclude_fields parameters of a query to records
+        """
+        include = set(','.join(query.get('include_fields', [])).split(',')) - {''}
+        exclude = set(','.join(query.get('exclude_fields', [])).split(',')) - {''}
+        return [{name: value for name, value in record.items()
+                 if (not include or name in include) and name not in exclude} for record in records]
+
+    def respond(self, path: str, query: Dict[str, List[str]]):
+        """
+        Return the status and body of a request
+        """
+        parts = path.strip('/').split('/')
+        if parts[-1] == 'bug':
+            if 'id' in query:
+                bug_ids = [int(bug_id) for bug_id in query['id']]
+                if len(bug_ids) > self.config.max_ids:
+                    return 413, {'error': True, 'message': 'Too many ids'}
+                bug_ids = [bug_id for bug_id in bug_ids if self.corpus.exists(bug_id)]
+                return 200, {'bugs': self.project([self.corpus.bug(bug_id) for bug_id in bug_ids], query)}
+            # Search for changed or newest bugs, every existing bug matches
+            limit = int(query.get('limit', ['1000'])[0])
+            offset = int(query.get('offset', ['0'])[0])
+            bug_ids = [bug_id for bug_id in range(1, self.config.bugs + 1) if self.corpus.exists(bug_id)]
+            if query.get('order', [''])[0] == 'bug_id DESC':
+                bug_ids.reverse()
+            bugs = [self.corpus.bug(bug_id) for bug_id in bug_ids[offset:offset + limit]]
+            return 200, {'bugs': self.project(bugs, query)}
+        if len(parts) >= 2 and parts[-1] in ('comment', 'history'):
+            bug_ids = [int(bug_id) for bug_id in [parts[-2]] + query.get('ids', [])]
+            bug_ids = [bug_id for bug_id in bug_ids if self.corpus.exists(bug_id)]
+            if parts[-1] == 'comment':
+                bugs = {str(bug_id): {'comments': self.project(self.corpus.comments(bug_id), query)}
+                        for bug_id in bug_ids}
+                return 200, {'bugs': bugs, 'comments': {}}
+            bugs = [{'id': bug_id, 'history': self.corpus.history(bug_id)} for bug_id in bug_ids]
+            return 200, {'bugs': bugs}
+        return 404, {'error': True, 'message': 'Not found'}
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, Nagle would hold the body back for an ack
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if mock.config.latency:
+                    time.sleep(mock.config.latency)
+                headers = {}
+                if mock.throttled():
+                    status, body = 429, {'error': True, 'message': 'Too many requests'}
+                    headers['Retry-After'] = str(mock.config.retry_after)
+                elif mock.failed():
+                    status, body = 500, {'error': True, 'message': 'Injected error'}
+                else:
+                    url = urlparse(self.path)
+                    status, body = mock.respond(url.path, parse_qs(url.query))
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                with mock.lock:
+                    mock.statuses[status] += 1
+                    mock.bytes_sent += len(data)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    for name, default in vars(MockConfig()).items():
+        if name != 'rate_limit':
+            parser.add_argument('--' + name.replace('_', '-'), type=type(default), default=default)
+    parser.add_argument('--rate-limit', type=float, default=None)
+    args = vars(parser.parse_args())
+    port = args.pop('port')
+    mock = MockBugzilla(MockConfig(**args), port=port)
+    print(f'Serving {mock.config.bugs} bugs at {mock.url}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
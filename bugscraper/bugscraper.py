@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 import os
-import re
-import json
+import time
+import random
 import requests
 import logging
-from typing import Iterable, List, Any
-from dataclasses import dataclass, field, asdict
+from typing import Iterable, Iterator, List, Any, Set, Dict, Optional
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import PurePath
 from overrides import overrides
+from bugscraper.metadata import BugSaveMetadata, FieldProjection, MetadataStore
+from bugscraper.storage import KINDS, Partitioning, backends, creation_month
+from bugscraper.ratelimit import TokenBucket, THROTTLE_STATUSES, get_limiter
+from bugscraper.cache import CachedResponse, ResponseCache
+from bugscraper.metrics import metrics
+from bugscraper.serialization import dumps, loads, response_json
 
 
 custom_subdomains = {
@@ -16,150 +24,524 @@ custom_subdomains = {
     'libreoffice': 'https://bugs.documentfoundation.org/rest/bug'
 }
 
+# Metric label of the REST endpoints, by the last segment of their path
+endpoints = {'bug': 'bugs', 'comment': 'comments', 'history': 'history'}
+
 
 logger = logging.getLogger('bugscraper')
 
 
+class JitterRetry(Retry):
+    """
+    Retry policy with full jitter on the exponential backoff
+    Retry-After headers sent by the server take precedence over the backoff
+    Retried attempts also wait for the rate limiter, which is slowed down on throttling statuses
+    """
+    limiter: Optional[TokenBucket] = None
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.limiter = self.limiter
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if self.limiter is not None and response is not None and response.status in THROTTLE_STATUSES:
+            self.limiter.throttled()
+        reason = response.status if response is not None else type(error).__name__
+        metrics.inc('retries_total', reason=reason)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    def get_backoff_time(self):
+        return random.uniform(0, super().get_backoff_time())
+
+
+class BugzillaAdapter(HTTPAdapter):
+    """
+    Adapter that takes a token from the rate limiter before sending and reports the final status back
+    With a response cache GET requests are sent conditionally, 304 responses are answered from it
+    """
+    def __init__(self, limiter: Optional[TokenBucket] = None, cache: Optional[ResponseCache] = None,
+                 **kwargs):
+        self.limiter = limiter
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def cached_response(request, cached: CachedResponse) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response._content = cached.body
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    @staticmethod
+    def endpoint(request) -> str:
+        return endpoints.get(urlparse(request.url).path.rstrip('/').rsplit('/', 1)[-1], 'other')
+
+    def send(self, request, **kwargs):
+        cached = None
+        endpoint = self.endpoint(request)
+        if self.cache is not None and request.method == 'GET':
+            cached = self.cache.get(request.url)
+            if self.cache.offline:
+                if cached is None:
+                    metrics.inc('requests_total', endpoint=endpoint, status='offline-miss')
+                    raise requests.exceptions.ConnectionError(f'Offline and not cached: {request.url}')
+                metrics.inc('cache_hits_total', endpoint=endpoint)
+                return self.cached_response(request, cached)
+            if cached is not None and cached.etag:
+                request.headers['If-None-Match'] = cached.etag
+            if cached is not None and cached.last_modified:
+                request.headers['If-Modified-Since'] = cached.last_modified
+
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+            # Reading the body here keeps the download in the measured network time
+            size = len(response.content or b'')
+        except requests.exceptions.RequestException as e:
+            metrics.inc('requests_total', endpoint=endpoint, status=type(e).__name__)
+            raise
+        finally:
+            metrics.observe('request_seconds', time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc('requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.inc('response_bytes_total', size, endpoint=endpoint)
+        if self.limiter is not None:
+            self.limiter.feedback(response.status_code)
+
+        if cached is not None and response.status_code == 304:
+            metrics.inc('cache_hits_total', endpoint=endpoint)
+            return self.cached_response(request, cached)
+        if self.cache is not None and request.method == 'GET' and response.status_code == 200:
+            self.cache.put(request.url, response.content,
+                           response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response
+
+
 class BugzillaApi(object):
     """
     Simple API class interface to fetch bugs
+    Requests go through a pooled keep-alive session that retries transient failures,
+    ids that still fail are collected in failed_ids for replay
+    With a rate every api talking to the same host shares one token bucket,
+    with a cache unchanged responses are served from disk
+    Include and exclude fields are passed on to Bugzilla to shrink responses, the fields the
+    scraper itself relies on are always kept
     """
-    def __init__(self, sub_domain: str):
+    # Record kind the api fetches, labels its fetch metrics
+    kind = ''
+    # Fields that projections never drop
+    required_fields: Set[str] = set()
+
+    def __init__(self, sub_domain: str, pool_size: int = 10, retries: int = 5, backoff_factor: float = 0.5,
+                 timeout: float = 60, rate: Optional[float] = None, burst: Optional[int] = None,
+                 cache: Optional[ResponseCache] = None, include_fields: Optional[Iterable[str]] = None,
+                 exclude_fields: Optional[Iterable[str]] = None):
         self.sub_domain = sub_domain
+        self.timeout = timeout
+        include_fields = set(include_fields or [])
+        self.projection = FieldProjection(
+            sorted(include_fields | self.required_fields) if include_fields else [],
+            sorted(set(exclude_fields or []) - self.required_fields)
+        )
+        self.failed_ids: Set[int] = set()
+        self.limiter = get_limiter(self.host, rate, burst) if rate else None
+
+        retry = JitterRetry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            respect_retry_after_header=True
+        )
+        retry.limiter = self.limiter
+        adapter = BugzillaAdapter(
+            self.limiter, cache, pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def fields(self) -> Dict[str, str]:
+        """
+        Query parameters of the field projection
+        """
+        params = {}
+        if self.projection.include_fields:
+            params['include_fields'] = ','.join(self.projection.include_fields)
+        if self.projection.exclude_fields:
+            params['exclude_fields'] = ','.join(self.projection.exclude_fields)
+        return params
 
     def fetch(self, *args, **kwargs):
         raise NotImplementedError
 
+    def fetch_many(self, bug_ids: Iterable[int]) -> Optional[Dict[str, List[Any]]]:
+        raise NotImplementedError
+
+    @staticmethod
+    def is_rejected(error: requests.exceptions.RequestException) -> bool:
+        """
+        Whether the server refused the request itself, like a batch naming a private or deleted bug
+        """
+        status = getattr(error.response, 'status_code', None)
+        return status is not None and 400 <= status < 500 and status != 429
+
+    def fetch_halves(self, bug_ids: List[str], error: requests.exceptions.RequestException):
+        """
+        Fetch both halves of a rejected batch on their own, so one bad id does not fail its neighbours
+        Returns None when no bug of the batch could be fetched
+        """
+        logger.debug(f'Batch of {len(bug_ids)} bugs rejected, fetching its halves: {error}')
+        half = len(bug_ids) // 2
+        record_maps = [self.fetch_many(bug_ids[:half]), self.fetch_many(bug_ids[half:])]
+        if all(record_map is None for record_map in record_maps):
+            return None
+        return {bug_id: records for record_map in record_maps if record_map
+                for bug_id, records in record_map.items()}
+
+    def count_fetch(self, result):
+        """
+        Record whether a fetch failed, came back empty or returned records, and pass its result on
+        """
+        outcome = 'failed' if result is None else 'empty' if not result else 'ok'
+        metrics.inc('fetches_total', kind=self.kind, result=outcome)
+        return result
+
     def __str__(self):
         if self.sub_domain in custom_subdomains:
             return custom_subdomains[self.sub_domain]
         return f'http://bugzilla.{self.sub_domain}.org/rest/bug'
 
+    @property
+    def host(self) -> str:
+        return urlparse(str(self)).netloc
+
 
 class BugzillaBugApi(BugzillaApi):
+    kind = 'bugs'
+    # Bugs are saved by the year of their creation time
+    required_fields = {'id', 'creation_time'}
+
+    def get_bugs(self, bug_ids: List[int], fields: Optional[Dict[str, str]] = None) -> requests.Response:
+        """
+        Request a chunk of bugs, raising on connection errors and error statuses
+        The field parameters default to the projection of the api
+        """
+        fields = self.fields if fields is None else fields
+        response = self.session.get(url=str(self) + '?', params={'id': bug_ids, **fields},
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def fetch_changed(self, since: str, limit: int = 1000) -> Iterator[List[Any]]:
+        """
+        Page through all bugs changed at or after the timestamp since, raising on request failures
+        """
+        offset = 0
+        while True:
+            params = {'last_change_time': since, 'order': 'bug_id', 'limit': limit, 'offset': offset,
+                      **self.fields}
+            response = self.session.get(url=str(self), params=params, timeout=self.timeout)
+            response.raise_for_status()
+            bug_list = response_json(response)['bugs']
+            yield bug_list
+            if len(bug_list) < limit:
+                break
+            offset += limit
+
+    def newest_id(self) -> Optional[int]:
+        """
+        Ask the search api for the largest bug id, None when the host does not answer such a search
+        """
+        params = {'order': 'bug_id DESC', 'limit': 1, 'include_fields': 'id'}
+        try:
+            response = self.session.get(url=str(self), params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return int(response_json(response)['bugs'][0]['id'])
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            logger.debug(f'Newest bug search failed: {e}')
+            return None
+
     @overrides
     def fetch(self, bug_ids: Iterable[int]) -> List[int]:
         bug_list = []
+        bug_ids = list(bug_ids)
         try:
-            response = requests.get(url=str(self) + '?', params={'id': list(bug_ids)})
-            response.raise_for_status()
-            bug_list = response.json()['bugs']
+            bug_list = response_json(self.get_bugs(bug_ids))['bugs']
         except requests.exceptions.RequestException as e:
-            logger.debug('Connection Error: returning None')
+            logger.warning('Connection Error: recording {} failed ids, returning None'.format(len(bug_ids)))
             logger.debug(str(e))
+            self.failed_ids.update(int(bug_id) for bug_id in bug_ids)
+            bug_list = None
         except KeyError as e:
             logger.warn('incorrect key bugs: returning None')
             logger.debug(str(e))
         finally:
-            return bug_list
+            return self.count_fetch(bug_list)
 
 
 class BugzillaCommentApi(BugzillaApi):
+    kind = 'comments'
+    # Comment ids are kept in the bug metadata
+    required_fields = {'id'}
+
     @overrides
     def fetch(self, bug_id: int):
         comment_list = []
         try:
-            response = requests.get(url=str(self) + f'/{bug_id}/comment')
+            response = self.session.get(url=str(self) + f'/{bug_id}/comment', params=self.fields,
+                                        timeout=self.timeout)
             response.raise_for_status()
-            meta_obj = response.json()['bugs']
+            meta_obj = response_json(response)['bugs']
             if isinstance(meta_obj, list):
                 meta_obj = meta_obj[0]
             comment_list = meta_obj[str(bug_id)]['comments']
         except requests.exceptions.RequestException as e:
-            logger.debug('Connection Error: returning None')
+            logger.debug(f'Connection Error: recording failed id {bug_id}, returning None')
             logger.debug(str(e))
+            self.failed_ids.add(int(bug_id))
+            comment_list = None
         except KeyError as e:
             logger.debug('incorrect key: returning None')
             logger.debug(str(e))
         finally:
-            return comment_list
+            return self.count_fetch(comment_list)
+
+    def fetch_many(self, bug_ids: Iterable[int]) -> Optional[Dict[str, List[Any]]]:
+        """
+        Fetch comments of several bugs in one request using the ids parameter
+        Returns a mapping from bug id to its comments, bugs missing in the response are recorded as failed
+        """
+        bug_ids = [str(bug_id) for bug_id in bug_ids]
+        if not bug_ids:
+            return {}
+        comment_map = {}
+        try:
+            response = self.session.get(url=str(self) + f'/{bug_ids[0]}/comment',
+                                        params={'ids': bug_ids[1:], **self.fields}, timeout=self.timeout)
+            response.raise_for_status()
+            meta_obj = response_json(response)['bugs']
+            for bug_id in bug_ids:
+                if bug_id in meta_obj:
+                    comment_map[bug_id] = meta_obj[bug_id]['comments']
+        except requests.exceptions.RequestException as e:
+            if self.is_rejected(e) and len(bug_ids) > 1:
+                return self.fetch_halves(bug_ids, e)
+            logger.debug('Connection Error: recording {} failed ids, returning None'.format(len(bug_ids)))
+            logger.debug(str(e))
+            comment_map = None
+        except KeyError as e:
+            logger.warning('incorrect key: returning partial comments')
+            logger.debug(str(e))
+        missing = bug_ids if comment_map is None else set(bug_ids) - set(comment_map)
+        self.failed_ids.update(int(bug_id) for bug_id in missing)
+        return self.count_fetch(comment_map)
 
 
 class BugzillaHistoryApi(BugzillaApi):
+    kind = 'history'
+    # Projections apply to the bug objects wrapping the history
+    required_fields = {'id', 'history'}
+
     @overrides
     def fetch(self, bug_id: int):
         history_list = []
         try:
-            response = requests.get(url=str(self) + f'/{bug_id}/history')
+            response = self.session.get(url=str(self) + f'/{bug_id}/history', params=self.fields,
+                                        timeout=self.timeout)
             response.raise_for_status()
-            history_list = response.json()['bugs'][0]['history']
+            history_list = response_json(response)['bugs'][0]['history']
         except requests.exceptions.RequestException as e:
-            logger.debug('Connection Error: returning None')
+            logger.debug(f'Connection Error: recording failed id {bug_id}, returning None')
             logger.debug(str(e))
+            self.failed_ids.add(int(bug_id))
+            history_list = None
         except KeyError as e:
             logger.warn('incorrect key: returning None')
             logger.debug(str(e))
         finally:
-            return history_list
-
-
-@dataclass
-class BugSaveMetadata:
-    bug_id: str = ''
-    year: int = -1
-    comment_ids: List[str] = field(default_factory=list)
-    edits: int = 0
-
-    @classmethod
-    def from_json(cls: 'BugSaveMetadata', json_str: str):
-        bug_dict = json.loads(json_str)
-
-        # Temporary workaround for backward compatiability
-        edits = bug_dict['edits'] if 'edits' in bug_dict else 0
-        return cls(str(bug_dict['bug_id']), bug_dict['year'], bug_dict['comment_ids'], edits)
+            return self.count_fetch(history_list)
+
+    def fetch_many(self, bug_ids: Iterable[int]) -> Optional[Dict[str, List[Any]]]:
+        """
+        Fetch history of several bugs in one request using the ids parameter
+        Returns a mapping from bug id to its history, bugs missing in the response are recorded as failed
+        """
+        bug_ids = [str(bug_id) for bug_id in bug_ids]
+        if not bug_ids:
+            return {}
+        history_map = {}
+        try:
+            response = self.session.get(url=str(self) + f'/{bug_ids[0]}/history',
+                                        params={'ids': bug_ids[1:], **self.fields}, timeout=self.timeout)
+            response.raise_for_status()
+            for bug in response_json(response)['bugs']:
+                history_map[str(bug['id'])] = bug['history']
+        except requests.exceptions.RequestException as e:
+            if self.is_rejected(e) and len(bug_ids) > 1:
+                return self.fetch_halves(bug_ids, e)
+            logger.debug('Connection Error: recording {} failed ids, returning None'.format(len(bug_ids)))
+            logger.debug(str(e))
+            history_map = None
+        except KeyError as e:
+            logger.warning('incorrect key: returning partial history')
+            logger.debug(str(e))
+        missing = bug_ids if history_map is None else set(bug_ids) - set(history_map)
+        self.failed_ids.update(int(bug_id) for bug_id in missing)
+        return self.count_fetch(history_map)
 
 
 class Saver(object):
-    def __init__(self, save_dir):
+    # Changed bugs after which their metadata is appended to the log while saving
+    metadata_flush_size = 10000
+
+    def __init__(self, save_dir, backend: str = 'jsonl', compression: str = 'none',
+                 partitioning: Optional[Partitioning] = None, max_open: int = 64):
         os.makedirs(save_dir, exist_ok=True)
         self.save_dir = save_dir
-        self.bug_metadata: List[BugSaveMetadata] = []
-        self.fileobjs = {}
+        self.bug_metadata = MetadataStore()
+        self.storage = backends[backend](save_dir, compression, partitioning, max_open)
 
     def load_metadata(self):
         metadata_path = PurePath(self.save_dir, 'bug_metadata.jsonl')
-        with open(metadata_path) as mf:
-            for line in mf:
-                self.bug_metadata.append(BugSaveMetadata.from_json(line))
+        self.bug_metadata.load(metadata_path)
         logger.info('Loaded Metadata')
         return self.bug_metadata
 
-    def save_metadata(self):
+    # Appends changed records to the metadata log, compact rewrites it with one line per bug
+    def save_metadata(self, compact: bool = False):
+        metadata_path = PurePath(self.save_dir, 'bug_metadata.jsonl')
+        if compact:
+            self.bug_metadata.save(metadata_path)
+            logger.info('Saved Metadata to file: {}'.format(metadata_path))
+        else:
+            changed = len(self.bug_metadata.dirty)
+            self.bug_metadata.flush(metadata_path)
+            logger.debug(f'Appended metadata of {changed} bugs to file: {metadata_path}')
+
+    # Streams metadata to its log as bugs are saved. Records are flushed first so that the
+    # log never refers to records that did not reach the disk, and a resume truncates both
+    def maybe_save_metadata(self):
+        if len(self.bug_metadata.dirty) >= self.metadata_flush_size:
+            self.flush()
+            self.save_metadata()
+
+    def flush(self):
+        with metrics.timer('flush_seconds'):
+            self.storage.flush()
+
+    # Storage positions and the metadata log size, only meaningful right after flush and save_metadata
+    def offsets(self) -> Dict[str, int]:
+        offsets = self.storage.offsets()
         metadata_path = PurePath(self.save_dir, 'bug_metadata.jsonl')
-        with open(metadata_path, 'w') as mf:
-            for meta in self.bug_metadata:
-                mf.write(json.dumps(asdict(meta)) + '\n')
+        if os.path.exists(metadata_path):
+            offsets[metadata_path.name] = os.path.getsize(metadata_path)
+        return offsets
+
+    # Drops anything written after the given offsets, used to resume from a checkpoint. Metadata
+    # appended to the log since then refers to dropped records, so the log is cut and reloaded too
+    def truncate(self, offsets: Dict[str, int]):
+        offsets = dict(offsets)
+        metadata_path = PurePath(self.save_dir, 'bug_metadata.jsonl')
+        metadata_size = offsets.pop(metadata_path.name, None)
+        self.storage.truncate(offsets)
+        if metadata_size is None or not os.path.exists(metadata_path):
+            return
+        if os.path.getsize(metadata_path) > metadata_size:
+            os.truncate(metadata_path, metadata_size)
+            self.bug_metadata = MetadataStore()
+            self.load_metadata()
 
-        logger.info('Saved Metadata to file: {}'.format(metadata_path))
+    def save_projection(self, kind: str, projection: FieldProjection):
+        """
+        Record the fields requested for kind, warning when earlier records were saved with other fields
+        """
+        projections = FieldProjection.load_all(self.save_dir)
+        previous = projections.get(kind)
+        if previous is not None and previous != projection:
+            logger.warning(f'Saving {kind} with {projection}, earlier records were saved with {previous}')
+        projections[kind] = projection
+        FieldProjection.save_all(self.save_dir, projections)
+
+    def load_failed(self, kind: str) -> List[int]:
+        failed_path = PurePath(self.save_dir, f'failed_{kind}.jsonl')
+        if not os.path.exists(failed_path):
+            return []
+        with open(failed_path) as ff:
+            return [loads(line) for line in ff]
+
+    # Overwrites the failed id record of kind, removing it once nothing is left to replay
+    def save_failed(self, kind: str, bug_ids: Iterable[int]):
+        failed_path = PurePath(self.save_dir, f'failed_{kind}.jsonl')
+        bug_ids = sorted(bug_ids)
+        if not bug_ids:
+            if os.path.exists(failed_path):
+                os.remove(failed_path)
+            return
+        with open(failed_path, 'w') as ff:
+            for bug_id in bug_ids:
+                ff.write(dumps(bug_id) + '\n')
+        logger.warning('Recorded {} failed ids to file: {}'.format(len(bug_ids), failed_path))
+
+    # Writes the comments or history of the bug at meta_idx and records them in its metadata
+    def save_records(self, kind: str, meta_idx: int, records: List[Any]):
+        bug_id = self.bug_metadata.bug_ids[meta_idx]
+        year, month = self.bug_metadata.years[meta_idx], self.bug_metadata.months[meta_idx]
+        with metrics.timer('disk_write_seconds', kind=kind):
+            self.storage.write(kind, year, bug_id, records, month)
+        metrics.inc('records_written_total', kind=kind)
+        if kind == 'comments':
+            self.bug_metadata.set_comment_ids(meta_idx, (comment['id'] for comment in records))
+        else:
+            self.bug_metadata.set_edits(meta_idx, len(records))
+        self.maybe_save_metadata()
+
+    def rebuild_metadata(self, kinds: Iterable[str] = KINDS, workers: int = None):
+        """
+        Rebuild the bug metadata from the stored records of kinds, bugs have to come first
+        Only the fields kept in the metadata are extracted, json lines files are scanned in parallel
+        """
+        for kind in kinds:
+            for year, bug_id, summary in self.storage.scan(kind, workers):
+                if kind == 'bugs':
+                    self.bug_metadata.append(BugSaveMetadata(str(bug_id), year, [], 0, summary or 0))
+                    continue
+                idx = self.bug_metadata.index_of(bug_id)
+                if idx is None:
+                    logger.debug(f'Skipping {kind} of unknown bug {bug_id}')
+                elif kind == 'comments':
+                    self.bug_metadata.set_comment_ids(idx, summary)
+                else:
+                    self.bug_metadata.set_edits(idx, summary)
+        return self.bug_metadata
 
     # Returns the bug metadata post simple checks
     def collect_bug_metadata(self):
-        for path, directories, files in os.walk(self.save_dir):
-            for filename in files:
-                match = file_regex.match(filename)
-                if match:
-                    year = int(match.group(1))
-                    # Now open the file for reading
-
-                    filepath = os.path.join(self.save_dir, filename)
-                    with open(filepath) as bf:
-                        for line in bf:
-                            bug = json.loads(line)
-                            self.bug_metadata.append(BugSaveMetadata(str(bug['id']), year, [], 0))
-        return self.bug_metadata
+        return self.rebuild_metadata(['bugs'])
 
     def __del__(self):
-        for _, fileobj in self.fileobjs.items():
-            fileobj.close()
+        self.storage.close()
 
 
 class BugSaver(Saver):
     """
-    Bug Saver utility that saves bug by years in json lines format
-    "TODO: Allow more granularity in file access"
+    Bug Saver utility that saves bugs in json lines files partitioned by creation time or id range
+    Partition files are opened on the first bug they get
     """
-    def __init__(self, save_dir, years: Iterable[int]):
-        super().__init__(save_dir)
+    def __init__(self, save_dir, backend: str = 'jsonl', compression: str = 'none',
+                 partitioning: Optional[Partitioning] = None, max_open: int = 64):
+        super().__init__(save_dir, backend, compression, partitioning, max_open)
 
         # Check if metadata exists
         try:
@@ -167,32 +549,28 @@ class BugSaver(Saver):
         except Exception as e:
             logger.debug('Metadata does not exist: {}'.format(e))
 
-        logger.info(f'Opening {len(years)} files for saving bugs')
-        for year in years:
-            filepath = os.path.join(self.save_dir, str(year) + '.jsonl')
-            self.fileobjs[year] = open(filepath, 'a')
+        self.storage.open('bugs')
 
     def save(self, bug_list: Iterable[int]):
         for bug in bug_list:
             try:
-                creation_year = int(bug['creation_time'].split('-')[0])
-                self.fileobjs[creation_year].write(json.dumps(bug) + '\n')
-                self.bug_metadata.append(BugSaveMetadata(str(bug['id']), creation_year, []))
+                year, month = creation_month(bug)
+                with metrics.timer('disk_write_seconds', kind='bugs'):
+                    self.storage.write('bugs', year, bug['id'], bug, month)
+                metrics.inc('records_written_total', kind='bugs')
+                self.bug_metadata.append(BugSaveMetadata(str(bug['id']), year, [], 0, month))
             except KeyError as e:
                 logger.debug(str(e))
-
-
-# Regex to capture year name in file
-file_regex = re.compile(r'^((?:19|20)\d{2}).jsonl$')
+        self.maybe_save_metadata()
 
 
 class CommentSaver(Saver):
     """
-    Comment Saver utility that saves bug by years in json lines format
-    "TODO: Allow more granularity in file access"
+    Comment Saver utility that saves comments in the partition of their bug in json lines format
     """
-    def __init__(self, save_dir):
-        super().__init__(save_dir)
+    def __init__(self, save_dir, backend: str = 'jsonl', compression: str = 'none',
+                 partitioning: Optional[Partitioning] = None, max_open: int = 64):
+        super().__init__(save_dir, backend, compression, partitioning, max_open)
 
         # Check if metadata exists
         try:
@@ -202,28 +580,19 @@ class CommentSaver(Saver):
             logger.debug('Loading Metadata from bug files')
             self.collect_bug_metadata()
 
-        years = [metadata.year for metadata in self.bug_metadata]
-        years = list(set(years))
-        logger.info(f'Opening {len(years)} files for saving comments')
-        for year in years:
-            filepath = os.path.join(self.save_dir, str(year) + '_comments.jsonl')
-            self.fileobjs[year] = open(filepath, 'a')
+        self.storage.open('comments')
 
     def save(self, meta_idx: int, comments: List[Any]):
-        bug = self.bug_metadata[meta_idx]
-        cdict = {bug.bug_id: comments}
-        self.fileobjs[bug.year].write(json.dumps(cdict) + '\n')
-        comment_ids = [str(comment['id']) for comment in comments]
-        self.bug_metadata[meta_idx].comment_ids = comment_ids
+        self.save_records('comments', meta_idx, comments)
 
 
 class HistorySaver(Saver):
     """
-    Comment Saver utility that saves bug by years in json lines format
-    "TODO: Allow more granularity in file access"
+    History Saver utility that saves history in the partition of their bug in json lines format
     """
-    def __init__(self, save_dir):
-        super().__init__(save_dir)
+    def __init__(self, save_dir, backend: str = 'jsonl', compression: str = 'none',
+                 partitioning: Optional[Partitioning] = None, max_open: int = 64):
+        super().__init__(save_dir, backend, compression, partitioning, max_open)
 
         # Check if metadata exists
         try:
@@ -233,15 +602,19 @@ class HistorySaver(Saver):
             logger.debug('Loading Metadata from bug files')
             self.collect_bug_metadata()
 
-        years = [metadata.year for metadata in self.bug_metadata]
-        years = list(set(years))
-        logger.info(f'Opening {len(years)} files for saving history')
-        for year in years:
-            filepath = os.path.join(self.save_dir, str(year) + '_history.jsonl')
-            self.fileobjs[year] = open(filepath, 'a')
+        self.storage.open('history')
 
     def save(self, meta_idx: int, history: List[Any]):
-        bug = self.bug_metadata[meta_idx]
-        hdict = {bug.bug_id: history}
-        self.fileobjs[bug.year].write(json.dumps(hdict) + '\n')
-        self.bug_metadata[meta_idx].edits = len(history)
+        self.save_records('history', meta_idx, history)
+
+
+class ScrapeSaver(BugSaver):
+    """
+    Saver for bugs together with their comments and history
+    All kinds share one metadata store and storage, so nothing is re-read between them
+    """
+    def __init__(self, save_dir, backend: str = 'jsonl', compression: str = 'none',
+                 partitioning: Optional[Partitioning] = None, max_open: int = 64):
+        super().__init__(save_dir, backend, compression, partitioning, max_open)
+        self.storage.open('comments')
+        self.storage.open('history')
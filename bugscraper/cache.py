@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""On-disk cache of Bugzilla REST responses."""
+import os
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+
+logger = logging.getLogger('bugscraper')
+
+
+@dataclass
+class CachedResponse:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body: bytes
+
+
+class ResponseCache(object):
+    """
+    SQLite store of GET response bodies keyed by request url, which holds the endpoint and bug ids
+    Bodies are kept compressed and the least recently used responses are evicted once the
+    cache grows beyond max_bytes. In offline mode apis answer from the cache only.
+    """
+    def __init__(self, path, max_bytes: int = 1024 * 1024 * 1024, offline: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses '
+            '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body BLOB, size INTEGER, used REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT etag, last_modified, body FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            # Committed together with the next put
+            self.conn.execute('UPDATE responses SET used = ? WHERE url = ?', (time.time(), url))
+            self.hits += 1
+        etag, last_modified, body = row
+        return CachedResponse(etag, last_modified, zlib.decompress(body))
+
+    def put(self, url: str, body: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        body = zlib.compress(body)
+        with self.lock:
+            row = self.conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.size += len(body) - (row[0] if row else 0)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (url, etag, last_modified, body, len(body), time.time())
+            )
+            if self.size > self.max_bytes:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        """
+        Drop least recently used responses until the cache is back under 90% of max_bytes
+        """
+        target = 0.9 * self.max_bytes
+        evicted = 0
+        while self.size > target:
+            rows = self.conn.execute('SELECT url, size FROM responses ORDER BY used LIMIT 1000').fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                if self.size <= target:
+                    break
+                self.conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+                self.size -= size
+                evicted += 1
+        logger.debug(f'Evicted {evicted} cached responses')
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.commit()
+                self.conn.close()
+                self.conn = None
+        logger.info(f'Response cache: {self.hits} hits, {self.misses} misses')
@@ -1,18 +1,45 @@
 # -*- coding: utf-8 -*-
 
 """Console script for bugscraper."""
+import os
 import sys
+import time
 import click
 import logging
+import requests
+import functools
+import dataclasses
 from pathlib import Path
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+from datetime import datetime, timezone
 from bugscraper.log import configure_logger
 from bugscraper.bugscraper import BugzillaBugApi, BugSaver
 from bugscraper.bugscraper import BugzillaCommentApi, CommentSaver
 from bugscraper.bugscraper import BugzillaHistoryApi, HistorySaver
+from bugscraper.bugscraper import Saver, ScrapeSaver
+from bugscraper.engine import FetchEngine, AdaptiveChunker
+from bugscraper.discovery import SparseChunker, find_max_id
+from bugscraper.pipeline import ScrapePipeline
+from bugscraper.shard import Shard, shard_dirs, merge_shards
+from bugscraper.cache import ResponseCache
+from bugscraper.metrics import MetricsReporter, metrics
+from bugscraper.corpus import Corpus
+from bugscraper.compression import extensions
+from bugscraper.state import ScrapeState, Checkpoint
+from bugscraper.storage import backends, GRANULARITIES, KINDS, JsonlBackend, Partitioning
+from bugscraper.storage import recorded_partitioning
+from bugscraper.metadata import BugSaveMetadata, MetadataStore
+from bugscraper.serialization import dumps
+from bugscraper.filtering import BugFilter, filter_partitions
+from bugscraper import export as exporter
 from bugscraper import utils
 from tqdm import tqdm
 
 
+logger = logging.getLogger('bugscraper')
+
+
 @click.option(
     '-v', '--verbose',
     count=True, help='verbosity level : v{WARN}, vv{INFO}, vvv{DEBUG}'
@@ -37,80 +64,620 @@ def main(verbose, debug_file):
     return 0
 
 
-year_maps = {
-    'kernel': range(2002, 2020),
-    'freebsd': range(1994, 2020),
-    'mozilla': range(1997, 2020),
-    'libreoffice': range(2010, 2020)
+# Default number of concurrent requests per subdomain
+concurrency_maps = {
+    'kernel': 4,
+    'freebsd': 4,
+    'mozilla': 8,
+    'libreoffice': 4
 }
 
 
+def get_workers(subdomain, workers):
+    if workers is not None:
+        return workers
+    return concurrency_maps.get(subdomain, 4)
+
+
+def parse_fields(ctx, param, value):
+    if value is None:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def parse_kind_fields(ctx, param, values):
+    fields = {}
+    for value in values:
+        kind, sep, names = value.partition(':')
+        if not sep or kind not in KINDS:
+            raise click.BadParameter(f'Expected KIND:FIELDS with KIND one of {", ".join(KINDS)}, got {value}')
+        fields[kind] = parse_fields(ctx, param, names)
+    return fields
+
+
+def parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return Shard.parse(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def option_group(param: str, config, *options):
+    """
+    Decorator adding options to a command, their values reach the command as one config object named param
+    Like single options it goes above the command decorator, groups can be stacked
+    """
+    names = [config_field.name for config_field in dataclasses.fields(config)]
+
+    def decorate(command: click.Command) -> click.Command:
+        callback = command.callback
+
+        @functools.wraps(callback)
+        def grouped(*args, **kwargs):
+            kwargs[param] = config(**{name: kwargs.pop(name) for name in names})
+            return callback(*args, **kwargs)
+
+        command.callback = grouped
+        # Options applied to a command are listed in reverse, like a stack of single options
+        for option in reversed(options):
+            option(command)
+        return command
+    return decorate
+
+
+@dataclass
+class NetworkOptions:
+    """
+    How the scrape commands talk to the host
+    """
+    retries: int
+    rate: Optional[float]
+    burst: Optional[int]
+    cache: Optional[str]
+    cache_size: int
+    offline: bool
+
+    def open_cache(self) -> Optional[ResponseCache]:
+        """
+        Open the response cache for the current command, closing it when the command ends
+        """
+        if self.cache is None:
+            if self.offline:
+                raise click.UsageError('--offline needs a response cache passed with --cache')
+            return None
+        cache = ResponseCache(self.cache, self.cache_size * 1024 * 1024, self.offline)
+        click.get_current_context().call_on_close(cache.close)
+        return cache
+
+    def api_options(self, workers: int, cache: Optional[ResponseCache]) -> Dict[str, Any]:
+        return dict(pool_size=workers, retries=self.retries, rate=self.rate, burst=self.burst, cache=cache)
+
+
+@dataclass
+class StorageOptions:
+    """
+    How the scrape commands store records
+    """
+    compression: str
+    backend: str
+    partition: Optional[str]
+    id_range_size: int
+    max_open_files: int
+
+    def get_partitioning(self, save_dir) -> Optional[Partitioning]:
+        """
+        Partitioning asked for with --partition, None to keep the one of the save directory
+        """
+        if self.partition is None:
+            return None
+        partitioning = Partitioning(self.partition, self.id_range_size)
+        recorded = recorded_partitioning(save_dir)
+        if recorded is not None and recorded != partitioning:
+            raise click.UsageError(f'{save_dir} is already partitioned by {recorded.granularity}, '
+                                   f'scrape into another directory to change it')
+        return partitioning
+
+    def open_saver(self, saver_cls, save_dir):
+        return saver_cls(save_dir, self.backend, self.compression, self.get_partitioning(save_dir),
+                         self.max_open_files)
+
+
+@dataclass
+class RunOptions:
+    """
+    Checkpointing, sharding and metrics of a scrape command run
+    """
+    resume: bool
+    checkpoint_interval: int
+    shard: Optional[Shard]
+    stats_file: Optional[str]
+    prometheus_file: Optional[str]
+    stats_interval: int
+
+    def start_metrics(self) -> MetricsReporter:
+        """
+        Write the metrics of the current command periodically and print a summary when it ends
+        """
+        metrics.reset()
+        reporter = MetricsReporter(metrics, self.stats_file, self.prometheus_file, self.stats_interval)
+        reporter.start()
+
+        def stop():
+            reporter.stop()
+            for line in metrics.summary():
+                click.echo(line, err=True)
+
+        click.get_current_context().call_on_close(stop)
+        return reporter
+
+
+@dataclass
+class FieldOptions:
+    """
+    Field projection of the scrape commands, per kind for the scrape command
+    """
+    include_fields: Any
+    exclude_fields: Any
+
+
+network_options = option_group(
+    'network', NetworkOptions,
+    click.option('--retries', default=5, help='Retries per request on connection errors and 429/5xx'),
+    click.option('--rate', type=float, help='Requests per second to the host, slowed down on 429/503'),
+    click.option('--burst', type=click.IntRange(1), help='Requests allowed at once above --rate'),
+    click.option('--cache', type=click.Path(), help='SQLite file caching responses between runs'),
+    click.option('--cache-size', default=1024, help='Megabytes kept in the response cache'),
+    click.option('--offline', is_flag=True, help='Answer requests from the response cache only')
+)
+
+storage_options = option_group(
+    'storage', StorageOptions,
+    click.option('--compression', type=click.Choice(sorted(extensions)), default='none',
+                 help='Compress json lines files, zstd falls back to gzip without zstandard'),
+    click.option('--backend', type=click.Choice(sorted(backends)), default='jsonl', help='Record storage'),
+    click.option('--partition', type=click.Choice(GRANULARITIES),
+                 help='Split year files by month or id range, defaults to the split of the save directory'),
+    click.option('--id-range-size', default=100000, help='Bug ids per file with --partition id-range'),
+    click.option('--max-open-files', default=64, help='Json lines files kept open at once')
+)
+
+run_options = option_group(
+    'run', RunOptions,
+    click.option('--resume', is_flag=True, help='Continue from the checkpoint of an interrupted run'),
+    click.option('--checkpoint-interval', default=300, help='Seconds between checkpoints'),
+    click.option('--shard', callback=parse_shard,
+                 help='Only scrape shard k/N of the ids, written to shard-k-of-N in the save directory'),
+    click.option('--stats-file', type=click.Path(), help='Json file of the run metrics'),
+    click.option('--prometheus-file', type=click.Path(), help='Prometheus textfile of the run metrics'),
+    click.option('--stats-interval', default=60, help='Seconds between writes of the metrics files')
+)
+
+field_options = option_group(
+    'fields', FieldOptions,
+    click.option('--include-fields', callback=parse_fields,
+                 help='Comma separated fields to request, the ones the scraper needs are always kept'),
+    click.option('--exclude-fields', callback=parse_fields,
+                 help='Comma separated fields left out of responses')
+)
+
+kind_field_options = option_group(
+    'fields', FieldOptions,
+    click.option('--include-fields', multiple=True, callback=parse_kind_fields,
+                 help='KIND:FIELDS to request for a record kind, can be repeated'),
+    click.option('--exclude-fields', multiple=True, callback=parse_kind_fields,
+                 help='KIND:FIELDS left out of responses for a record kind, can be repeated')
+)
+
+
+def discover_fin_id(api, init_id):
+    """
+    Find the id after the largest bug of the host, for ranges given without --fin-id
+    """
+    try:
+        max_id = find_max_id(api, init_id)
+    except requests.exceptions.RequestException as e:
+        raise click.ClickException(f'Discovering the largest bug id failed, pass --fin-id: {e}')
+    if max_id is None:
+        raise click.ClickException(f'No bugs found from id {init_id}, pass --fin-id')
+    return max_id + 1
+
+
 @click.argument('subdomain')
 @click.option('--save-dir', '-s', type=click.Path(), default='.')
 @click.option('--init-id', '-i', default=1)
-@click.option('--fin-id', '-f', default=200000)
-@click.option('--syo', type=click.IntRange(2000, 2020), help='Starting Year range override')
-@click.option('--eyo', type=click.IntRange(2000, 2020), help='Ending Year range override')
+@click.option('--fin-id', '-f', type=int, help='Id the range stops before, found from the host by default')
 @click.option('--chunk-size', '-c', default=1000)
+@click.option('--workers', '-w', type=click.IntRange(1), help='Concurrent requests, defaults per subdomain')
+@click.option('--replay', is_flag=True, help='Only fetch ids recorded as failed by a previous run')
+@click.option('--adaptive', is_flag=True, help='Adapt the chunk size to response latency and failures')
+@click.option('--max-chunk-size', default=10000, help='Largest chunk size used with --adaptive')
+@click.option('--target-latency', default=10.0, help='Response time in seconds targeted by --adaptive')
+@click.option('--sparse', is_flag=True, help='Sample ahead after runs of empty chunks, skipping empty ranges')
+@click.option('--empty-chunks', default=5, help='Empty chunks in a row after which --sparse samples ahead')
+@click.option('--sample-size', default=100, help='Ids fetched by --sparse out of every 10 chunks sampled')
+@click.option('--incremental', is_flag=True, help='Only fetch bugs changed since the last recorded change')
+@network_options
+@storage_options
+@run_options
+@field_options
 @main.command()
-def bugscrape(subdomain, save_dir, init_id, fin_id, syo, eyo, chunk_size):
+def bugscrape(subdomain, save_dir, init_id, fin_id, chunk_size, workers, replay, adaptive, max_chunk_size,
+              target_latency, sparse, empty_chunks, sample_size, incremental, network, storage, run, fields):
+    if adaptive and sparse:
+        raise click.UsageError('--adaptive and --sparse cannot be combined')
     save_dir = Path(save_dir, subdomain + 'bugs')
-    bug_range = range(init_id, fin_id)
-    bug_chunks = list(utils.divide_chunks(bug_range, chunk_size))
-    api = BugzillaBugApi(subdomain)
-    if syo is not None and eyo is not None:
-        saver = BugSaver(save_dir, range(syo, eyo + 1))
+    shard = run.shard
+    if shard is not None:
+        save_dir = shard.save_dir(save_dir)
+    workers = get_workers(subdomain, workers)
+    run.start_metrics()
+    cache = network.open_cache()
+    api = BugzillaBugApi(subdomain, **network.api_options(workers, cache), **asdict(fields))
+    saver = storage.open_saver(BugSaver, save_dir)
+    saver.save_projection('bugs', api.projection)
+
+    state = ScrapeState.load(save_dir)
+    if incremental and state.last_change_time is None:
+        raise click.UsageError(f'No high-water mark in {save_dir}, run a full bugscrape first')
+
+    checkpoint = load_checkpoint(saver, api, 'bugscrape', run)
+    started = datetime.now(timezone.utc)
+    if fin_id is None and not (replay or incremental):
+        fin_id = discover_fin_id(api, init_id)
+    bug_range = saver.load_failed('bugs') if replay else range(init_id, fin_id or init_id)
+    if shard is not None:
+        bug_range = shard.filter(bug_range)
+    if run.resume:
+        bug_range = [bug_id for bug_id in bug_range if not checkpoint.is_done(bug_id)]
+    engine = FetchEngine(workers)
+    if incremental:
+        logger.info(f'Fetching bugs changed since {state.last_change_time}')
+        bug_range = []
+        pages = api.fetch_changed(state.last_change_time, chunk_size)
+        results = ((bug_range, bug_list) for bug_list in pages)
+    elif adaptive:
+        chunker = AdaptiveChunker(bug_range, chunk_size, max_size=max_chunk_size,
+                                  target_latency=target_latency)
+        results = engine.run(lambda chunk: chunker.fetch(api, chunk), chunker)
+    elif sparse:
+        sparse_chunker = SparseChunker(bug_range, chunk_size, empty_chunks, sample_size=sample_size)
+        results = engine.run(lambda chunk: sparse_chunker.fetch(api, chunk), sparse_chunker)
+    else:
+        results = engine.run(api.fetch, utils.divide_chunks(bug_range, chunk_size))
+
+    pending_kinds = ('comments', 'history') if incremental else ()
+    try:
+        with tqdm(total=len(bug_range) or None, desc='Fetching and Saving bugs') as pbar:
+            for chunk, bug_list in results:
+                if bug_list is None:
+                    continue
+                if incremental:
+                    bug_list = [bug for bug in bug_list if not checkpoint.is_done(bug['id'])
+                                and (shard is None or shard.owns(bug['id']))]
+                saver.save(bug_list)
+                state.update(bug_list, pending_kinds)
+                checkpoint.add_done(chunk or [bug['id'] for bug in bug_list])
+                if checkpoint.maybe_save(saver, api.failed_ids):
+                    state.save(save_dir)
+                pbar.update(len(chunk) or len(bug_list))
+    except requests.exceptions.RequestException as e:
+        # The high-water mark is kept so the next incremental run fetches the missed changes again
+        checkpoint.save(saver, api.failed_ids)
+        state.save(save_dir)
+        raise click.ClickException(f'Fetching changed bugs failed: {e}')
+
+    # Also appends the metadata changed since the last flush, the rest already streamed to the log
+    checkpoint.save(saver, api.failed_ids)
+    # A range scrape does not refresh bugs outside the range, so only the first one sets the mark
+    if incremental or (not replay and state.last_change_time is None):
+        state.mark(started)
+    state.save(save_dir)
+    failed = utils.merge_failed(saver.load_failed('bugs'), bug_range, api.failed_ids)
+    saver.save_failed('bugs', failed)
+    checkpoint.remove(save_dir)
+    if sparse and not incremental:
+        logger.info(f'Skipped {sparse_chunker.skipped} ids in empty ranges')
+
+
+def load_checkpoint(saver, api, command, run):
+    """
+    Start a fresh checkpoint or restore the saver files and failed ids of an interrupted run
+    """
+    if not run.resume:
+        if os.path.exists(Checkpoint.path(saver.save_dir, command)):
+            logger.warning(f'Overwriting checkpoint of interrupted {command}, pass --resume to continue it')
+        checkpoint = Checkpoint(command)
     else:
-        saver = BugSaver(save_dir, year_maps[subdomain])
+        # An empty checkpoint would rescrape the whole range on top of the existing records
+        if not os.path.exists(Checkpoint.path(saver.save_dir, command)):
+            raise click.UsageError(f'No checkpoint of {command} to resume in {saver.save_dir}')
+        checkpoint = Checkpoint.load(saver.save_dir, command)
+        saver.truncate(checkpoint.offsets)
+        api.failed_ids.update(checkpoint.failed)
+    checkpoint.interval = run.checkpoint_interval
+    return checkpoint
+
+
+def scrape_bug_records(saver, api, kind, workers, replay, batch_size, incremental, run):
+    """
+    Fetch per bug records (comments or history) for every bug in the saver metadata
+    Fetches run concurrently while this function stays the single writer to the saver
+    """
+    saver.save_projection(kind, api.projection)
+    state = ScrapeState.load(saver.save_dir)
+    checkpoint = load_checkpoint(saver, api, kind, run)
+    meta_idxs = range(len(saver.bug_metadata))
+    if replay or incremental:
+        selected = set(saver.load_failed(kind)) if replay else set()
+        selected.update(state.pending.get(kind, []) if incremental else [])
+        meta_idxs = sorted(saver.bug_metadata.index_of(bug_id) for bug_id in selected
+                           if saver.bug_metadata.index_of(bug_id) is not None)
+    bug_ids = saver.bug_metadata.bug_ids
+    if run.resume:
+        meta_idxs = [idx for idx in meta_idxs if not checkpoint.is_done(bug_ids[idx])]
+
+    def fetch(idx_chunk):
+        chunk_ids = [bug_ids[idx] for idx in idx_chunk]
+        if batch_size > 1:
+            return api.fetch_many(chunk_ids)
+        return {str(chunk_ids[0]): api.fetch(chunk_ids[0])}
+
+    engine = FetchEngine(workers)
+    idx_chunks = list(utils.divide_chunks(meta_idxs, batch_size))
+    results = engine.run(fetch, idx_chunks)
+    with tqdm(total=len(meta_idxs), desc=f'Fetching and Saving {kind}') as pbar:
+        for idx_chunk, record_map in results:
+            for idx in idx_chunk:
+                records = (record_map or {}).get(str(bug_ids[idx]))
+                if records is not None:
+                    saver.save(idx, records)
+            checkpoint.add_done(bug_ids[idx] for idx in idx_chunk)
+            checkpoint.maybe_save(saver, api.failed_ids)
+            pbar.update(len(idx_chunk))
+
+    # Also appends the metadata changed since the last flush, the rest already streamed to the log
+    checkpoint.save(saver, api.failed_ids)
+    attempted = [bug_ids[idx] for idx in meta_idxs]
+    failed = utils.merge_failed(saver.load_failed(kind), attempted, api.failed_ids)
+    saver.save_failed(kind, failed)
+    if incremental:
+        state.clear_pending(kind, attempted)
+        state.save(saver.save_dir)
+    checkpoint.remove(saver.save_dir)
 
-    for chunk in tqdm(bug_chunks, desc='Fetching and Saving bug chunks of size {}'.format(len(bug_chunks))):
-        bug_list = api.fetch(chunk)
-        if bug_list is not None:
-            saver.save(bug_list)
 
-    saver.save_metadata()
+def record_command(kind, saver_cls, api_cls, subdomain, save_dir, workers, replay, batch_size, incremental,
+                   network, storage, run, fields):
+    """
+    Body of the commentscrape and historyscrape commands
+    """
+    save_dir = Path(save_dir, subdomain + 'bugs')
+    if run.shard is not None:
+        save_dir, parent_dir = run.shard.save_dir(save_dir), save_dir
+        run.shard.seed_metadata(parent_dir, save_dir)
+    workers = get_workers(subdomain, workers)
+    run.start_metrics()
+
+    saver = storage.open_saver(saver_cls, save_dir)
+    cache = network.open_cache()
+    api = api_cls(subdomain, **network.api_options(workers, cache), **asdict(fields))
+    scrape_bug_records(saver, api, kind, workers, replay, batch_size, incremental, run)
 
 
 @click.argument('subdomain')
 @click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--workers', '-w', type=click.IntRange(1), help='Concurrent requests, defaults per subdomain')
+@click.option('--replay', is_flag=True, help='Only fetch ids recorded as failed by a previous run')
+@click.option('--batch-size', '-b', default=1, help='Bugs per request, values above 1 use the ids parameter')
+@click.option('--incremental', is_flag=True, help='Only fetch bugs changed by the last incremental bugscrape')
+@network_options
+@storage_options
+@run_options
+@field_options
 @main.command()
-def commentscrape(subdomain, save_dir):
+def commentscrape(subdomain, save_dir, workers, replay, batch_size, incremental, network, storage, run,
+                  fields):
+    record_command('comments', CommentSaver, BugzillaCommentApi, subdomain, save_dir, workers, replay,
+                   batch_size, incremental, network, storage, run, fields)
+
+
+@click.argument('subdomain')
+@click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--workers', '-w', type=click.IntRange(1), help='Concurrent requests, defaults per subdomain')
+@click.option('--replay', is_flag=True, help='Only fetch ids recorded as failed by a previous run')
+@click.option('--batch-size', '-b', default=1, help='Bugs per request, values above 1 use the ids parameter')
+@click.option('--incremental', is_flag=True, help='Only fetch bugs changed by the last incremental bugscrape')
+@network_options
+@storage_options
+@run_options
+@field_options
+@main.command()
+def historyscrape(subdomain, save_dir, workers, replay, batch_size, incremental, network, storage, run,
+                  fields):
+    record_command('history', HistorySaver, BugzillaHistoryApi, subdomain, save_dir, workers, replay,
+                   batch_size, incremental, network, storage, run, fields)
+
+
+@click.argument('subdomain')
+@click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--init-id', '-i', default=1)
+@click.option('--fin-id', '-f', type=int, help='Id the range stops before, found from the host by default')
+@click.option('--chunk-size', '-c', default=1000)
+@click.option('--batch-size', '-b', default=1, help='Bugs per comment/history request')
+@click.option('--workers', '-w', type=click.IntRange(1), help='Concurrent requests per stage')
+@click.option('--max-pending', default=10000, help='Saved bugs allowed to wait for comments and history')
+@network_options
+@storage_options
+@run_options
+@kind_field_options
+@main.command()
+def scrape(subdomain, save_dir, init_id, fin_id, chunk_size, batch_size, workers, max_pending, network,
+           storage, run, fields):
+    """Fetch bugs, comments and history in a single pipelined pass."""
     save_dir = Path(save_dir, subdomain + 'bugs')
+    shard = run.shard
+    if shard is not None:
+        save_dir = shard.save_dir(save_dir)
+    workers = get_workers(subdomain, workers)
+    run.start_metrics()
+    saver = storage.open_saver(ScrapeSaver, save_dir)
+    cache = network.open_cache()
+    api_options = network.api_options(workers, cache)
+    projections = {
+        kind: dict(include_fields=fields.include_fields.get(kind),
+                   exclude_fields=fields.exclude_fields.get(kind))
+        for kind in KINDS
+    }
+    bug_api = BugzillaBugApi(subdomain, **api_options, **projections['bugs'])
+    record_apis = {
+        'comments': BugzillaCommentApi(subdomain, **api_options, **projections['comments']),
+        'history': BugzillaHistoryApi(subdomain, **api_options, **projections['history'])
+    }
+    for kind, api in [('bugs', bug_api)] + list(record_apis.items()):
+        saver.save_projection(kind, api.projection)
+    pipeline = ScrapePipeline(bug_api, record_apis, workers, batch_size, max_pending)
 
-    saver = CommentSaver(save_dir)
-    api = BugzillaCommentApi(subdomain)
+    state = ScrapeState.load(save_dir)
+    checkpoint = load_checkpoint(saver, bug_api, 'scrape', run)
+    for kind, api in record_apis.items():
+        api.failed_ids.update(checkpoint.failed_records.get(kind, []))
+    started = datetime.now(timezone.utc)
+    if fin_id is None:
+        fin_id = discover_fin_id(bug_api, init_id)
+    bug_range = range(init_id, fin_id) if shard is None else shard.filter(range(init_id, fin_id))
+    attempted = {kind: [] for kind in record_apis}
+    if run.resume:
+        # Bugs saved before the interruption only need the records they were still waiting for
+        resumed = set()
+        for kind, bug_ids in checkpoint.pending.items():
+            pipeline.submit(bug_ids, [kind])
+            attempted[kind].extend(bug_ids)
+            resumed.update(bug_ids)
+        bug_range = [bug_id for bug_id in bug_range
+                     if not checkpoint.is_done(bug_id) and bug_id not in resumed]
 
-    for idx, bug_info in enumerate(tqdm(saver.bug_metadata, desc='Fetching and Saving comments')):
-        comment_list = api.fetch(bug_info.bug_id)
-        if comment_list is not None:
-            saver.save(idx, comment_list)
+    def save_checkpoint():
+        checkpoint.pending = pipeline.pending()
+        checkpoint.failed_records = {kind: sorted(api.failed_ids) for kind, api in record_apis.items()}
+        checkpoint.save(saver, bug_api.failed_ids)
 
-    saver.save_metadata()
+    results = pipeline.run(utils.divide_chunks(bug_range, chunk_size))
+    with tqdm(total=len(bug_range), desc='Fetching and Saving bugs, comments and history') as pbar:
+        for kind, chunk, result in results:
+            if kind == 'bugs':
+                if result is None:
+                    pbar.update(len(chunk))
+                    continue
+                saver.save(result)
+                saved = [int(bug['id']) for bug in result
+                         if saver.bug_metadata.index_of(bug['id']) is not None]
+                pipeline.submit(saved)
+                for record_kind in record_apis:
+                    attempted[record_kind].extend(saved)
+                # Ids without a bug have nothing left to fetch
+                missing = set(chunk).difference(saved)
+                checkpoint.add_done(missing)
+                pbar.update(len(missing))
+            else:
+                for bug_id in chunk:
+                    records = (result or {}).get(str(bug_id))
+                    if records is not None:
+                        saver.save_records(kind, saver.bug_metadata.index_of(bug_id), records)
+                finished = pipeline.complete(kind, chunk)
+                checkpoint.add_done(finished)
+                pbar.update(len(finished))
+            if time.monotonic() - checkpoint.saved_at >= checkpoint.interval:
+                save_checkpoint()
+                state.save(save_dir)
+
+    save_checkpoint()
+    if state.last_change_time is None:
+        state.mark(started)
+    state.save(save_dir)
+    saver.save_failed('bugs', utils.merge_failed(saver.load_failed('bugs'), bug_range, bug_api.failed_ids))
+    for kind, api in record_apis.items():
+        saver.save_failed(kind, utils.merge_failed(saver.load_failed(kind), attempted[kind], api.failed_ids))
+    checkpoint.remove(save_dir)
 
 
 @click.argument('subdomain')
 @click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--compression', type=click.Choice(sorted(extensions)), default='none',
+              help='Compress json lines files, zstd falls back to gzip without zstandard')
+@click.option('--backend', type=click.Choice(sorted(backends)), default='jsonl', help='Record storage')
 @main.command()
-def historyscrape(subdomain, save_dir):
+def merge(subdomain, save_dir, compression, backend):
+    """Merge the output of every shard into the save directory without duplicates."""
     save_dir = Path(save_dir, subdomain + 'bugs')
+    sources = shard_dirs(save_dir) if os.path.isdir(save_dir) else []
+    if not sources:
+        raise click.UsageError(f'No shard directories found in {save_dir}')
+    logger.info(f'Merging {len(sources)} shards into {save_dir}')
+    counts = merge_shards(save_dir, sources, backend, compression)
+    click.echo(', '.join(f'{count} {kind}' for kind, count in counts.items()))
 
-    saver = HistorySaver(save_dir)
-    api = BugzillaHistoryApi(subdomain)
 
-    for idx, bug_info in enumerate(tqdm(saver.bug_metadata, desc='Fetching and Saving histories')):
-        comment_list = api.fetch(bug_info.bug_id)
-        if comment_list is not None:
-            saver.save(idx, comment_list)
+@click.argument('subdomain')
+@click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--workers', '-w', type=click.IntRange(1), help='Processes scanning files')
+@click.option('--backend', type=click.Choice(sorted(backends)), default='jsonl', help='Record storage')
+@main.command()
+def metagen(subdomain, save_dir, workers, backend):
+    """Rebuild bug_metadata.jsonl and the file indexes from the stored records."""
+    save_dir = Path(save_dir, subdomain + 'bugs')
+    saver = Saver(save_dir, backend)
+    saver.rebuild_metadata(KINDS, workers)
+    saver.save_metadata(compact=True)
+    logger.info(f'Rebuilt metadata of {len(saver.bug_metadata)} bugs')
 
-    saver.save_metadata()
+
+@click.argument('subdomain')
+@click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--workers', '-w', type=click.IntRange(1), help='Processes rebuilding the metadata')
+@click.option('--backend', type=click.Choice(sorted(backends)), default='jsonl', help='Record storage')
+@main.command()
+def compact(subdomain, save_dir, workers, backend):
+    """Keep only the newest record of every bug and rewrite bug_metadata.jsonl to match."""
+    save_dir = Path(save_dir, subdomain + 'bugs')
+    if not os.path.isdir(save_dir):
+        raise click.UsageError(f'No save directory at {save_dir}')
+    # Checkpoints hold file offsets that compaction invalidates
+    checkpoints = list(save_dir.glob('checkpoint_*.json'))
+    if checkpoints:
+        raise click.UsageError(f'Finish the interrupted scrape with --resume first, found {checkpoints[0]}')
+    saver = Saver(save_dir, backend)
+    counts = saver.storage.compact()
+    saver.rebuild_metadata(KINDS, workers)
+    saver.save_metadata(compact=True)
+    for kind, (kept, dropped) in counts.items():
+        click.echo(f'{kind}: kept {kept}, dropped {dropped}')
 
 
+@click.argument('bug_ids', nargs=-1, type=int)
 @click.argument('subdomain')
 @click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--year', type=int, help='Bugs created in this year when no ids are given')
+@click.option('--start', type=int, help='First bug id of the range when no ids are given')
+@click.option('--end', type=int, help='Bug id the range stops before when no ids are given')
+@click.option('--backend', type=click.Choice(sorted(backends)), default='jsonl', help='Record storage')
 @main.command()
-def metagen(save_dir):
-    save_dir = Path(save_dir, 'subdomain' + 'bugs')
-    CommentSaver(save_dir).save_metadata()
+def get(subdomain, bug_ids, save_dir, year, start, end, backend):
+    """Print stored bugs with their comments and history as json lines."""
+    save_dir = Path(save_dir, subdomain + 'bugs')
+    if not bug_ids and year is None and start is None and end is None:
+        raise click.UsageError('Pass bug ids, or select bugs with --year, --start or --end')
+    with Corpus(save_dir, backend) as corpus:
+        for bug_id in bug_ids:
+            bug = corpus.get(bug_id)
+            if bug is None:
+                logger.warning(f'Bug {bug_id} is not stored in {save_dir}')
+            else:
+                click.echo(dumps(asdict(bug)))
+        if not bug_ids:
+            for bug in corpus.bugs(year, start, end):
+                click.echo(dumps(asdict(bug)))
 
 
 @click.argument('metadata', type=click.Choice(['history', 'comments', 'all']))
@@ -120,7 +687,7 @@ def metagen(save_dir):
 def clean(metadata, subdomain, save_dir):
     logger = logging.getLogger('bugscraper')
     save_dir = Path(save_dir, subdomain + 'bugs')
-    glob = '*' if metadata == 'all' else f'**/*{metadata}.jsonl'
+    glob = '*' if metadata == 'all' else f'**/*{metadata}.jsonl*'
     for match in list(save_dir.glob(glob)):
         logger.info(f'Removing file {match}')
         match.unlink()
@@ -128,14 +695,62 @@ def clean(metadata, subdomain, save_dir):
 
 @click.argument('subdomain')
 @click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--out-dir', '-o', type=click.Path(), help='Defaults to <save_dir>/<subdomain>export')
+@click.option('--format', 'fmt', type=click.Choice(['parquet', 'arrow']), default='parquet')
+@click.option('--kind', '-k', type=click.Choice(['bugs', 'comments', 'history', 'all']), default='all')
+@click.option('--batch-size', '-b', default=10000, help='Rows held in memory per written batch')
+@click.option('--backend', type=click.Choice(sorted(backends)), default='jsonl', help='Record storage')
+@main.command()
+def export(subdomain, save_dir, out_dir, fmt, kind, batch_size, backend):
+    """Export scraped records to Parquet or Arrow IPC files partitioned by year."""
+    out_dir = out_dir or Path(save_dir, subdomain + 'export')
+    save_dir = Path(save_dir, subdomain + 'bugs')
+    storage = backends[backend](save_dir)
+    kinds = KINDS if kind == 'all' else [kind]
+    try:
+        for export_kind in kinds:
+            total = exporter.export(storage, export_kind, out_dir, fmt, batch_size)
+            logger.info(f'Exported {total} {export_kind} rows to {out_dir}')
+    except ImportError as e:
+        raise click.ClickException(str(e))
+    finally:
+        storage.close()
+
+
+@click.argument('subdomain')
+@click.option('--save-dir', '-s', type=click.Path(), default='.')
+@click.option('--product', '-p', multiple=True, help='Keep bugs of this product, can be repeated')
+@click.option('--component', multiple=True, help='Keep bugs of this component, can be repeated')
+@click.option('--status', multiple=True, help='Keep bugs with this status, can be repeated')
+@click.option('--resolution', multiple=True, help='Keep bugs with this resolution, can be repeated')
+@click.option('--created-after', help='Keep bugs created at or after this ISO 8601 time')
+@click.option('--created-before', help='Keep bugs created before this ISO 8601 time')
+@click.option('--changed-after', help='Keep bugs last changed at or after this ISO 8601 time')
+@click.option('--changed-before', help='Keep bugs last changed before this ISO 8601 time')
+@click.option('--workers', '-w', type=click.IntRange(1), help='Processes, defaults to the number of CPUs')
 @main.command()
-def filter(subdomain, save_dir):
+def filter(subdomain, save_dir, product, component, status, resolution, created_after, created_before,
+           changed_after, changed_before, workers):
+    """Filter scraped bugs into <subdomain>bugs_filtered, by default to Core and Firefox products."""
     base_save_dir = Path(save_dir, subdomain + 'bugs')
     filter_save_dir = Path(save_dir, subdomain + 'bugs_filtered')
-    saver = BugSaver(filter_save_dir, year_maps[subdomain])
-    for bug in tqdm(utils.mozilla_filter(base_save_dir), desc='Filtering Bugs'):
-        saver.save([bug])
-    saver.save_metadata()
+    values = {'product': product, 'component': component, 'status': status, 'resolution': resolution}
+    bug_filter = BugFilter(values, created_after, created_before, changed_after, changed_before)
+    if not bug_filter.values and not any([created_after, created_before, changed_after, changed_before]):
+        bug_filter = BugFilter({'product': ['Core', 'Firefox']})
+
+    partitions = JsonlBackend(base_save_dir).partitions('bugs')
+    metadata = MetadataStore()
+    results = filter_partitions(bug_filter, partitions, filter_save_dir, workers)
+    for year, bugs in tqdm(results, total=len(partitions), desc='Filtering Bugs'):
+        for bug_id, month in bugs:
+            metadata.append(BugSaveMetadata(str(bug_id), year, [], 0, month))
+    # Later comment and history scrapes into the filtered directory write files partitioned like the source
+    partitioning = recorded_partitioning(base_save_dir)
+    if partitioning is not None:
+        partitioning.save(filter_save_dir)
+    metadata.save(Path(filter_save_dir, 'bug_metadata.jsonl'))
+    logger.info(f'Kept {len(metadata)} bugs in {filter_save_dir}')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Compressed json lines files written as independently decompressible frames."""
+import io
+import os
+import gzip
+import struct
+import logging
+from typing import IO, List, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# File extension of every supported compression
+extensions = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Uncompressed bytes buffered into one frame
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Entries of the .frames sidecar, compressed offset and length of a frame
+FRAME_ENTRY = struct.Struct('<qq')
+
+
+def resolve(compression: str) -> str:
+    """
+    Return the compression to write with, falling back to gzip when zstandard is not installed
+    """
+    if compression == 'zstd' and zstandard is None:
+        logger.warning('zstandard is not installed, compressing with gzip instead')
+        return 'gzip'
+    return compression
+
+
+def compression_of(path) -> str:
+    path = str(path)
+    for compression, extension in extensions.items():
+        if extension and path.endswith(extension):
+            return compression
+    return 'none'
+
+
+def plain_path(path) -> str:
+    """
+    Return path without its compression extension
+    """
+    path = str(path)
+    return path[:len(path) - len(extensions[compression_of(path)])]
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3, write_content_size=True).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def open_binary(path) -> IO[bytes]:
+    """
+    Open a possibly compressed json lines file for reading lines as bytes
+    """
+    compression = compression_of(path)
+    if compression == 'none':
+        return open(path, 'rb')
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if zstandard is None:
+        raise ImportError(f'Reading {path} requires zstandard, install it with pip install zstandard')
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+    return io.BufferedReader(reader)
+
+
+def frames(path) -> List[Tuple[int, int]]:
+    """
+    Return the (offset, length) of every frame of a compressed file from its .frames sidecar
+    Frames can be decompressed independently, for example by several processes at once
+    """
+    with open(str(path) + '.frames', 'rb') as ff:
+        return list(FRAME_ENTRY.iter_unpack(ff.read()))
+
+
+def read_frame(path, offset: int, length: int) -> bytes:
+    with open(path, 'rb') as cf:
+        cf.seek(offset)
+        return decompress(cf.read(length), compression_of(path))
+
+
+class FramedWriter(object):
+    """
+    Append only text file that compresses buffered lines into frames of about block_size bytes
+    A frame always ends with a complete line, flush closes the current frame so that tell and
+    truncate work on frame boundaries like on a plain file
+    """
+    def __init__(self, path, compression: str, block_size: int = BLOCK_SIZE):
+        self.name = str(path)
+        self.compression = compression
+        self.block_size = block_size
+        self.fileobj = open(self.name, 'ab')
+        self.frameobj = open(self.name + '.frames', 'ab')
+        self.buffer: List[bytes] = []
+        self.buffered = 0
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self.write_frame()
+
+    def write_frame(self):
+        if not self.buffer:
+            return
+        data = compress(b''.join(self.buffer), self.compression)
+        self.frameobj.write(FRAME_ENTRY.pack(self.fileobj.tell(), len(data)))
+        self.fileobj.write(data)
+        self.buffer = []
+        self.buffered = 0
+
+    def flush(self):
+        self.write_frame()
+        self.fileobj.flush()
+        self.frameobj.flush()
+        os.fsync(self.frameobj.fileno())
+
+    def fileno(self) -> int:
+        return self.fileobj.fileno()
+
+    def tell(self) -> int:
+        return self.fileobj.tell()
+
+    def truncate(self, size: int):
+        self.buffer = []
+        self.buffered = 0
+        self.fileobj.truncate(size)
+        self.frameobj.flush()
+        kept = sum(1 for offset, _ in frames(self.name) if offset < size)
+        self.frameobj.truncate(kept * FRAME_ENTRY.size)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        self.fileobj.seek(offset, whence)
+        self.frameobj.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.write_frame()
+        self.fileobj.close()
+        self.frameobj.close()
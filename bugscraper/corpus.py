@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Random access reads of scraped bugs, comments and history."""
+import os
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from bugscraper.storage import backends
+
+
+logger = logging.getLogger('bugscraper')
+
+
+@dataclass
+class CorpusBug:
+    bug: Dict[str, Any]
+    comments: List[Dict[str, Any]] = field(default_factory=list)
+    history: List[Dict[str, Any]] = field(default_factory=list)
+
+
+class Corpus(object):
+    """
+    Read only view of a save directory
+    Json lines files are read through their .idx indexes, which are built or brought up to date the
+    first time a file is read, so a bug is found with a binary search per file instead of a scan
+    """
+    def __init__(self, save_dir, backend: str = 'jsonl'):
+        if not os.path.isdir(save_dir):
+            raise FileNotFoundError(f'No save directory at {save_dir}')
+        self.save_dir = save_dir
+        self.storage = backends[backend](save_dir)
+
+    def __enter__(self) -> 'Corpus':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, bug_id: int) -> Optional[CorpusBug]:
+        """
+        Return a bug with its comments and history, None if the bug is not stored
+        """
+        bug = self.storage.get('bugs', bug_id)
+        if bug is None:
+            return None
+        return self.attach(bug_id, bug)
+
+    def attach(self, bug_id: int, bug: Dict[str, Any]) -> CorpusBug:
+        return CorpusBug(
+            bug,
+            self.storage.get('comments', bug_id) or [],
+            self.storage.get('history', bug_id) or []
+        )
+
+    def records(self, kind: str, year: int = None, start: int = None, end: int = None) -> Iterator[Any]:
+        """
+        Yield the records of kind created in year with bug ids in [start, end), in id order per year
+        """
+        for _, _, record in self.storage.select(kind, year, start, end):
+            yield record
+
+    def bugs(self, year: int = None, start: int = None, end: int = None) -> Iterator[CorpusBug]:
+        """
+        Yield the bugs created in year with bug ids in [start, end) along with their comments and history
+        """
+        for _, bug_id, bug in self.storage.select('bugs', year, start, end):
+            yield self.attach(bug_id, bug)
+
+    def close(self):
+        self.storage.close()
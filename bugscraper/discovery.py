@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""Discovery of the bug id space and skipping of sparse id ranges."""
+import logging
+import threading
+from typing import Any, List, Optional, Sequence
+
+from bugscraper.metrics import metrics
+from bugscraper.serialization import response_json
+
+
+logger = logging.getLogger('bugscraper')
+
+
+def probe(api, bug_id: int, window: int) -> Optional[int]:
+    """
+    Return the largest existing id among the window ids starting at bug_id, None if none of them exist
+    Request failures are raised, a failed probe must not read as a missing range. Only ids are asked for,
+    full bugs would make every probe as heavy as a scrape chunk
+    """
+    response = api.get_bugs(list(range(bug_id, bug_id + window)), fields={'include_fields': 'id'})
+    bug_list = response_json(response)['bugs']
+    return max((int(bug['id']) for bug in bug_list), default=None)
+
+
+def find_max_id(api, start: int = 1, window: int = 200) -> Optional[int]:
+    """
+    Find the largest bug id of the api host, None when no bug exists at or after start
+    The newest bug reported by the search api is only a starting point: ids above it are probed with
+    exponentially growing steps, then the last step is narrowed by binary search. Every probe asks for
+    a window of ids, so the window has to be longer than the runs of deleted or private ids.
+    """
+    newest = api.newest_id()
+    lo = max(start, newest or start)
+    known = probe(api, lo, window)
+    if known is None and newest is not None and newest >= start:
+        known = newest
+
+    step = window
+    while True:
+        hi = lo + step
+        found = probe(api, hi, window)
+        if found is None:
+            break
+        known, lo = found, hi
+        step *= 2
+
+    # Without any bug below hi there is no lower bound to narrow from
+    while known is not None and hi - lo > window:
+        mid = (lo + hi) // 2
+        found = probe(api, mid, window)
+        if found is None:
+            hi = mid
+        else:
+            known, lo = max(known, found), mid
+    logger.info(f'Discovered largest bug id {known} of {api.host}')
+    return known
+
+
+class Stride(list):
+    """
+    Ids of a sparse range, only a sample of them is fetched unless that sample finds a bug
+    """
+    def __init__(self, bug_ids: Sequence[int], sample_size: int):
+        super().__init__(bug_ids)
+        step = max(1, len(self) // sample_size)
+        self.sample = self[::step]
+        self.rest = [bug_id for i, bug_id in enumerate(self) if i % step]
+
+
+class SparseChunker(object):
+    """
+    Hands out id chunks, switching to coarse sampling after a run of empty chunks
+    While sampling, ids are handed out in strides of stride_chunks chunks. A stride whose sample finds
+    a bug is fetched in full and ends sampling, a stride with an empty sample is skipped.
+    """
+    def __init__(self, bug_ids: Sequence[int], chunk_size: int = 1000, empty_chunks: int = 5,
+                 stride_chunks: int = 10, sample_size: int = 100):
+        self.bug_ids = bug_ids
+        self.chunk_size = chunk_size
+        self.empty_chunks = empty_chunks
+        self.stride_size = chunk_size * stride_chunks
+        self.sample_size = sample_size
+        self.pos = 0
+        self.empty_run = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    @property
+    def sampling(self) -> bool:
+        return self.empty_run >= self.empty_chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Sequence[int]:
+        with self.lock:
+            if self.pos >= len(self.bug_ids):
+                raise StopIteration
+            if self.sampling:
+                chunk = Stride(self.bug_ids[self.pos:self.pos + self.stride_size], self.sample_size)
+            else:
+                chunk = self.bug_ids[self.pos:self.pos + self.chunk_size]
+            self.pos += len(chunk)
+            return chunk
+
+    def record(self, chunk: Sequence[int], bug_list: Optional[List[Any]]):
+        # Failed fetches say nothing about the range and leave the run alone
+        with self.lock:
+            if bug_list:
+                if self.sampling:
+                    logger.info(f'Found bugs near id {chunk[0]}, leaving sampling mode')
+                self.empty_run = 0
+            elif bug_list is not None:
+                self.empty_run += 1
+                if self.empty_run == self.empty_chunks:
+                    logger.info(f'{self.empty_run} empty chunks before id {chunk[-1] + 1}, sampling ahead')
+
+    def fetch(self, api, chunk: Sequence[int]) -> Optional[List[Any]]:
+        """
+        Fetch a chunk of bugs with api, a stride is fetched in full only when its sample finds a bug
+        """
+        if not isinstance(chunk, Stride):
+            bug_list = api.fetch(chunk)
+            self.record(chunk, bug_list)
+            return bug_list
+
+        bug_list = api.fetch(chunk.sample)
+        if bug_list == []:
+            with self.lock:
+                self.skipped += len(chunk.rest)
+            metrics.inc('ids_skipped_total', len(chunk.rest))
+            logger.debug(f'Skipping {len(chunk.rest)} ids after an empty sample at id {chunk[0]}')
+            return bug_list
+
+        # A failed sample may hide bugs, so the stride is fetched in full like a hit
+        bug_list = list(bug_list or [])
+        for start in range(0, len(chunk.rest), self.chunk_size):
+            bug_list.extend(api.fetch(chunk.rest[start:start + self.chunk_size]) or [])
+        self.record(chunk, bug_list)
+        return bug_list
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent fetch engine for bugscraper."""
+import time
+import logging
+import threading
+import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, ReadTimeoutError
+
+from bugscraper.metrics import metrics
+from bugscraper.serialization import response_json
+
+
+logger = logging.getLogger('bugscraper')
+
+# Sentinel marking an exhausted task iterator
+_done = object()
+
+
+class FetchEngine(object):
+    """
+    Bounded worker pool that runs fetch calls concurrently
+    Results are yielded in submission order so a single writer can consume them
+    """
+    def __init__(self, workers: int = 4, window: int = None):
+        self.workers = max(1, workers)
+        # Number of tasks allowed in flight, bounds memory held by pending results
+        self.window = window if window is not None else 2 * self.workers
+
+    def run(self, fetch: Callable[[Any], Any], tasks: Iterable[Any]) -> Iterator[Tuple[Any, Any]]:
+        """
+        Apply fetch to every task and yield (task, result) pairs in order
+        Tasks are pulled lazily from the iterable as slots become free, an iterator
+        that ran dry is polled again after every completed task
+        """
+        tasks = iter(tasks)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while len(pending) < self.window:
+                task = next(tasks, _done)
+                if task is _done:
+                    break
+                pending.append((task, executor.submit(fetch, task)))
+
+            while pending:
+                task, future = pending.popleft()
+                result = future.result()
+                task_next = next(tasks, _done)
+                if task_next is not _done:
+                    pending.append((task_next, executor.submit(fetch, task_next)))
+                yield task, result
+
+
+class AdaptiveChunker(object):
+    """
+    Hands out id chunks that grow while responses stay fast and small
+    A chunk failing with 413/414/5xx or a timeout is split in half and queued again,
+    single ids that still fail are recorded in the api failed ids
+    """
+    def __init__(self, bug_ids: Sequence[int], chunk_size: int = 1000, min_size: int = 1,
+                 max_size: int = 10000, target_latency: float = 10.0, target_bytes: int = 32 * 1024 * 1024):
+        self.bug_ids = bug_ids
+        self.chunk_size = chunk_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+        self.pos = 0
+        self.split_chunks = deque()
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    # The engine polls again after completions, so split chunks queued late are still handed out
+    def __next__(self) -> Sequence[int]:
+        with self.lock:
+            if self.split_chunks:
+                return self.split_chunks.popleft()
+            if self.pos >= len(self.bug_ids):
+                raise StopIteration
+            chunk = self.bug_ids[self.pos:self.pos + self.chunk_size]
+            self.pos += len(chunk)
+            return chunk
+
+    def success(self, latency: float, size: int):
+        with self.lock:
+            if latency > self.target_latency or size > self.target_bytes:
+                self.chunk_size = max(self.min_size, int(self.chunk_size * 0.7))
+            elif latency < self.target_latency / 2 and size < self.target_bytes / 2:
+                self.chunk_size = min(self.max_size, max(self.chunk_size + 1, int(self.chunk_size * 1.5)))
+
+    def failure(self, chunk: Sequence[int]) -> bool:
+        """
+        Split a failed chunk and queue both halves, returns False when it cannot be split further
+        """
+        if len(chunk) <= self.min_size:
+            return False
+        half = len(chunk) // 2
+        with self.lock:
+            self.chunk_size = max(self.min_size, half)
+            self.split_chunks.append(chunk[:half])
+            self.split_chunks.append(chunk[half:])
+        logger.info(f'Splitting failed chunk of size {len(chunk)}, chunk size is now {self.chunk_size}')
+        return True
+
+    @staticmethod
+    def is_splittable(error: requests.exceptions.RequestException) -> bool:
+        if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.RetryError)):
+            return True
+        # Timeouts that exhausted the urllib3 retries surface as a ConnectionError wrapping them
+        cause = error.args[0] if error.args else None
+        timeouts = (ReadTimeoutError, ConnectTimeoutError)
+        if isinstance(cause, MaxRetryError) and isinstance(cause.reason, timeouts):
+            return True
+        status = getattr(error.response, 'status_code', None)
+        return status in (413, 414) or (status is not None and status >= 500)
+
+    def fetch(self, api, chunk: Sequence[int]) -> Optional[List[Any]]:
+        """
+        Fetch a chunk of bugs with api and feed latency, size or failure back into the chunk size
+        """
+        start = time.monotonic()
+        try:
+            response = api.get_bugs(list(chunk))
+            bug_list = response_json(response)['bugs']
+        except requests.exceptions.RequestException as e:
+            logger.debug(str(e))
+            if self.is_splittable(e) and self.failure(chunk):
+                return None
+            logger.warning('Connection Error: recording {} failed ids, returning None'.format(len(chunk)))
+            api.failed_ids.update(int(bug_id) for bug_id in chunk)
+            metrics.inc('fetches_total', kind='bugs', result='failed')
+            return None
+        except KeyError as e:
+            logger.warning('incorrect key bugs: returning None')
+            logger.debug(str(e))
+            metrics.inc('fetches_total', kind='bugs', result='empty')
+            return []
+        self.success(time.monotonic() - start, len(response.content))
+        metrics.inc('fetches_total', kind='bugs', result='ok' if bug_list else 'empty')
+        return bug_list
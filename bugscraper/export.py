@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""Columnar export of scraped corpora to Parquet or Arrow IPC."""
+import os
+import json
+import logging
+from itertools import groupby
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Bugzilla timestamps are ISO 8601 in UTC
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Columns of every kind, timestamps are parsed from strings and fields not listed
+# for bugs are kept as a json string in the extra column
+BUG_COLUMNS = [
+    ('id', 'int64'), ('year', 'int16'), ('product', 'string'), ('component', 'string'),
+    ('classification', 'string'), ('status', 'string'), ('resolution', 'string'),
+    ('severity', 'string'), ('priority', 'string'), ('version', 'string'), ('op_sys', 'string'),
+    ('platform', 'string'), ('summary', 'string'), ('creator', 'string'), ('assigned_to', 'string'),
+    ('is_open', 'bool'), ('keywords', 'list<string>'), ('creation_time', 'timestamp'),
+    ('last_change_time', 'timestamp'), ('extra', 'string')
+]
+COMMENT_COLUMNS = [
+    ('bug_id', 'int64'), ('year', 'int16'), ('id', 'int64'), ('count', 'int32'), ('creator', 'string'),
+    ('creation_time', 'timestamp'), ('is_private', 'bool'), ('attachment_id', 'int64'),
+    ('tags', 'list<string>'), ('text', 'string')
+]
+HISTORY_COLUMNS = [
+    ('bug_id', 'int64'), ('year', 'int16'), ('who', 'string'), ('when', 'timestamp'),
+    ('field_name', 'string'), ('removed', 'string'), ('added', 'string'), ('attachment_id', 'int64')
+]
+
+columns = {
+    'bugs': BUG_COLUMNS,
+    'comments': COMMENT_COLUMNS,
+    'history': HISTORY_COLUMNS
+}
+
+
+def arrow_type(name: str) -> 'pa.DataType':
+    if name == 'timestamp':
+        return pa.timestamp('s', tz='UTC')
+    if name == 'list<string>':
+        return pa.list_(pa.string())
+    return pa.type_for_alias(name)
+
+
+def schema(kind: str) -> 'pa.Schema':
+    return pa.schema([(name, arrow_type(type_name)) for name, type_name in columns[kind]])
+
+
+def rows(kind: str, year: int, bug_id: int, record: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Flatten a stored record into rows of the export schema of kind
+    """
+    if kind == 'bugs':
+        row = {name: record.get(name) for name, _ in BUG_COLUMNS}
+        row['year'] = year
+        extra = {key: value for key, value in record.items() if key not in row}
+        row['extra'] = json.dumps(extra) if extra else None
+        yield row
+    elif kind == 'comments':
+        for comment in record:
+            row = {name: comment.get(name) for name, _ in COMMENT_COLUMNS}
+            row['bug_id'], row['year'] = bug_id, year
+            yield row
+    else:
+        for entry in record:
+            for change in entry.get('changes', []):
+                yield {
+                    'bug_id': bug_id, 'year': year, 'who': entry.get('who'), 'when': entry.get('when'),
+                    'field_name': change.get('field_name'), 'removed': change.get('removed'),
+                    'added': change.get('added'), 'attachment_id': change.get('attachment_id')
+                }
+
+
+def to_batch(kind: str, batch_rows: List[Dict[str, Any]]) -> 'pa.RecordBatch':
+    arrays = []
+    for name, type_name in columns[kind]:
+        values = [row[name] for row in batch_rows]
+        if type_name == 'timestamp':
+            strings = pa.array(values, type=pa.string())
+            arrays.append(pc.strptime(strings, format=TIME_FORMAT, unit='s').cast(arrow_type(type_name)))
+        else:
+            arrays.append(pa.array(values, type=arrow_type(type_name)))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema(kind))
+
+
+class PartitionWriter(object):
+    """
+    Writes record batches of one year partition to a Parquet or Arrow IPC file
+    """
+    def __init__(self, path: str, kind: str, fmt: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if fmt == 'parquet':
+            self.writer = pq.ParquetWriter(path, schema(kind), compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(path, schema(kind))
+        self.fmt = fmt
+
+    def write(self, batch: 'pa.RecordBatch'):
+        if self.fmt == 'parquet':
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+def export(storage, kind: str, out_dir: str, fmt: str = 'parquet', batch_size: int = 10000) -> int:
+    """
+    Stream the stored records of kind into files partitioned by year under out_dir/kind/<year>/
+    At most batch_size rows are held in memory at a time, returns the number of rows written
+    """
+    if pa is None:
+        raise ImportError('Exporting requires pyarrow, install it with pip install pyarrow')
+
+    total = 0
+    extension = 'parquet' if fmt == 'parquet' else 'arrow'
+    records: Iterable[Tuple[int, int, Any]] = storage.records(kind)
+    for year, year_records in groupby(records, key=lambda record: record[0]):
+        path = os.path.join(out_dir, kind, str(year), f'part-0.{extension}')
+        writer = PartitionWriter(path, kind, fmt)
+        batch_rows = []
+        for record in year_records:
+            batch_rows.extend(rows(kind, *record))
+            if len(batch_rows) >= batch_size:
+                writer.write(to_batch(kind, batch_rows))
+                total += len(batch_rows)
+                batch_rows = []
+        if batch_rows:
+            writer.write(to_batch(kind, batch_rows))
+            total += len(batch_rows)
+        writer.close()
+        logger.info(f'Exported {kind} of {year} to {path}')
+    return total
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming, parallel filtering of scraped bug files."""
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from bugscraper.compression import open_binary, plain_path
+from bugscraper.serialization import loads
+from bugscraper.storage import creation_month, partition_month
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Bug fields that can be filtered by exact value
+VALUE_FIELDS = ('product', 'component', 'status', 'resolution')
+
+
+@dataclass
+class BugFilter:
+    """
+    Predicates a bug has to satisfy, an empty filter accepts every bug
+    Values of a field are alternatives, different fields and date bounds must all hold
+    """
+    values: Dict[str, List[str]] = field(default_factory=dict)
+    created_after: Optional[str] = None
+    created_before: Optional[str] = None
+    changed_after: Optional[str] = None
+    changed_before: Optional[str] = None
+
+    def __post_init__(self):
+        self.values = {name: list(values) for name, values in self.values.items() if values}
+        # Encoded forms of "field": value as json.dumps and orjson write them, used to reject raw lines
+        self.needles = [
+            sorted({
+                '"{}"{}{}'.format(name, separator, json.dumps(value, ensure_ascii=ensure_ascii))
+                for value in values for separator in (': ', ':') for ensure_ascii in (True, False)
+            })
+            for name, values in self.values.items()
+        ]
+        self.byte_needles = [[needle.encode('utf-8') for needle in needles] for needles in self.needles]
+
+    def prefilter(self, line: Union[str, bytes]) -> bool:
+        """
+        Cheap check on a raw json line, False means the bug can not match
+        """
+        needles = self.byte_needles if isinstance(line, bytes) else self.needles
+        return all(any(needle in line for needle in alternatives) for alternatives in needles)
+
+    def matches(self, bug: Dict[str, Any]) -> bool:
+        for name, values in self.values.items():
+            if bug.get(name) not in values:
+                return False
+        # Bugzilla timestamps are ISO 8601 in UTC, so they compare as strings
+        created, changed = bug.get('creation_time', ''), bug.get('last_change_time', '')
+        return not (
+            (self.created_after and created < self.created_after)
+            or (self.created_before and created >= self.created_before)
+            or (self.changed_after and changed < self.changed_after)
+            or (self.changed_before and changed >= self.changed_before)
+        )
+
+    def filter_lines(self, lines) -> Iterator[Tuple[Union[str, bytes], Dict[str, Any]]]:
+        for line in lines:
+            if not self.prefilter(line):
+                continue
+            bug = loads(line)
+            if self.matches(bug):
+                yield line, bug
+
+
+def filter_partition(args: Tuple[BugFilter, int, str, str, int]) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    Filter one partition into an uncompressed file of the same name in out_dir, writing matching lines
+    unchanged in batches. Returns the year and the (id, creation month) of the matching bugs
+    """
+    bug_filter, year, in_path, out_dir, batch_size = args
+    # Month partitions name the month, other files only have it in the creation time of their bugs
+    month = partition_month('bugs', in_path)
+    bugs = []
+    batch = []
+    out_path = os.path.join(out_dir, os.path.basename(plain_path(in_path)))
+    with open_binary(in_path) as bf, open(out_path, 'wb') as of:
+        for line, bug in bug_filter.filter_lines(bf):
+            batch.append(line)
+            bug_month = month or (creation_month(bug)[1] if 'creation_time' in bug else 0)
+            bugs.append((int(bug['id']), bug_month))
+            if len(batch) >= batch_size:
+                of.writelines(batch)
+                batch = []
+        of.writelines(batch)
+    return year, bugs
+
+
+def filter_partitions(bug_filter: BugFilter, partitions: List[Tuple[int, str]], out_dir, workers: int = None,
+                      batch_size: int = 1000) -> Iterator[Tuple[int, List[Tuple[int, int]]]]:
+    """
+    Filter the (year, path) partitions in parallel processes, yielding (year, [(bug id, month)]) by partition
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(bug_filter, year, path, str(out_dir), batch_size) for year, path in partitions]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(filter_partition, tasks)
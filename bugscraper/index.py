@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""Per file byte offset indexes of json lines partitions."""
+import os
+import mmap
+import struct
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from bugscraper.compression import compression_of, decompress, frames, read_frame
+from bugscraper.serialization import loads
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Index files start with a header holding the indexed size and inode of the partition
+INDEX_MAGIC = b'BSIDX001'
+HEADER = struct.Struct('<8sqq')
+
+# Entries are sorted by bug id. A line is found by reading length bytes at offset, which is the line
+# itself for plain files and its frame for compressed ones, and slicing line_length bytes at line_offset
+ENTRY = struct.Struct('<qqqii')
+
+Entry = Tuple[int, int, int, int]
+
+
+def index_path(path) -> str:
+    return str(path) + '.idx'
+
+
+def scan_lines(path, start: int = 0) -> Iterator[Tuple[Entry, bytes]]:
+    """
+    Yield the location and bytes of every line of a partition from byte start on
+    """
+    if compression_of(path) == 'none':
+        with open(path, 'rb') as pf:
+            pf.seek(start)
+            offset = start
+            for line in pf:
+                yield (offset, len(line), 0, len(line)), line
+                offset += len(line)
+        return
+
+    compression = compression_of(path)
+    with open(path, 'rb') as pf:
+        for frame_offset, frame_length in frames(path):
+            if frame_offset < start:
+                continue
+            pf.seek(frame_offset)
+            data = decompress(pf.read(frame_length), compression)
+            line_offset = 0
+            for line in data.splitlines(keepends=True):
+                yield (frame_offset, frame_length, line_offset, len(line)), line
+                line_offset += len(line)
+
+
+def read_index(path) -> Optional[Tuple[int, Dict[int, Entry]]]:
+    """
+    Return the indexed size and entries of the index of a partition, None if it is missing or stale
+    """
+    if not os.path.exists(index_path(path)):
+        return None
+    with open(index_path(path), 'rb') as xf:
+        data = xf.read()
+    magic, size, inode = HEADER.unpack_from(data)
+    stat = os.stat(path)
+    if magic != INDEX_MAGIC or inode != stat.st_ino or size > stat.st_size:
+        return None
+    entries = {
+        bug_id: (offset, length, line_offset, line_length)
+        for bug_id, offset, length, line_offset, line_length in ENTRY.iter_unpack(data[HEADER.size:])
+    }
+    return size, entries
+
+
+def write_index(path, size: int, entries: Dict[int, Entry]):
+    tmp_path = index_path(path) + '.tmp'
+    with open(tmp_path, 'wb') as xf:
+        xf.write(HEADER.pack(INDEX_MAGIC, size, os.stat(path).st_ino))
+        for bug_id in sorted(entries):
+            xf.write(ENTRY.pack(bug_id, *entries[bug_id]))
+    os.replace(tmp_path, index_path(path))
+
+
+def is_current(path) -> bool:
+    """
+    Whether the index of a partition covers the whole file
+    """
+    if not os.path.exists(index_path(path)):
+        return False
+    with open(index_path(path), 'rb') as xf:
+        header = xf.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return False
+    magic, size, inode = HEADER.unpack(header)
+    stat = os.stat(path)
+    return magic == INDEX_MAGIC and inode == stat.st_ino and size == stat.st_size
+
+
+class IndexReader(object):
+    """
+    Looks bug ids up in the memory mapped index of a partition and reads their lines
+    Lookups binary search the sorted entries, so only the touched pages of the index are read
+    """
+    def __init__(self, path):
+        self.path = str(path)
+        self.compressed = compression_of(path) != 'none'
+        with open(index_path(path), 'rb') as xf:
+            self.mm = mmap.mmap(xf.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = (len(self.mm) - HEADER.size) // ENTRY.size
+        self.fileobj = open(self.path, 'rb')
+        # Last decompressed frame, consecutive ids mostly share one
+        self.frame: Tuple[int, bytes] = (-1, b'')
+
+    def __len__(self) -> int:
+        return self.count
+
+    def entry(self, pos: int) -> Tuple[int, Entry]:
+        bug_id, *entry = ENTRY.unpack_from(self.mm, HEADER.size + pos * ENTRY.size)
+        return bug_id, tuple(entry)
+
+    def bisect(self, bug_id: int) -> int:
+        """
+        Return the position of the first entry whose bug id is not below bug_id
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] < bug_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, bug_id: int) -> Optional[Entry]:
+        pos = self.bisect(int(bug_id))
+        if pos < self.count:
+            found, entry = self.entry(pos)
+            if found == int(bug_id):
+                return entry
+        return None
+
+    def entries(self, start: int = None, end: int = None) -> Iterator[Tuple[int, Entry]]:
+        """
+        Yield the (bug id, entry) of the bug ids in [start, end) in id order
+        """
+        pos = 0 if start is None else self.bisect(start)
+        while pos < self.count:
+            bug_id, entry = self.entry(pos)
+            if end is not None and bug_id >= end:
+                return
+            yield bug_id, entry
+            pos += 1
+
+    def read(self, entry: Entry) -> bytes:
+        offset, length, line_offset, line_length = entry
+        if not self.compressed:
+            self.fileobj.seek(offset)
+            return self.fileobj.read(length)
+        if self.frame[0] != offset:
+            self.frame = (offset, read_frame(self.path, offset, length))
+        return self.frame[1][line_offset:line_offset + line_length]
+
+    def close(self):
+        self.mm.close()
+        self.fileobj.close()
+
+
+def open_index(path, kind: str) -> IndexReader:
+    """
+    Bring the index of a partition up to date if needed and open it for lookups
+    """
+    if not is_current(path):
+        index_partition(path, kind)
+    return IndexReader(path)
+
+
+def summarize(kind: str, records: Any) -> Any:
+    """
+    The part of a record kept in the bug metadata, comment ids for comments and edit counts for history
+    """
+    if kind == 'comments':
+        return [comment['id'] for comment in records]
+    if kind == 'history':
+        return len(records)
+    return None
+
+
+def index_partition(path, kind: str, full: bool = False) -> Tuple[Dict[int, Entry], Dict[int, Any]]:
+    """
+    Bring the index of a partition up to date and return its entries with the summaries of scanned lines
+    Lines appended since the last indexing are scanned unless full is set, in which case the whole file
+    is. The last line of a bug wins, like everywhere else.
+    """
+    size, entries = (None if full else read_index(path)) or (0, {})
+    summaries: Dict[int, Any] = {}
+    end = size
+    for entry, line in scan_lines(path, size):
+        try:
+            record = loads(line)
+            if kind == 'bugs':
+                entries[int(record['id'])] = entry
+            else:
+                for bug_id, records in record.items():
+                    entries[int(bug_id)] = entry
+                    summaries[int(bug_id)] = summarize(kind, records)
+        except (ValueError, KeyError):
+            # A crash while appending can leave a partial last line behind
+            logger.warning(f'Skipping malformed line at offset {entry[0]} of {path}')
+            continue
+        end = entry[0] + entry[1]
+    if end != size or not os.path.exists(index_path(path)):
+        write_index(path, max(end, size), entries)
+    return entries, summaries
+
+
+def scan_partition(task: Tuple[str, int, str]) -> Tuple[int, List[Tuple[int, Any]]]:
+    """
+    Index one partition and return its year with the (bug id, summary) of every bug in it
+    Bug ids come straight from the index, only comments and history need their lines parsed
+    """
+    kind, year, path = task
+    entries, summaries = index_partition(path, kind, full=kind != 'bugs')
+    return year, [(bug_id, summaries.get(bug_id)) for bug_id in entries]
+
+
+def scan_partitions(kind: str, partitions: List[Tuple[int, str]],
+                    workers: int = None) -> Iterator[Tuple[int, List[Tuple[int, Any]]]]:
+    """
+    Scan the (year, path) partitions of kind in parallel processes
+    """
+    tasks = [(kind, year, str(path)) for year, path in partitions]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(scan_partition, tasks)
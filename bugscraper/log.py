@@ -42,7 +42,7 @@ def configure_logger(stream_level='DEBUG', debug_file=None):
         logger.addHandler(file_handler)
 
     # Get settings based on the given stream_level
-    log_formatter = logging.Formatter(LOG_FORMATS[stream_level])
+    log_formatter = logging.Formatter(LOG_FORMATS.get(stream_level, LOG_FORMATS['INFO']))
     log_level = LOG_LEVELS[stream_level]
 
     # Create a stream handler
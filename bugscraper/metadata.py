@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""Compact store of per bug save metadata."""
+import os
+import json
+import logging
+from array import array
+from pathlib import PurePath
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+from dataclasses import dataclass, field, asdict
+
+from bugscraper.compression import open_binary
+from bugscraper.serialization import dumps, loads
+from bugscraper.state import atomic_write_json
+
+
+logger = logging.getLogger('bugscraper')
+
+
+@dataclass
+class BugSaveMetadata:
+    bug_id: str = ''
+    year: int = -1
+    comment_ids: List[str] = field(default_factory=list)
+    edits: int = 0
+    # Creation month, 0 when unknown
+    month: int = 0
+
+    @classmethod
+    def from_json(cls: 'BugSaveMetadata', json_str: Union[str, bytes]):
+        bug_dict = loads(json_str)
+
+        # Temporary workaround for backward compatiability
+        edits = bug_dict['edits'] if 'edits' in bug_dict else 0
+        return cls(str(bug_dict['bug_id']), bug_dict['year'], bug_dict['comment_ids'], edits,
+                   bug_dict.get('month', 0))
+
+
+class MetadataStore(object):
+    """
+    Column store of bug save metadata indexed by bug id
+    Comment ids are kept out of line in a single pool, every bug only stores
+    its slice of the pool. The metadata file is an append-only log where the
+    last line of a bug wins, so persisting a change only appends that bug.
+    """
+    __slots__ = ('bug_ids', 'years', 'months', 'edits', 'comment_starts', 'comment_counts',
+                 'comment_pool', 'index', 'dirty')
+
+    def __init__(self):
+        self.bug_ids = array('q')
+        self.years = array('h')
+        self.months = array('b')
+        self.edits = array('l')
+        self.comment_starts = array('q')
+        self.comment_counts = array('l')
+        self.comment_pool = array('q')
+        self.index: Dict[int, int] = {}
+        self.dirty = set()
+
+    def __len__(self) -> int:
+        return len(self.bug_ids)
+
+    def __getitem__(self, idx: int) -> BugSaveMetadata:
+        bug_id = str(self.bug_ids[idx])
+        return BugSaveMetadata(bug_id, self.years[idx], self.comment_ids(idx), self.edits[idx],
+                               self.months[idx])
+
+    def __iter__(self) -> Iterator[BugSaveMetadata]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def index_of(self, bug_id) -> Optional[int]:
+        return self.index.get(int(bug_id))
+
+    def append(self, meta: BugSaveMetadata) -> int:
+        """
+        Add the metadata of a bug, a bug that is already stored only has its year and month updated
+        """
+        bug_id = int(meta.bug_id)
+        idx = self.index.get(bug_id)
+        if idx is None:
+            idx = len(self.bug_ids)
+            self.index[bug_id] = idx
+            self.bug_ids.append(bug_id)
+            self.years.append(meta.year)
+            self.months.append(meta.month)
+            self.edits.append(meta.edits)
+            self.comment_starts.append(0)
+            self.comment_counts.append(0)
+            self.set_comment_ids(idx, meta.comment_ids)
+        else:
+            self.years[idx] = meta.year
+            if meta.month:
+                self.months[idx] = meta.month
+            if meta.comment_ids:
+                self.set_comment_ids(idx, meta.comment_ids)
+            if meta.edits:
+                self.edits[idx] = meta.edits
+        self.dirty.add(idx)
+        return idx
+
+    def comment_ids(self, idx: int) -> List[str]:
+        start = self.comment_starts[idx]
+        return [str(comment_id) for comment_id in self.comment_pool[start:start + self.comment_counts[idx]]]
+
+    def set_comment_ids(self, idx: int, comment_ids: Iterable):
+        comment_ids = [int(comment_id) for comment_id in comment_ids]
+        if len(comment_ids) <= self.comment_counts[idx]:
+            start = self.comment_starts[idx]
+            self.comment_pool[start:start + len(comment_ids)] = array('q', comment_ids)
+        else:
+            self.comment_starts[idx] = len(self.comment_pool)
+            self.comment_pool.extend(comment_ids)
+        self.comment_counts[idx] = len(comment_ids)
+        self.dirty.add(idx)
+
+    def set_edits(self, idx: int, edits: int):
+        self.edits[idx] = edits
+        self.dirty.add(idx)
+
+    def load(self, metadata_path):
+        with open_binary(metadata_path) as mf:
+            for line_no, line in enumerate(mf):
+                try:
+                    meta = BugSaveMetadata.from_json(line)
+                except json.JSONDecodeError:
+                    # A crash while appending can leave a partial last line behind
+                    logger.warning(f'Skipping malformed metadata line {line_no} in {metadata_path}')
+                    continue
+                idx = self.index_of(meta.bug_id)
+                if idx is None:
+                    self.append(meta)
+                else:
+                    # Later log lines replace the earlier state of the bug
+                    self.years[idx] = meta.year
+                    self.months[idx] = meta.month
+                    self.set_comment_ids(idx, meta.comment_ids)
+                    self.edits[idx] = meta.edits
+        self.dirty.clear()
+
+    def flush(self, metadata_path):
+        """
+        Append the records changed since the last flush to the metadata log
+        """
+        with open(metadata_path, 'a') as mf:
+            for idx in sorted(self.dirty):
+                mf.write(dumps(asdict(self[idx])) + '\n')
+            mf.flush()
+            os.fsync(mf.fileno())
+        self.dirty.clear()
+
+    def save(self, metadata_path):
+        """
+        Rewrite the metadata log with a single line per bug
+        """
+        tmp_path = str(metadata_path) + '.tmp'
+        with open(tmp_path, 'w') as mf:
+            for meta in self:
+                mf.write(dumps(asdict(meta)) + '\n')
+            mf.flush()
+            os.fsync(mf.fileno())
+        os.replace(tmp_path, metadata_path)
+        self.dirty.clear()
+
+
+@dataclass
+class FieldProjection:
+    """
+    Fields requested from Bugzilla for one record kind, empty lists mean full records
+    """
+    include_fields: List[str] = field(default_factory=list)
+    exclude_fields: List[str] = field(default_factory=list)
+
+    @staticmethod
+    def path(save_dir) -> PurePath:
+        return PurePath(save_dir, 'field_projection.json')
+
+    @classmethod
+    def load_all(cls: 'FieldProjection', save_dir) -> Dict[str, 'FieldProjection']:
+        projection_path = cls.path(save_dir)
+        if not os.path.exists(projection_path):
+            return {}
+        with open(projection_path) as pf:
+            return {kind: cls(**projection) for kind, projection in json.load(pf).items()}
+
+    @classmethod
+    def save_all(cls: 'FieldProjection', save_dir, projections: Dict[str, 'FieldProjection']):
+        projections = {kind: asdict(projection) for kind, projection in projections.items()}
+        atomic_write_json(cls.path(save_dir), projections)
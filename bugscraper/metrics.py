@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""Counters and latency histograms of scrape runs, reported as json stats and Prometheus text."""
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Prefix of every metric in the Prometheus textfile
+PREFIX = 'bugscraper_'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        Return the (upper bound, observations at or below it) of every bucket, ending with +Inf
+        """
+        buckets, total = [], 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append(('+Inf' if bound == float('inf') else repr(bound), total))
+        return buckets
+
+
+def label_key(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Metrics(object):
+    """
+    Thread safe registry of labelled counters and histograms
+    Apis, savers and the pipeline all record into the module level registry below
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.started = time.time()
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name: str, **labels) -> float:
+        """
+        Sum a counter, or the observed seconds of a histogram, over the series matching labels
+        """
+        wanted = set(label_key(labels))
+        with self.lock:
+            total = sum(value for (metric, key), value in self.counters.items()
+                        if metric == name and wanted <= set(key))
+            total += sum(histogram.sum for (metric, key), histogram in self.histograms.items()
+                         if metric == name and wanted <= set(key))
+        return total
+
+    def snapshot(self) -> Dict[str, object]:
+        with self.lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': histogram.count,
+                           'sum': histogram.sum, 'buckets': dict(histogram.cumulative())}
+                          for (name, labels), histogram in sorted(self.histograms.items())]
+        return {'started': self.started, 'uptime': time.time() - self.started,
+                'counters': counters, 'histograms': histograms}
+
+    def prometheus(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {PREFIX}{name} counter')
+                    typed.add(name)
+                lines.append(f'{PREFIX}{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f'# TYPE {PREFIX}{name} histogram')
+                    typed.add(name)
+                for bound, count in histogram.cumulative():
+                    bucket_labels = format_labels(labels + (('le', bound),))
+                    lines.append(f'{PREFIX}{name}_bucket{bucket_labels} {count}')
+                lines.append(f'{PREFIX}{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{PREFIX}{name}_count{format_labels(labels)} {histogram.count}')
+        lines.append(f'{PREFIX}uptime_seconds {time.time() - self.started}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> List[str]:
+        """
+        Return a short human readable account of the run
+        """
+        elapsed = time.time() - self.started
+        requests = self.total('requests_total')
+        statuses: Dict[str, float] = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                if name == 'requests_total':
+                    status = dict(labels).get('status', '')
+                    statuses[status] = statuses.get(status, 0) + value
+        lines = [
+            f'Run took {elapsed:.1f}s, {requests:.0f} requests ({requests / max(elapsed, 1e-9):.1f}/s), '
+            f'{self.total("response_bytes_total") / 1e6:.1f} MB downloaded, '
+            f'{self.total("retries_total"):.0f} retries, {self.total("cache_hits_total"):.0f} cache hits',
+            'Statuses: ' + (', '.join(f'{status}: {count:.0f}' for status, count in sorted(statuses.items()))
+                            or 'none'),
+        ]
+        for kind in ('bugs', 'comments', 'history'):
+            fetches = self.total('fetches_total', kind=kind)
+            if fetches:
+                empty = self.total('fetches_total', kind=kind, result='empty')
+                failed = self.total('fetches_total', kind=kind, result='failed')
+                lines.append(
+                    f'{kind}: {self.total("records_written_total", kind=kind):.0f} records written, '
+                    f'{fetches:.0f} fetches of which {empty:.0f} empty and {failed:.0f} failed'
+                )
+        # Workers fetch and decode concurrently, so those times add up across them
+        lines.append(
+            f'Time in network {self.total("request_seconds"):.1f}s and json decode '
+            f'{self.total("json_decode_seconds"):.1f}s summed over workers, '
+            f'disk write {self.total("disk_write_seconds"):.1f}s, flush {self.total("flush_seconds"):.1f}s'
+        )
+        return lines
+
+
+# Registry shared by everything running in the process
+metrics = Metrics()
+
+
+def write_atomic(path, text: str):
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'w') as tf:
+        tf.write(text)
+    os.replace(tmp_path, path)
+
+
+class MetricsReporter(object):
+    """
+    Writes the metrics to a json stats file and a Prometheus textfile every interval seconds
+    The textfile can be picked up by the node exporter textfile collector. Both files are replaced
+    atomically, so readers never see a partial write.
+    """
+    def __init__(self, registry: Metrics, stats_path: Optional[str] = None,
+                 prometheus_path: Optional[str] = None, interval: float = 60):
+        self.registry = registry
+        self.stats_path = stats_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> 'MetricsReporter':
+        if self.stats_path or self.prometheus_path:
+            self.thread.start()
+        return self
+
+    def write(self):
+        try:
+            if self.stats_path:
+                write_atomic(self.stats_path, json.dumps(self.registry.snapshot(), indent=2) + '\n')
+            if self.prometheus_path:
+                write_atomic(self.prometheus_path, self.registry.prometheus())
+        except OSError as e:
+            logger.warning(f'Writing metrics failed: {e}')
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""Pipelined scraping of bugs together with their comments and history."""
+import queue
+import logging
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from bugscraper.engine import FetchEngine
+from bugscraper.utils import divide_chunks
+
+
+logger = logging.getLogger('bugscraper')
+
+
+class ScrapePipeline(object):
+    """
+    Fetches bug chunks and fans the saved bugs out to comment and history fetchers
+    Every stage fetches in its own threads and hands results back through one bounded
+    queue, so the consumer of run stays the single writer. Once max_pending bugs wait
+    for their records the bug stage stops taking new chunks until the slower stages catch up.
+    """
+    def __init__(self, bug_api, record_apis: Dict[str, Any], workers: int = 4, batch_size: int = 1,
+                 max_pending: int = 10000):
+        self.bug_api = bug_api
+        self.record_apis = record_apis
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.results = queue.Queue(maxsize=4 * self.workers * (1 + len(record_apis)))
+        # Task queues are bounded by the throttle, max_pending ids plus the bug chunks in flight
+        self.tasks = {kind: queue.Queue() for kind in record_apis}
+        # Record kinds each saved bug still waits for, only touched by the writer
+        self.remaining: Dict[int, Set[str]] = {}
+        self.outstanding = 0
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def throttle(self, chunks: Iterable[List[int]]) -> Iterator[List[int]]:
+        for chunk in chunks:
+            with self.cond:
+                self.cond.wait_for(lambda: self.outstanding < self.max_pending or self.stopped)
+            if self.stopped:
+                return
+            yield chunk
+
+    def fetch_records(self, kind: str, chunk: List[int]) -> Optional[Dict[str, List[Any]]]:
+        api = self.record_apis[kind]
+        if self.batch_size > 1:
+            return api.fetch_many(chunk)
+        return {str(chunk[0]): api.fetch(chunk[0])}
+
+    def run_bugs(self, chunks: Iterable[List[int]]):
+        try:
+            engine = FetchEngine(self.workers)
+            for chunk, bug_list in engine.run(self.bug_api.fetch, self.throttle(chunks)):
+                self.results.put(('bugs', chunk, bug_list))
+        except Exception as e:
+            self.results.put(('error', None, e))
+        finally:
+            self.results.put(('done', 'bugs', None))
+
+    def run_records(self, kind: str):
+        try:
+            chunk = self.tasks[kind].get()
+            while chunk is not None:
+                self.results.put((kind, chunk, self.fetch_records(kind, chunk)))
+                chunk = self.tasks[kind].get()
+        except Exception as e:
+            self.results.put(('error', None, e))
+        finally:
+            self.results.put(('done', kind, None))
+
+    def submit(self, bug_ids: List[int], kinds: Iterable[str] = None):
+        """
+        Queue saved bugs for the given record kinds, all kinds by default
+        """
+        kinds = list(self.record_apis if kinds is None else kinds)
+        new_ids = [bug_id for bug_id in bug_ids if bug_id not in self.remaining]
+        for bug_id in bug_ids:
+            self.remaining.setdefault(bug_id, set()).update(kinds)
+        with self.cond:
+            self.outstanding += len(new_ids)
+        for kind in kinds:
+            for chunk in divide_chunks(bug_ids, self.batch_size):
+                self.tasks[kind].put(chunk)
+
+    def complete(self, kind: str, bug_ids: Iterable[int]) -> List[int]:
+        """
+        Mark kind as handled for bug_ids, returns the bugs that have nothing left to fetch
+        """
+        finished = []
+        for bug_id in bug_ids:
+            kinds = self.remaining[bug_id]
+            kinds.discard(kind)
+            if not kinds:
+                del self.remaining[bug_id]
+                finished.append(bug_id)
+        with self.cond:
+            self.outstanding -= len(finished)
+            self.cond.notify_all()
+        return finished
+
+    def pending(self) -> Dict[str, List[int]]:
+        """
+        Ids of saved bugs still waiting for each record kind
+        """
+        return {
+            kind: sorted(bug_id for bug_id, kinds in self.remaining.items() if kind in kinds)
+            for kind in self.record_apis
+        }
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def run(self, chunks: Iterable[List[int]]) -> Iterator[Tuple[str, List[int], Any]]:
+        """
+        Yield (kind, id chunk, result) as any stage finishes a fetch
+        Bug results are lists of bugs, record results map bug ids to their records
+        The consumer is expected to submit the bugs it saved before asking for the next result
+        """
+        threads = [threading.Thread(target=self.run_bugs, args=(chunks,), daemon=True)]
+        for kind in self.record_apis:
+            threads.extend(threading.Thread(target=self.run_records, args=(kind,), daemon=True)
+                           for _ in range(self.workers))
+        for thread in threads:
+            thread.start()
+
+        running = len(threads)
+        try:
+            while running:
+                kind, chunk, result = self.results.get()
+                if kind == 'error':
+                    raise result
+                if kind == 'done':
+                    running -= 1
+                    if chunk == 'bugs':
+                        # Every saved bug is queued by now, let the record workers drain and exit
+                        for tasks in self.tasks.values():
+                            for _ in range(self.workers):
+                                tasks.put(None)
+                    continue
+                yield kind, chunk, result
+        finally:
+            self.stop()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""Client side rate limiting shared by all requests to a host."""
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Statuses a server uses to ask clients to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket that adapts its rate to the server
+    The rate is halved whenever the server throttles and grows back additively
+    towards max_rate while requests succeed
+    """
+    def __init__(self, max_rate: float, burst: Optional[int] = None, min_rate: float = 0.1):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = burst if burst is not None else max(1, int(max_rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop saved up tokens so the lower rate takes effect right away
+            self.tokens = min(self.tokens, 0)
+        logger.debug(f'Server throttled requests, rate is now {self.rate:.2f}/s')
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def feedback(self, status: int):
+        if status in THROTTLE_STATUSES:
+            self.throttled()
+        elif status < 400:
+            self.succeeded()
+
+
+# Buckets shared by every api talking to the same host
+limiters: Dict[str, TokenBucket] = {}
+limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str, rate: float, burst: Optional[int] = None) -> TokenBucket:
+    with limiters_lock:
+        if host not in limiters:
+            limiters[host] = TokenBucket(rate, burst)
+        return limiters[host]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""Json encoding and decoding, using orjson when it is installed."""
+import json
+import logging
+import requests
+from typing import Any, Union
+
+from bugscraper.metrics import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+logger = logging.getLogger('bugscraper')
+
+
+def dumps(obj: Any) -> str:
+    """
+    Encode obj as a single line of json
+    orjson writes compact separators and raw utf-8, both forms decode to the same value
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def response_json(response) -> Any:
+    """
+    Decode the body of a response, orjson parses the raw bytes without decoding them to text first
+    Malformed bodies raise the same requests JSONDecodeError as response.json
+    """
+    with metrics.timer('json_decode_seconds'):
+        if orjson is None:
+            return response.json()
+        try:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError as e:
+            raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Deterministic partitioning of scrape work into shards and merging of their output."""
+import os
+import re
+import json
+import shutil
+import logging
+from pathlib import Path, PurePath
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Set, Tuple
+
+from bugscraper.bugscraper import Saver
+from bugscraper.metadata import FieldProjection, MetadataStore
+from bugscraper.storage import KINDS, Partitioning, backends
+from bugscraper.serialization import dumps, loads
+from bugscraper.index import index_path
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Ids are assigned to shards in contiguous blocks so every shard still fetches dense ranges
+SHARD_BLOCK_SIZE = 1000
+
+shard_dir_regex = re.compile(r'^shard-(\d+)-of-(\d+)$')
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    Shard k of N owns the bugs, comments and history of the id blocks whose index is k modulo N
+    The assignment only depends on the bug id, so shards never overlap whatever ranges they scrape
+    """
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls: 'Shard', value: str) -> 'Shard':
+        match = re.match(r'^(\d+)/(\d+)$', value)
+        if not match:
+            raise ValueError(f'Expected a shard as k/N, got {value}')
+        index, count = int(match.group(1)), int(match.group(2))
+        if not 0 <= index < count:
+            raise ValueError(f'Shard index must be in [0, {count}), got {index}')
+        return cls(index, count)
+
+    def owns(self, bug_id) -> bool:
+        return (int(bug_id) // SHARD_BLOCK_SIZE) % self.count == self.index
+
+    def filter(self, bug_ids: Iterable[int]) -> List[int]:
+        return [bug_id for bug_id in bug_ids if self.owns(bug_id)]
+
+    def save_dir(self, save_dir) -> Path:
+        return Path(save_dir, f'shard-{self.index}-of-{self.count}')
+
+    def seed_metadata(self, parent_dir, shard_dir):
+        """
+        Copy the metadata of the owned bugs from the parent directory to a shard without metadata
+        Lets a shard fetch comments and history for bugs scraped without sharding, into files
+        partitioned like the ones of the parent
+        """
+        partitioning = Partitioning.load(parent_dir)
+        if partitioning is not None and Partitioning.load(shard_dir) is None:
+            os.makedirs(shard_dir, exist_ok=True)
+            partitioning.save(shard_dir)
+        parent_path = PurePath(parent_dir, 'bug_metadata.jsonl')
+        shard_path = PurePath(shard_dir, 'bug_metadata.jsonl')
+        if os.path.exists(shard_path) or not os.path.exists(parent_path):
+            return
+        os.makedirs(shard_dir, exist_ok=True)
+        seeded = 0
+        with open(parent_path) as pf, open(shard_path, 'w') as sf:
+            for line in pf:
+                try:
+                    bug_id = loads(line)['bug_id']
+                except json.JSONDecodeError:
+                    continue
+                if self.owns(bug_id):
+                    sf.write(line)
+                    seeded += 1
+        logger.info(f'Seeded shard metadata with {seeded} bugs from {parent_path}')
+
+
+def shard_dirs(save_dir) -> List[Path]:
+    """
+    Return the shard directories below save_dir ordered by shard index
+    """
+    found = []
+    for name in os.listdir(save_dir):
+        match = shard_dir_regex.match(name)
+        if match and os.path.isdir(os.path.join(save_dir, name)):
+            found.append((int(match.group(2)), int(match.group(1)), Path(save_dir, name)))
+    return [path for _, _, path in sorted(found)]
+
+
+def load_failed(source_dir, kind: str) -> Set[int]:
+    failed_path = PurePath(source_dir, f'failed_{kind}.jsonl')
+    if not os.path.exists(failed_path):
+        return set()
+    with open(failed_path) as ff:
+        return {loads(line) for line in ff}
+
+
+def merge_shards(save_dir, sources: List[Path], backend: str = 'jsonl',
+                 compression: str = 'none') -> Dict[str, int]:
+    """
+    Merge the records, metadata and failed ids of save_dir and the source directories into save_dir
+    A bug stored more than once keeps its last record, later sources winning over earlier ones
+    and save_dir itself. The merged files are partitioned like the last source that records how it is
+    partitioned. Returns the number of records merged per kind
+    """
+    sources = [Path(save_dir)] + list(sources)
+    storages = [backends[backend](source) for source in sources]
+
+    # Metadata logs only provide the creation months the records are partitioned by
+    metadata = MetadataStore()
+    for source in sources:
+        metadata_path = PurePath(source, 'bug_metadata.jsonl')
+        if os.path.exists(metadata_path):
+            metadata.load(metadata_path)
+    partitioning = None
+    for source in sources:
+        partitioning = Partitioning.load(source) or partitioning
+
+    # First pass finds the position of the record that wins for every bug id
+    winners: Dict[str, Dict[int, Tuple[int, int]]] = {kind: {} for kind in KINDS}
+    scraped: Dict[str, List[Shard]] = {kind: [] for kind in KINDS}
+    for kind in KINDS:
+        for source_idx, storage in enumerate(storages):
+            seq = -1
+            for seq, (_, bug_id, _) in enumerate(storage.records(kind)):
+                winners[kind][bug_id] = (source_idx, seq)
+            match = shard_dir_regex.match(sources[source_idx].name)
+            if source_idx > 0 and match and seq >= 0:
+                scraped[kind].append(Shard(int(match.group(1)), int(match.group(2))))
+
+    tmp_dir = Path(save_dir, '.merge-tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    target = backends[backend](tmp_dir, compression, partitioning)
+    for kind in KINDS:
+        target.open(kind)
+        for source_idx, storage in enumerate(storages):
+            for seq, (year, bug_id, record) in enumerate(storage.records(kind)):
+                if winners[kind][bug_id] == (source_idx, seq):
+                    idx = metadata.index_of(bug_id)
+                    target.write(kind, year, bug_id, record, 0 if idx is None else metadata.months[idx])
+        logger.info(f'Merged {len(winners[kind])} {kind} records')
+    target.close()
+    for storage in storages:
+        storage.close()
+    if backend == 'jsonl':
+        # The merged files may use another compression than the ones they replace
+        for kind in KINDS:
+            for _, path in storages[0].partitions(kind):
+                os.remove(path)
+                for sidecar in (path + '.frames', index_path(path)):
+                    if os.path.exists(sidecar):
+                        os.remove(sidecar)
+    for name in os.listdir(tmp_dir):
+        os.replace(os.path.join(tmp_dir, name), os.path.join(save_dir, name))
+    os.rmdir(tmp_dir)
+
+    # A replayed log would take the comment ids and edits of the last source that saved the bug,
+    # whichever source the kept records came from, so the metadata is rebuilt from the merged records
+    saver = Saver(save_dir, backend)
+    saver.rebuild_metadata(KINDS)
+    saver.save_metadata(compact=True)
+    saver.storage.close()
+    projections = {}
+    for source in sources:
+        projections.update(FieldProjection.load_all(source))
+    if projections:
+        FieldProjection.save_all(save_dir, projections)
+
+    for kind in KINDS:
+        # Shards that scraped a kind know better than save_dir which of their ids still fail
+        failed = {bug_id for bug_id in load_failed(save_dir, kind)
+                  if not any(shard.owns(bug_id) for shard in scraped[kind])}
+        failed = failed.union(*(load_failed(source, kind) for source in sources[1:]))
+        failed.difference_update(winners[kind])
+        failed_path = PurePath(save_dir, f'failed_{kind}.jsonl')
+        if failed:
+            with open(failed_path, 'w') as ff:
+                for bug_id in sorted(failed):
+                    ff.write(dumps(bug_id) + '\n')
+        elif os.path.exists(failed_path):
+            os.remove(failed_path)
+    return {kind: len(winners[kind]) for kind in KINDS}
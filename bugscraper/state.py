@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent scrape state kept in the save directory."""
+import os
+import json
+import time
+import bisect
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+from dataclasses import dataclass, field, asdict
+from pathlib import PurePath
+from datetime import datetime, timedelta, timezone
+
+
+logger = logging.getLogger('bugscraper')
+
+# Safety margin for the difference between the local and the Bugzilla server clock
+CLOCK_SKEW_MINUTES = 10
+
+
+def atomic_write_json(path, obj: Any):
+    """
+    Write obj as json to a temporary file and move it over path
+    A crash at any point leaves either the old or the new file in place
+    """
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'w') as tf:
+        json.dump(obj, tf)
+        tf.flush()
+        os.fsync(tf.fileno())
+    os.replace(tmp_path, path)
+
+
+@dataclass
+class ScrapeState:
+    """
+    High-water mark of bug changes and the ids changed since the last comment/history scrape
+    """
+    last_change_time: Optional[str] = None
+    pending: Dict[str, List[int]] = field(default_factory=dict)
+
+    @staticmethod
+    def path(save_dir) -> PurePath:
+        return PurePath(save_dir, 'scrape_state.json')
+
+    @classmethod
+    def load(cls: 'ScrapeState', save_dir) -> 'ScrapeState':
+        state_path = cls.path(save_dir)
+        if not os.path.exists(state_path):
+            return cls()
+        with open(state_path) as sf:
+            return cls(**json.load(sf))
+
+    def save(self, save_dir):
+        atomic_write_json(self.path(save_dir), asdict(self))
+        logger.info('Saved scrape state, high-water mark is {}'.format(self.last_change_time))
+
+    def update(self, bug_list: Iterable[Any], pending_kinds: Iterable[str] = ()):
+        """
+        Queue the ids of bug_list for the given record kinds
+        """
+        bug_ids = [int(bug['id']) for bug in bug_list]
+        for kind in pending_kinds:
+            self.pending[kind] = sorted(set(self.pending.get(kind, [])).union(bug_ids))
+
+    def mark(self, started: datetime):
+        """
+        Move the high-water mark to the start of a successful run
+        Bugs changing while the run was in progress are fetched again by the next incremental run
+        """
+        started = started - timedelta(minutes=CLOCK_SKEW_MINUTES)
+        self.last_change_time = started.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def clear_pending(self, kind: str, bug_ids: Iterable[int]):
+        self.pending[kind] = sorted(set(self.pending.get(kind, [])).difference(bug_ids))
+
+
+def merge_intervals(intervals: Iterable[List[int]]) -> List[List[int]]:
+    """
+    Merge half open [start, end) intervals into a sorted list of disjoint intervals
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+@dataclass
+class Checkpoint:
+    """
+    Progress of a scrape command that allows resuming it exactly once
+    Completed ids are stored as merged intervals together with the flushed file offsets, the
+    size of the metadata log included, and the ids that failed so far. The scrape pipeline also
+    records the saved bugs still waiting for records of a kind and the failed ids of every record kind.
+    """
+    command: str = ''
+    done: List[List[int]] = field(default_factory=list)
+    offsets: Dict[str, int] = field(default_factory=dict)
+    failed: List[int] = field(default_factory=list)
+    pending: Dict[str, List[int]] = field(default_factory=dict)
+    failed_records: Dict[str, List[int]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.interval = 300
+        self.saved_at = time.monotonic()
+        self.new_ids: List[int] = []
+
+    @staticmethod
+    def path(save_dir, command: str) -> PurePath:
+        return PurePath(save_dir, f'checkpoint_{command}.json')
+
+    @classmethod
+    def load(cls: 'Checkpoint', save_dir, command: str) -> 'Checkpoint':
+        checkpoint_path = cls.path(save_dir, command)
+        if not os.path.exists(checkpoint_path):
+            return cls(command)
+        with open(checkpoint_path) as cf:
+            checkpoint = cls(**json.load(cf))
+        logger.info('Resuming {} with {} completed ranges'.format(command, len(checkpoint.done)))
+        return checkpoint
+
+    def add_done(self, bug_ids: Iterable[int]):
+        self.new_ids.extend(int(bug_id) for bug_id in bug_ids)
+
+    def is_done(self, bug_id: int) -> bool:
+        pos = bisect.bisect_right(self.done, [int(bug_id), float('inf')])
+        return pos > 0 and self.done[pos - 1][0] <= int(bug_id) < self.done[pos - 1][1]
+
+    def save(self, saver, failed_ids: Iterable[int]):
+        """
+        Flush the saver and persist its metadata, then atomically record the progress
+        Work done after this point is redone on resume and its writes are truncated
+        """
+        saver.flush()
+        saver.save_metadata()
+        self.done = merge_intervals(self.done + [[bug_id, bug_id + 1] for bug_id in self.new_ids])
+        self.new_ids = []
+        self.offsets = saver.offsets()
+        self.failed = sorted(failed_ids)
+        atomic_write_json(self.path(saver.save_dir, self.command), asdict(self))
+        self.saved_at = time.monotonic()
+        logger.debug('Saved checkpoint with {} completed ranges'.format(len(self.done)))
+
+    def maybe_save(self, saver, failed_ids: Iterable[int]) -> bool:
+        if time.monotonic() - self.saved_at < self.interval:
+            return False
+        self.save(saver, failed_ids)
+        return True
+
+    def remove(self, save_dir):
+        checkpoint_path = self.path(save_dir, self.command)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
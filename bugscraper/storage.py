@@ -0,0 +1,558 @@
+# -*- coding: utf-8 -*-
+
+"""Storage backends that savers write bugs, comments and history to."""
+import os
+import re
+import json
+import sqlite3
+import logging
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from pathlib import PurePath
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from bugscraper.compression import FramedWriter, compression_of, extensions, open_binary, plain_path, resolve
+from bugscraper.serialization import dumps, loads
+from bugscraper.index import IndexReader, index_path, open_index, scan_partitions, summarize
+from bugscraper.state import atomic_write_json
+
+
+logger = logging.getLogger('bugscraper')
+
+
+# Record kinds written by the savers
+KINDS = ('bugs', 'comments', 'history')
+
+# Ways records can be split into files
+GRANULARITIES = ('year', 'month', 'id-range')
+
+
+@dataclass(frozen=True)
+class Partitioning:
+    """
+    How records are split into files, always within the creation year of their bug
+    Month partitions follow the creation month of the bug, id-range partitions blocks of id_range ids.
+    A save directory keeps the partitioning it was first written with, so a bug never ends up in two files.
+    """
+    granularity: str = 'year'
+    id_range: int = 100000
+
+    def __post_init__(self):
+        if self.granularity not in GRANULARITIES:
+            raise ValueError(f'Unknown partition granularity {self.granularity}')
+        if self.id_range < 1:
+            raise ValueError(f'Id ranges must hold at least one id, got {self.id_range}')
+
+    def label(self, year: int, month: int, bug_id: int) -> str:
+        """
+        Name of the partition of a bug, an unknown month of 0 falls back to the year
+        """
+        if self.granularity == 'month' and month:
+            return f'{year}-{month:02d}'
+        if self.granularity == 'id-range':
+            return f'{year}-id{int(bug_id) // self.id_range * self.id_range}'
+        return str(year)
+
+    @staticmethod
+    def path(save_dir) -> PurePath:
+        return PurePath(save_dir, 'partitioning.json')
+
+    @classmethod
+    def load(cls: 'Partitioning', save_dir) -> Optional['Partitioning']:
+        partitioning_path = cls.path(save_dir)
+        if not os.path.exists(partitioning_path):
+            return None
+        with open(partitioning_path) as pf:
+            return cls(**json.load(pf))
+
+    def save(self, save_dir):
+        atomic_write_json(self.path(save_dir), asdict(self))
+
+
+def creation_month(bug: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Return the year and month a bug was created in
+    """
+    created = bug['creation_time']
+    return int(created[:4]), int(created[5:7])
+
+
+class StorageBackend(object):
+    """
+    Interface of the storage savers write records to
+    A record is a bug for kind bugs and the list of comments or history entries of a bug otherwise
+    """
+    def __init__(self, save_dir, compression: str = 'none', partitioning: Optional[Partitioning] = None,
+                 max_open: int = 64):
+        self.save_dir = save_dir
+        self.compression = compression
+
+    def open(self, kind: str):
+        """
+        Prepare writing records of kind
+        """
+        pass
+
+    def write(self, kind: str, year: int, bug_id: int, record: Any, month: int = 0):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    # Positions that truncate restores, only meaningful right after flush
+    def offsets(self) -> Dict[str, int]:
+        return {}
+
+    def truncate(self, offsets: Dict[str, int]):
+        pass
+
+    def records(self, kind: str) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Yield the (year, bug id, record) of every stored record of kind, ordered by year
+        """
+        raise NotImplementedError
+
+    def bug_years(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yield the (bug id, year) of every stored bug
+        """
+        for year, bug_id, _ in self.records('bugs'):
+            yield bug_id, year
+
+    def get(self, kind: str, bug_id: int) -> Optional[Any]:
+        """
+        Return the stored record of kind of a bug, None if there is none
+        """
+        found = None
+        for _, record_id, record in self.records(kind):
+            if record_id == int(bug_id):
+                found = record
+        return found
+
+    def select(self, kind: str, year: int = None, start: int = None,
+               end: int = None) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Yield the (year, bug id, record) of the records of kind of a year and bug ids in [start, end)
+        """
+        for record_year, bug_id, record in self.records(kind):
+            if year is not None and record_year != year:
+                continue
+            if (start is None or bug_id >= start) and (end is None or bug_id < end):
+                yield record_year, bug_id, record
+
+    def compact(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Drop every stored record but the newest of each bug, returns the records kept and dropped per kind
+        """
+        return {}
+
+    def scan(self, kind: str, workers: int = None) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Yield the (year, bug id, summary) of every stored record of kind, see index.summarize
+        The summary of a bug is its creation month when the storage knows it, None otherwise
+        """
+        if kind == 'bugs':
+            for bug_id, year in self.bug_years():
+                yield year, bug_id, None
+            return
+        for year, bug_id, records in self.records(kind):
+            yield year, bug_id, summarize(kind, records)
+
+    def close(self):
+        pass
+
+
+# Suffix of the json lines files of each kind
+suffixes = {'bugs': '', 'comments': '_comments', 'history': '_history'}
+
+# Regex to capture year name in file, followed by the month or id range of finer partitions,
+# compressed files included
+partition_regex = {
+    kind: re.compile(r'^((?:19|20)\d{2})(?:-(\d{2}|id\d+))?' + suffix + r'\.jsonl(?:\.gz|\.zst)?$')
+    for kind, suffix in suffixes.items()
+}
+
+
+def partition_month(kind: str, path) -> int:
+    """
+    Return the month of a month partition, 0 for any other file
+    """
+    match = partition_regex[kind].match(os.path.basename(str(path)))
+    sub_partition = match.group(2) if match else None
+    return int(sub_partition) if sub_partition and sub_partition.isdigit() else 0
+
+
+def recorded_partitioning(save_dir) -> Optional[Partitioning]:
+    """
+    Return the partitioning a save directory was written with, None for a directory without records
+    Directories written before the partitioning was recorded hold year files
+    """
+    partitioning = Partitioning.load(save_dir)
+    if partitioning is None and os.path.isdir(save_dir):
+        names = os.listdir(save_dir)
+        if any(partition_regex[kind].match(name) for kind in KINDS for name in names):
+            return Partitioning()
+    return partitioning
+
+
+class HandlePool(object):
+    """
+    Append handles opened on first use, at most max_open of them at a time
+    The least recently used handle is flushed, synced and closed to make room for a new one
+    """
+    def __init__(self, opener: Callable[[Any], Any], max_open: int = 64):
+        self.opener = opener
+        self.max_open = max(1, max_open)
+        self.handles: 'OrderedDict[Any, Any]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def __iter__(self):
+        return iter(self.handles.values())
+
+    @staticmethod
+    def sync(fileobj):
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+
+    def get(self, key) -> Any:
+        fileobj = self.handles.get(key)
+        if fileobj is not None:
+            self.handles.move_to_end(key)
+            return fileobj
+        while len(self.handles) >= self.max_open:
+            _, evicted = self.handles.popitem(last=False)
+            self.sync(evicted)
+            evicted.close()
+            logger.debug(f'Closed least recently used file {evicted.name}')
+        fileobj = self.handles[key] = self.opener(key)
+        return fileobj
+
+    def close(self):
+        for fileobj in self.handles.values():
+            fileobj.close()
+        self.handles = OrderedDict()
+
+
+def line_bug_id(kind: str, line: bytes) -> int:
+    """
+    Return the bug id of a json lines record, -1 for a malformed line
+    """
+    try:
+        record = loads(line)
+        return int(record['id'] if kind == 'bugs' else next(iter(record)))
+    except (ValueError, KeyError, TypeError, StopIteration):
+        return -1
+
+
+def compact_partition(path, kind: str) -> Tuple[int, int]:
+    """
+    Rewrite a json lines file with only the last line of every bug, returns the lines kept and dropped
+    Memory is bounded by one integer per line and one bit per bug id of the file. Malformed lines,
+    like a partial last line left by a crash, are dropped as well.
+    """
+    bug_ids = array('q')
+    low, high = None, -1
+    with open_binary(path) as rf:
+        for line in rf:
+            bug_id = line_bug_id(kind, line) if line.endswith(b'\n') else -1
+            bug_ids.append(bug_id)
+            if bug_id >= 0:
+                low = bug_id if low is None else min(low, bug_id)
+                high = max(high, bug_id)
+    if low is None:
+        low = 0
+
+    # Walk backwards so the first line seen of a bug is its newest
+    seen = bytearray((high - low) // 8 + 1)
+    keep = bytearray(len(bug_ids) // 8 + 1)
+    kept = 0
+    for line_no in range(len(bug_ids) - 1, -1, -1):
+        bug_id = bug_ids[line_no]
+        if bug_id < 0:
+            continue
+        bit = bug_id - low
+        if not seen[bit >> 3] & (1 << (bit & 7)):
+            seen[bit >> 3] |= 1 << (bit & 7)
+            keep[line_no >> 3] |= 1 << (line_no & 7)
+            kept += 1
+    dropped = len(bug_ids) - kept
+    if not dropped:
+        return kept, 0
+
+    path = str(path)
+    tmp_path = path + '.compact-tmp'
+    compression = compression_of(path)
+    if compression == 'none':
+        wf = open(tmp_path, 'w', encoding='utf-8')
+    else:
+        wf = FramedWriter(tmp_path, compression)
+    with open_binary(path) as rf:
+        for line_no, line in enumerate(rf):
+            if keep[line_no >> 3] & (1 << (line_no & 7)):
+                wf.write(line.decode('utf-8'))
+    wf.flush()
+    os.fsync(wf.fileno())
+    wf.close()
+    if os.path.exists(index_path(path)):
+        os.remove(index_path(path))
+    os.replace(tmp_path, path)
+    if compression != 'none':
+        os.replace(tmp_path + '.frames', path + '.frames')
+    return kept, dropped
+
+
+class JsonlBackend(StorageBackend):
+    """
+    Stores records in json lines files per partition, comments and history lines map the bug id to its records
+    Partitions are opened on their first write through a pool that keeps at most max_open files open.
+    With compression the files are written as gzip or zstd frames and get a .gz or .zst extension
+    """
+    def __init__(self, save_dir, compression: str = 'none', partitioning: Optional[Partitioning] = None,
+                 max_open: int = 64):
+        super().__init__(save_dir, resolve(compression))
+        self.recorded = recorded_partitioning(save_dir)
+        if partitioning is not None and self.recorded is not None and partitioning != self.recorded:
+            raise ValueError(f'{save_dir} is partitioned by {self.recorded}, cannot write {partitioning}')
+        self.partitioning = partitioning or self.recorded or Partitioning()
+        self.kinds = set()
+        self.fileobjs = HandlePool(self.open_partition, max_open)
+        self.readers: Dict[str, IndexReader] = {}
+
+    def open(self, kind: str):
+        if not os.path.exists(Partitioning.path(self.save_dir)):
+            self.partitioning.save(self.save_dir)
+            self.recorded = self.partitioning
+        self.kinds.add(kind)
+
+    def open_partition(self, filepath: str):
+        # Keep appending to an existing file so that a partition never ends up in two files
+        compression = next(
+            (compression for compression, extension in extensions.items()
+             if os.path.exists(filepath + extension)), self.compression
+        )
+        if compression == 'none':
+            return open(filepath, 'a', encoding='utf-8')
+        return FramedWriter(filepath + extensions[compression], compression)
+
+    def write(self, kind: str, year: int, bug_id: int, record: Any, month: int = 0):
+        label = self.partitioning.label(year, month, bug_id)
+        if kind != 'bugs':
+            record = {str(bug_id): record}
+        filepath = os.path.join(self.save_dir, label + suffixes[kind] + '.jsonl')
+        self.fileobjs.get(filepath).write(dumps(record) + '\n')
+
+    def flush(self):
+        for fileobj in self.fileobjs:
+            HandlePool.sync(fileobj)
+
+    def offsets(self) -> Dict[str, int]:
+        """
+        Sizes of every file of the opened kinds, open or not
+        """
+        offsets = {}
+        for kind in self.kinds:
+            for _, path in self.partitions(kind):
+                offsets[os.path.basename(path)] = os.path.getsize(path)
+        offsets.update({os.path.basename(fileobj.name): fileobj.tell() for fileobj in self.fileobjs})
+        return offsets
+
+    def truncate(self, offsets: Dict[str, int]):
+        """
+        Cut the files of the opened kinds back to offsets, files missing from them were created later
+        and are emptied. Without any offset nothing is known about the files and all are kept.
+        """
+        if not offsets:
+            return
+        for kind in self.kinds:
+            for _, path in self.partitions(kind):
+                filename = os.path.basename(path)
+                size = offsets.get(filename, 0)
+                if os.path.getsize(path) == size:
+                    continue
+                # Handles are keyed by the path without the compression extension
+                fileobj = self.fileobjs.get(plain_path(path))
+                fileobj.truncate(size)
+                fileobj.seek(0, os.SEEK_END)
+                # The index may cover the dropped lines, the next scan rebuilds it
+                if os.path.exists(index_path(path)):
+                    os.remove(index_path(path))
+
+    def partitions(self, kind: str) -> List[Tuple[int, str]]:
+        """
+        Return the (year, path) of every json lines file of kind, ordered by year
+        """
+        partitions = []
+        for filename in os.listdir(self.save_dir):
+            match = partition_regex[kind].match(filename)
+            if match:
+                partitions.append((int(match.group(1)), os.path.join(self.save_dir, filename)))
+        return sorted(partitions)
+
+    def compact(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Compact every file in turn, the newest record of a bug is its last line
+        """
+        counts = {}
+        for kind in KINDS:
+            kept, dropped = 0, 0
+            for _, filepath in self.partitions(kind):
+                reader = self.readers.pop(filepath, None)
+                if reader is not None:
+                    reader.close()
+                file_kept, file_dropped = compact_partition(filepath, kind)
+                logger.info(f'Compacted {filepath}: kept {file_kept} records, dropped {file_dropped}')
+                kept += file_kept
+                dropped += file_dropped
+            counts[kind] = (kept, dropped)
+        return counts
+
+    def scan(self, kind: str, workers: int = None) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Index the files of kind in parallel processes while collecting their summaries
+        Bugs of month partitions are summarized by the month of their file
+        """
+        partitions = self.partitions(kind)
+        results = scan_partitions(kind, partitions, workers)
+        for (_, path), (year, summaries) in zip(partitions, results):
+            month = partition_month(kind, path) if kind == 'bugs' else 0
+            for bug_id, summary in summaries:
+                yield year, bug_id, month or summary
+
+    def reader(self, kind: str, filepath: str) -> IndexReader:
+        if filepath not in self.readers:
+            self.readers[filepath] = open_index(filepath, kind)
+        return self.readers[filepath]
+
+    def parse(self, kind: str, line: bytes) -> Any:
+        record = loads(line)
+        if kind == 'bugs':
+            return record
+        return next(iter(record.values()))
+
+    def get(self, kind: str, bug_id: int) -> Optional[Any]:
+        """
+        Look the bug up in the index of every file of kind, a few binary searches instead of a scan
+        """
+        found = None
+        for _, filepath in self.partitions(kind):
+            reader = self.reader(kind, filepath)
+            entry = reader.lookup(bug_id)
+            if entry is not None:
+                found = self.parse(kind, reader.read(entry))
+        return found
+
+    def select(self, kind: str, year: int = None, start: int = None,
+               end: int = None) -> Iterator[Tuple[int, int, Any]]:
+        """
+        Read the records through the index, in id order within every year
+        """
+        for record_year, filepath in self.partitions(kind):
+            if year is not None and record_year != year:
+                continue
+            reader = self.reader(kind, filepath)
+            for bug_id, entry in reader.entries(start, end):
+                yield record_year, bug_id, self.parse(kind, reader.read(entry))
+
+    def records(self, kind: str) -> Iterator[Tuple[int, int, Any]]:
+        for year, filepath in self.partitions(kind):
+            with open_binary(filepath) as rf:
+                for line in rf:
+                    record = loads(line)
+                    if kind == 'bugs':
+                        yield year, int(record['id']), record
+                    else:
+                        for bug_id, bug_records in record.items():
+                            yield year, int(bug_id), bug_records
+
+    def close(self):
+        self.fileobjs.close()
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Stores records in a SQLite database with one table per kind keyed by bug id
+    Rows are upserted in batched transactions, so re-scraping a bug replaces it
+    Records are stored uncompressed whatever compression is asked for, and unpartitioned
+    """
+    def __init__(self, save_dir, compression: str = 'none', partitioning: Optional[Partitioning] = None,
+                 max_open: int = 64, batch_size: int = 1000):
+        super().__init__(save_dir, compression)
+        self.batch_size = batch_size
+        self.pending: Dict[str, List[Tuple[int, int, str]]] = {kind: [] for kind in KINDS}
+        self.conn = sqlite3.connect(os.path.join(save_dir, 'bugs.sqlite'))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for kind in KINDS:
+            self.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {kind} (bug_id INTEGER PRIMARY KEY, year INTEGER, data TEXT)'
+            )
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS {kind}_year ON {kind} (year)')
+        self.conn.commit()
+
+    def write(self, kind: str, year: int, bug_id: int, record: Any, month: int = 0):
+        self.pending[kind].append((int(bug_id), year, dumps(record)))
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.conn:
+            for kind, rows in self.pending.items():
+                if rows:
+                    self.conn.executemany(f'INSERT OR REPLACE INTO {kind} VALUES (?, ?, ?)', rows)
+                    rows.clear()
+
+    def records(self, kind: str) -> Iterator[Tuple[int, int, Any]]:
+        self.flush()
+        for year, bug_id, data in self.conn.execute(f'SELECT year, bug_id, data FROM {kind} ORDER BY year'):
+            yield year, bug_id, loads(data)
+
+    def bug_years(self) -> Iterator[Tuple[int, int]]:
+        self.flush()
+        yield from self.conn.execute('SELECT bug_id, year FROM bugs')
+
+    def get(self, kind: str, bug_id: int) -> Optional[Any]:
+        self.flush()
+        row = self.conn.execute(f'SELECT data FROM {kind} WHERE bug_id = ?', (int(bug_id),)).fetchone()
+        return None if row is None else loads(row[0])
+
+    def select(self, kind: str, year: int = None, start: int = None,
+               end: int = None) -> Iterator[Tuple[int, int, Any]]:
+        self.flush()
+        conditions, params = [], []
+        for condition, value in (('year = ?', year), ('bug_id >= ?', start), ('bug_id < ?', end)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        query = f'SELECT year, bug_id, data FROM {kind}{where} ORDER BY year, bug_id'
+        for record_year, bug_id, data in self.conn.execute(query, params):
+            yield record_year, bug_id, loads(data)
+
+    def compact(self) -> Dict[str, Tuple[int, int]]:
+        """
+        Rows are already unique per bug, vacuuming only reclaims the space of replaced rows
+        """
+        self.flush()
+        counts = {}
+        for kind in KINDS:
+            counts[kind] = (self.conn.execute(f'SELECT COUNT(*) FROM {kind}').fetchone()[0], 0)
+        self.conn.execute('VACUUM')
+        return counts
+
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+
+backends = {
+    'jsonl': JsonlBackend,
+    'sqlite': SqliteBackend
+}
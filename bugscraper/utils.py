@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
-import json
 from pathlib import Path
+from bugscraper.filtering import BugFilter
+from bugscraper.compression import open_binary
+from bugscraper.storage import JsonlBackend
+from typing import Iterable, Set
 
 
 def divide_chunks(l, n):
@@ -10,20 +13,15 @@ def divide_chunks(l, n):
         yield l[i:i + n]
 
 
+# Failed ids from an earlier run stay recorded unless they were attempted again
+def merge_failed(previous: Iterable[int], attempted: Iterable[int], failed: Iterable[int]) -> Set[int]:
+    return (set(previous) - set(attempted)) | set(failed)
+
+
 def mozilla_filter(save_path: Path):
-    years = set()
-
-    products = ['Core', 'Firefox']
-
-    # Reading the metadata file to get years
-    with open(Path(save_path, 'bug_metadata.jsonl')) as mf:
-        for line in mf:
-            meta = json.loads(line)
-            years.add(meta['year'])
-
-    for year in years:
-        with open(Path(save_path, str(year) + '.jsonl')) as bf:
-            for bugrec in bf:
-                bug = json.loads(bugrec)
-                if bug['product'] in products:
-                    yield bug
+    bug_filter = BugFilter({'product': ['Core', 'Firefox']})
+
+    for year, path in JsonlBackend(save_path).partitions('bugs'):
+        with open_binary(path) as bf:
+            for _, bug in bug_filter.filter_lines(bf):
+                yield bug
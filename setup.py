@@ -11,7 +11,9 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['Click>=7.0', 'tqdm>=4.0', 'requests>=2.22', 'overrides>=2.5']
+requirements = ['Click>=7.0', 'tqdm>=4.0', 'requests>=2.27', 'overrides>=2.5']
+
+extra_requirements = {'export': ['pyarrow>=1.0'], 'zstd': ['zstandard>=0.15'], 'fast': ['orjson>=3.0']}
 
 setup_requirements = ['pytest-runner', ]
 
@@ -41,6 +43,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -5,9 +5,11 @@
 
 import pytest
 import json
+import requests
 from click.testing import CliRunner
 
-from bugscraper.bugscraper import BugzillaBugApi, BugSaver
+from bugscraper.bugscraper import (BugzillaBugApi, BugzillaCommentApi, BugzillaHistoryApi, BugSaver,
+                                   custom_subdomains)
 from bugscraper import cli
 
 
@@ -51,3 +53,85 @@ def test_bug_saver(tmp_path):
 
     assert test_bug_file.exists()
     assert json.loads(test_bug_file.read_text()) == sim_bug
+
+
+def test_failed_fetch_is_recorded(monkeypatch):
+    monkeypatch.setitem(custom_subdomains, 'offline', 'http://127.0.0.1:1/rest/bug')
+    api = BugzillaCommentApi('offline', retries=0)
+    assert api.fetch(42) is None
+    assert api.failed_ids == {42}
+
+
+class FakeResponse(object):
+    def __init__(self, payload):
+        self.payload = payload
+        self.content = json.dumps(payload).encode()
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def test_comment_fetch_many_splits_bugs(monkeypatch):
+    api = BugzillaCommentApi('kernel')
+    payload = {'bugs': {'1': {'comments': [{'id': 10}]}, '2': {'comments': []}}, 'comments': {}}
+    monkeypatch.setattr(api.session, 'get', lambda url, params, timeout: FakeResponse(payload))
+    comment_map = api.fetch_many([1, 2, 3])
+    assert comment_map == {'1': [{'id': 10}], '2': []}
+    assert api.failed_ids == {3}
+
+
+def rejecting_get(bad_id, records):
+    """
+    A session get answering 404 to any batch naming bad_id, like Bugzilla does for a deleted bug
+    """
+    requested = []
+
+    def get(url, params, timeout):
+        bug_ids = [url.split('/')[-2]] + params['ids']
+        requested.append(bug_ids)
+        if bad_id in bug_ids:
+            response = requests.Response()
+            response.status_code = 404
+            response.url = url
+            return response
+        return FakeResponse(records(bug_ids))
+    return get, requested
+
+
+@pytest.mark.parametrize('api_cls', [BugzillaCommentApi, BugzillaHistoryApi])
+def test_fetch_many_isolates_rejected_bug(monkeypatch, api_cls):
+    api = api_cls('kernel')
+    if api_cls is BugzillaCommentApi:
+        def records(bug_ids):
+            return {'bugs': {bug_id: {'comments': [{'id': 1}]} for bug_id in bug_ids}}
+    else:
+        def records(bug_ids):
+            return {'bugs': [{'id': int(bug_id), 'history': [{'id': 1}]} for bug_id in bug_ids]}
+    get, requested = rejecting_get('3', records)
+    monkeypatch.setattr(api.session, 'get', get)
+    assert api.fetch_many([]) == {}
+    assert requested == []
+
+    record_map = api.fetch_many([1, 2, 3, 4, 5])
+    assert sorted(record_map) == ['1', '2', '4', '5']
+    assert api.failed_ids == {3}
+    assert requested[0] == ['1', '2', '3', '4', '5']
+    assert ['3'] in requested
+
+
+def test_field_projection_keeps_required_fields(monkeypatch):
+    api = BugzillaBugApi('kernel', include_fields=['product', 'status'], exclude_fields=['id', 'cc'])
+    assert api.fields == {'include_fields': 'creation_time,id,product,status', 'exclude_fields': 'cc'}
+    requested = []
+
+    def get(url, params, timeout):
+        requested.append(params)
+        return FakeResponse({'bugs': []})
+
+    monkeypatch.setattr(api.session, 'get', get)
+    api.fetch([1, 2])
+    assert requested[0]['include_fields'] == 'creation_time,id,product,status'
+    assert BugzillaCommentApi('kernel').fields == {}
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.cache` module."""
+
+import os
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from bugscraper.cache import ResponseCache
+from bugscraper.bugscraper import BugzillaHistoryApi
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=2500)
+    # Random bytes do not compress, every response takes about 700 bytes
+    payload = os.urandom(700)
+    for idx in range(3):
+        cache.put(f'url{idx}', payload, etag=f'"{idx}"')
+    cache.get('url0')
+    cache.put('url3', payload)
+    assert cache.size <= 2500
+    assert cache.get('url0').etag == '"0"'
+    assert cache.get('url1') is None
+    assert cache.get('url3').body == payload
+    cache.close()
+
+
+def test_conditional_requests(tmp_path, monkeypatch):
+    sent = []
+
+    def send(adapter, request, **kwargs):
+        sent.append(request.headers.get('If-None-Match'))
+        response = requests.Response()
+        response.request, response.url = request, request.url
+        if request.headers.get('If-None-Match') == '"v1"':
+            response.status_code = 304
+        else:
+            response.status_code = 200
+            response._content = b'{"bugs": [{"id": 1, "history": [{"who": "a"}]}]}'
+            response.headers['ETag'] = '"v1"'
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, 'send', send)
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'))
+    api = BugzillaHistoryApi('kde', cache=cache)
+    assert api.fetch(1) == [{'who': 'a'}]
+    assert api.fetch(1) == [{'who': 'a'}]
+    assert sent == [None, '"v1"']
+
+    cache.offline = True
+    assert api.fetch(1) == [{'who': 'a'}]
+    assert api.fetch(2) is None
+    assert api.failed_ids == {2}
+    assert len(sent) == 2
+    with pytest.raises(requests.exceptions.ConnectionError):
+        api.session.get(str(api) + '/3/history')
+    cache.close()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.compression` module."""
+
+import json
+import pytest
+
+from bugscraper.compression import FramedWriter, extensions, frames, open_binary, read_frame
+from bugscraper.storage import JsonlBackend
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zstd'])
+def test_framed_writer_round_trip(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    path = str(tmp_path / ('2002.jsonl' + extensions[compression]))
+    writer = FramedWriter(path, compression, block_size=100)
+    lines = [json.dumps({'id': bug_id, 'summary': 'x' * 30}) + '\n' for bug_id in range(20)]
+    for line in lines[:10]:
+        writer.write(line)
+    writer.flush()
+    offset = writer.tell()
+    for line in lines[10:]:
+        writer.write(line)
+    writer.flush()
+
+    with open_binary(path) as rf:
+        assert [line.decode('utf-8') for line in rf] == lines
+    first, length = frames(path)[0]
+    assert read_frame(path, first, length).decode('utf-8').startswith(lines[0])
+
+    # Truncating to a flushed offset drops whole frames
+    writer.truncate(offset)
+    writer.seek(0, 2)
+    writer.close()
+    with open_binary(path) as rf:
+        assert [line.decode('utf-8') for line in rf] == lines[:10]
+    assert all(start < offset for start, _ in frames(path))
+
+
+def test_compressed_backend_records(tmp_path):
+    storage = JsonlBackend(tmp_path, 'gzip')
+    storage.open('comments')
+    storage.write('comments', 2003, 7, [{'id': 70}])
+    storage.close()
+    assert (tmp_path / '2003_comments.jsonl.gz').exists()
+    assert list(JsonlBackend(tmp_path).records('comments')) == [(2003, 7, [{'id': 70}])]
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.corpus` module."""
+
+import pytest
+
+from bugscraper.corpus import Corpus, CorpusBug
+from bugscraper.storage import backends
+
+
+@pytest.fixture(params=['jsonl', 'jsonl-gzip', 'sqlite'])
+def save_dir(request, tmp_path):
+    backend, _, compression = request.param.partition('-')
+    storage = backends[backend](tmp_path, compression or 'none')
+    storage.open('bugs')
+    storage.open('comments')
+    storage.open('history')
+    for bug_id in range(1, 30):
+        year = 2002 if bug_id % 2 else 2003
+        storage.write('bugs', year, bug_id, {'id': bug_id, 'summary': str(bug_id)})
+        storage.write('comments', year, bug_id, [{'id': bug_id * 10}])
+    storage.write('history', 2002, 3, [{'when': 'x'}])
+    storage.write('bugs', 2002, 5, {'id': 5, 'summary': 'updated'})
+    storage.close()
+    return tmp_path, backend
+
+
+def test_get(save_dir):
+    with Corpus(*save_dir) as corpus:
+        assert corpus.get(3) == CorpusBug({'id': 3, 'summary': '3'}, [{'id': 30}], [{'when': 'x'}])
+        assert corpus.get(4).history == []
+        assert corpus.get(5).bug['summary'] == 'updated'
+        assert corpus.get(100) is None
+
+
+def test_iterate(save_dir):
+    with Corpus(*save_dir) as corpus:
+        assert [bug.bug['id'] for bug in corpus.bugs(year=2003, start=10, end=16)] == [10, 12, 14]
+        assert [comments[0]['id'] for comments in corpus.records('comments', start=27)] == [270, 290, 280]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.discovery` module."""
+
+import json
+import requests
+
+from bugscraper.engine import FetchEngine
+from bugscraper.discovery import SparseChunker, find_max_id
+
+
+class FakeBugApi(object):
+    """Serves the bugs in existing, the search for the newest bug returns newest"""
+    host = 'bugzilla.example.org'
+
+    def __init__(self, existing, newest=None):
+        self.existing = set(existing)
+        self.newest = newest
+        self.failed_ids = set()
+        self.requested = []
+        self.probe_fields = []
+
+    def newest_id(self):
+        return self.newest
+
+    def get_bugs(self, bug_ids, fields=None):
+        self.probe_fields.append(fields)
+        response = requests.Response()
+        response.status_code = 200
+        bugs = [{'id': bug_id} for bug_id in bug_ids if bug_id in self.existing]
+        response._content = json.dumps({'bugs': bugs}).encode()
+        return response
+
+    def fetch(self, bug_ids):
+        self.requested.extend(bug_ids)
+        return [{'id': bug_id} for bug_id in bug_ids if bug_id in self.existing]
+
+
+def test_find_max_id_probes_past_holes():
+    existing = [bug_id for bug_id in range(1, 123457) if bug_id % 7]
+    api = FakeBugApi(existing)
+    assert find_max_id(api, window=50) == 123456
+    assert all(fields == {'include_fields': 'id'} for fields in api.probe_fields)
+    # A stale newest bug is only a starting point
+    assert find_max_id(FakeBugApi(existing, newest=100000), window=50) == 123456
+
+
+def test_find_max_id_without_bugs():
+    assert find_max_id(FakeBugApi([]), start=10) is None
+
+
+def test_sparse_chunker_skips_empty_ranges():
+    existing = set(range(1, 2001)) | set(range(50001, 52001))
+    api = FakeBugApi(existing)
+    chunker = SparseChunker(range(1, 60001), chunk_size=500, empty_chunks=3, stride_chunks=4, sample_size=20)
+    engine = FetchEngine(workers=1)
+    fetched, handed_out = [], []
+    for chunk, bug_list in engine.run(lambda chunk: chunker.fetch(api, chunk), chunker):
+        handed_out.extend(chunk)
+        fetched.extend(bug['id'] for bug in bug_list or [])
+
+    assert sorted(fetched) == sorted(existing)
+    assert handed_out == list(range(1, 60001))
+    assert chunker.skipped > 0
+    assert len(api.requested) == 60000 - chunker.skipped
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.engine` module."""
+
+import time
+import json
+import random
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from bugscraper import bugscraper
+from bugscraper.bugscraper import BugzillaBugApi
+from bugscraper.engine import FetchEngine, AdaptiveChunker
+
+
+def test_engine_preserves_order():
+    def fetch(task):
+        time.sleep(random.random() / 100)
+        return task * 2
+
+    engine = FetchEngine(workers=4)
+    results = list(engine.run(fetch, range(50)))
+    assert results == [(i, i * 2) for i in range(50)]
+
+
+class FakeBugApi(object):
+    """Rejects any chunk larger than max_ids with 413"""
+    def __init__(self, max_ids):
+        self.max_ids = max_ids
+        self.failed_ids = set()
+
+    def get_bugs(self, bug_ids):
+        response = requests.Response()
+        if len(bug_ids) > self.max_ids:
+            response.status_code = 413
+            raise requests.exceptions.HTTPError(response=response)
+        response.status_code = 200
+        response._content = json.dumps({'bugs': [{'id': bug_id} for bug_id in bug_ids]}).encode()
+        return response
+
+
+def test_adaptive_chunker_splits_and_grows():
+    api = FakeBugApi(max_ids=30)
+    chunker = AdaptiveChunker(range(1, 501), chunk_size=100)
+    engine = FetchEngine(workers=2)
+    fetched = []
+    for _, bug_list in engine.run(lambda chunk: chunker.fetch(api, chunk), chunker):
+        fetched.extend(bug['id'] for bug in bug_list or [])
+
+    assert sorted(fetched) == list(range(1, 501))
+    assert not api.failed_ids
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Answers single ids right away and stalls past the client timeout on larger chunks"""
+    def do_GET(self):
+        bug_ids = parse_qs(urlparse(self.path).query).get('id', [])
+        if len(bug_ids) > 1:
+            time.sleep(0.5)
+        body = json.dumps({'bugs': [{'id': int(bug_id)} for bug_id in bug_ids]}).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except ConnectionError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def test_adaptive_chunker_splits_timed_out_chunks(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/rest/bug'
+    monkeypatch.setitem(bugscraper.custom_subdomains, 'slow', url)
+    try:
+        # Retried timeouts reach the chunker as a ConnectionError wrapping the urllib3 timeout
+        api = BugzillaBugApi('slow', retries=1, backoff_factor=0, timeout=0.2)
+        chunker = AdaptiveChunker(range(1, 5), chunk_size=4)
+        fetched = []
+        for _, bug_list in FetchEngine(workers=1).run(lambda chunk: chunker.fetch(api, chunk), chunker):
+            fetched.extend(bug['id'] for bug in bug_list or [])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert sorted(fetched) == [1, 2, 3, 4]
+    assert not api.failed_ids
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.export` module."""
+
+import pytest
+
+from bugscraper.bugscraper import BugSaver, HistorySaver
+from bugscraper import export
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+
+def test_export_history_parquet(tmp_path):
+    save_dir = tmp_path / 'bugs'
+    saver = BugSaver(save_dir)
+    saver.save([{'id': 1, 'creation_time': '2002-11-14T04:48:24Z', 'product': 'Core'}])
+    saver.flush()
+    saver.save_metadata()
+    history_saver = HistorySaver(save_dir)
+    changes = [{'field_name': 'status', 'removed': 'NEW', 'added': 'FIXED'}]
+    history_saver.save(0, [{'who': 'dev', 'when': '2003-01-01T00:00:00Z', 'changes': changes}])
+    history_saver.flush()
+
+    assert export.export(saver.storage, 'bugs', tmp_path / 'out') == 1
+    assert export.export(history_saver.storage, 'history', tmp_path / 'out') == 1
+    bugs = pq.read_table(tmp_path / 'out' / 'bugs' / '2002' / 'part-0.parquet').to_pylist()
+    history = pq.read_table(tmp_path / 'out' / 'history' / '2002' / 'part-0.parquet').to_pylist()
+    assert bugs[0]['product'] == 'Core' and bugs[0]['extra'] is None
+    assert history[0]['added'] == 'FIXED' and history[0]['when'].year == 2003
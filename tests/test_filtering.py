@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.filtering` module."""
+
+import json
+from click.testing import CliRunner
+
+from bugscraper import cli
+from bugscraper.bugscraper import BugSaver
+from bugscraper.filtering import BugFilter, filter_partitions
+from bugscraper.storage import Partitioning
+
+
+def test_filter_partitions(tmp_path):
+    bugs = [
+        {'id': 1, 'product': 'Core', 'creation_time': '2002-03-01T00:00:00Z'},
+        {'id': 2, 'product': 'Firefox', 'creation_time': '2002-06-01T00:00:00Z'},
+        {'id': 3, 'product': 'Firefox', 'creation_time': '2002-01-01T00:00:00Z'},
+    ]
+    in_path = tmp_path / '2002.jsonl'
+    in_path.write_text(''.join(json.dumps(bug) + '\n' for bug in bugs))
+
+    bug_filter = BugFilter({'product': ['Firefox']}, created_after='2002-02-01T00:00:00Z')
+    assert not bug_filter.prefilter(json.dumps(bugs[0]))
+    # Passes the raw line check but is created too early
+    assert bug_filter.prefilter(json.dumps(bugs[2])) and not bug_filter.matches(bugs[2])
+
+    results = list(filter_partitions(bug_filter, [(2002, str(in_path))], tmp_path / 'out', workers=1))
+    assert results == [(2002, [(2, 6)])]
+    assert json.loads((tmp_path / 'out' / '2002.jsonl').read_text()) == bugs[1]
+
+
+def test_prefilter_accepts_compact_json():
+    bug = {'id': 1, 'product': 'Firefox', 'component': 'Général'}
+    bug_filter = BugFilter({'product': ['Firefox'], 'component': ['Général']})
+    for line in (json.dumps(bug), json.dumps(bug, separators=(',', ':'), ensure_ascii=False)):
+        assert bug_filter.prefilter(line)
+        assert bug_filter.prefilter(line.encode('utf-8'))
+    assert not bug_filter.prefilter(json.dumps(dict(bug, product='Core')).encode('utf-8'))
+
+
+def test_filter_command_keeps_partitioning(tmp_path):
+    saver = BugSaver(tmp_path / 'mozillabugs', partitioning=Partitioning('month'))
+    saver.save([{'id': 1, 'product': 'Firefox', 'creation_time': '2002-03-01T00:00:00Z'},
+                {'id': 2, 'product': 'Core', 'creation_time': '2002-06-01T00:00:00Z'}])
+    saver.flush()
+    saver.storage.close()
+
+    args = ['filter', 'mozilla', '-s', str(tmp_path), '--product', 'Firefox', '--workers', '1']
+    result = CliRunner().invoke(cli.main, args)
+    assert result.exit_code == 0, result.output
+    filtered = tmp_path / 'mozillabugs_filtered'
+    assert Partitioning.load(filtered) == Partitioning('month')
+    metadata = [json.loads(line) for line in (filtered / 'bug_metadata.jsonl').read_text().splitlines()]
+    assert [(meta['bug_id'], meta['year'], meta['month']) for meta in metadata] == [('1', 2002, 3)]
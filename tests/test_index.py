@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.index` module."""
+
+import json
+import pytest
+
+from bugscraper.bugscraper import Saver
+from bugscraper.compression import extensions, read_frame
+from bugscraper.index import index_partition, index_path, read_index
+from bugscraper.storage import JsonlBackend
+
+
+def read_line(path, entry):
+    offset, length, line_offset, line_length = entry
+    if path.endswith('.jsonl'):
+        with open(path, 'rb') as pf:
+            pf.seek(offset)
+            data = pf.read(length)
+    else:
+        data = read_frame(path, offset, length)
+    return json.loads(data[line_offset:line_offset + line_length])
+
+
+@pytest.mark.parametrize('compression', ['none', 'gzip', 'zstd'])
+def test_index_partition(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    storage = JsonlBackend(tmp_path, compression)
+    storage.open('bugs')
+    for bug_id in range(1, 6):
+        storage.write('bugs', 2002, bug_id, {'id': bug_id, 'summary': str(bug_id)})
+    storage.write('bugs', 2002, 3, {'id': 3, 'summary': 'updated'})
+    storage.close()
+
+    path = str(tmp_path / ('2002.jsonl' + extensions[compression]))
+    entries, _ = index_partition(path, 'bugs')
+    assert sorted(entries) == [1, 2, 3, 4, 5]
+    assert read_line(path, entries[3])['summary'] == 'updated'
+    assert read_index(path)[1] == entries
+
+    # Appended lines are indexed without rescanning the start of the file
+    storage = JsonlBackend(tmp_path, compression)
+    storage.open('bugs')
+    storage.write('bugs', 2002, 9, {'id': 9, 'summary': '9'})
+    storage.close()
+    entries, _ = index_partition(path, 'bugs')
+    assert sorted(entries) == [1, 2, 3, 4, 5, 9]
+    assert read_line(path, entries[9])['id'] == 9
+
+
+def test_stale_index(tmp_path):
+    path = str(tmp_path / '2002.jsonl')
+    with open(path, 'w') as pf:
+        pf.write(json.dumps({'id': 1}) + '\n')
+    index_partition(path, 'bugs')
+    assert read_index(path) is not None
+    # A file replaced by a shorter one invalidates its index
+    with open(path, 'w') as pf:
+        pf.write('{}\n')
+    assert read_index(path) is None
+    assert index_path(path).endswith('.jsonl.idx')
+
+
+def test_rebuild_metadata(tmp_path):
+    storage = JsonlBackend(tmp_path)
+    storage.open('bugs')
+    storage.open('comments')
+    storage.open('history')
+    storage.write('bugs', 2002, 1, {'id': 1})
+    storage.write('bugs', 2003, 2, {'id': 2})
+    storage.write('comments', 2002, 1, [{'id': 10}, {'id': 11}])
+    storage.write('history', 2003, 2, [{'when': 'x'}, {'when': 'y'}])
+    storage.close()
+
+    metadata = Saver(tmp_path).rebuild_metadata(workers=2)
+    assert metadata[metadata.index_of(1)].comment_ids == ['10', '11']
+    assert metadata[metadata.index_of(2)].year == 2003
+    assert metadata[metadata.index_of(2)].edits == 2
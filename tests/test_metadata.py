@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.metadata` module."""
+
+from bugscraper.bugscraper import BugSaver
+from bugscraper.metadata import BugSaveMetadata, FieldProjection, MetadataStore
+
+
+def test_metadata_store_log_roundtrip(tmp_path):
+    metadata_path = tmp_path / 'bug_metadata.jsonl'
+    store = MetadataStore()
+    store.append(BugSaveMetadata('7', 2002, []))
+    store.append(BugSaveMetadata('3', 2004, ['30', '31']))
+    store.save(metadata_path)
+
+    # Re-scraping a bug updates it in place and only appends that bug to the log
+    idx = store.append(BugSaveMetadata('7', 2003, []))
+    store.set_comment_ids(idx, [70, 71, 72])
+    store.set_edits(idx, 4)
+    store.flush(metadata_path)
+    assert len(metadata_path.read_text().splitlines()) == 3
+
+    loaded = MetadataStore()
+    loaded.load(metadata_path)
+    assert len(loaded) == 2
+    assert loaded[loaded.index_of(7)] == BugSaveMetadata('7', 2003, ['70', '71', '72'], 4)
+    assert loaded[loaded.index_of('3')].comment_ids == ['30', '31']
+
+
+def test_saver_streams_metadata(tmp_path, monkeypatch):
+    monkeypatch.setattr(BugSaver, 'metadata_flush_size', 2)
+    saver = BugSaver(tmp_path)
+    saver.save([{'id': 1, 'creation_time': '2002-01-01T00:00:00Z'}])
+    assert not (tmp_path / 'bug_metadata.jsonl').exists()
+    saver.save([{'id': 2, 'creation_time': '2002-01-01T00:00:00Z'},
+                {'id': 3, 'creation_time': '2002-01-01T00:00:00Z'}])
+    # Flushed without an explicit save, records first
+    assert len((tmp_path / 'bug_metadata.jsonl').read_text().splitlines()) == 3
+    assert len((tmp_path / '2002.jsonl').read_text().splitlines()) == 3
+    assert not saver.bug_metadata.dirty
+    saver.storage.close()
+
+
+def test_saver_records_field_projection(tmp_path):
+    saver = BugSaver(tmp_path)
+    saver.save_projection('bugs', FieldProjection(['creation_time', 'id', 'product']))
+    saver.save_projection('comments', FieldProjection())
+    projections = FieldProjection.load_all(tmp_path)
+    assert projections['bugs'].include_fields == ['creation_time', 'id', 'product']
+    assert projections['comments'] == FieldProjection()
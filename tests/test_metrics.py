@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.metrics` module."""
+
+import json
+import requests
+from requests.adapters import HTTPAdapter
+
+from bugscraper.bugscraper import BugzillaCommentApi
+from bugscraper.metrics import Metrics, MetricsReporter, metrics
+
+
+def test_prometheus_text(tmp_path):
+    registry = Metrics()
+    registry.inc('requests_total', endpoint='bugs', status=200)
+    registry.inc('requests_total', 2, endpoint='bugs', status=429)
+    registry.observe('request_seconds', 0.02, endpoint='bugs')
+    registry.observe('request_seconds', 3, endpoint='bugs')
+    text = registry.prometheus()
+    assert '# TYPE bugscraper_requests_total counter' in text
+    assert 'bugscraper_requests_total{endpoint="bugs",status="429"} 2' in text
+    assert 'bugscraper_request_seconds_bucket{endpoint="bugs",le="0.025"} 1' in text
+    assert 'bugscraper_request_seconds_bucket{endpoint="bugs",le="+Inf"} 2' in text
+    assert 'bugscraper_request_seconds_count{endpoint="bugs"} 2' in text
+    assert registry.total('requests_total', endpoint='bugs') == 3
+    assert registry.total('request_seconds') == 3.02
+
+    reporter = MetricsReporter(registry, str(tmp_path / 'stats.json'), str(tmp_path / 'bugscraper.prom'), 60)
+    reporter.start().stop()
+    stats = json.loads((tmp_path / 'stats.json').read_text())
+    assert {'name': 'requests_total', 'labels': {'endpoint': 'bugs', 'status': '200'}, 'value': 1} \
+        in stats['counters']
+    assert (tmp_path / 'bugscraper.prom').read_text().startswith('# TYPE')
+
+
+def test_api_instrumentation(monkeypatch):
+    def send(adapter, request, **kwargs):
+        response = requests.Response()
+        response.request, response.url, response.status_code = request, request.url, 200
+        response._content = b'{"bugs": {"1": {"comments": [{"id": 10}]}, "2": {"comments": []}}}'
+        return response
+
+    monkeypatch.setattr(HTTPAdapter, 'send', send)
+    metrics.reset()
+    api = BugzillaCommentApi('kde')
+    api.fetch(1)
+    api.fetch(2)
+    api.fetch(3)
+    assert metrics.total('requests_total', endpoint='comments', status=200) == 3
+    assert metrics.total('response_bytes_total') > 0
+    assert metrics.total('fetches_total', kind='comments', result='ok') == 1
+    # A bug missing from the response is a key error, which leaves the fetch empty as well
+    assert metrics.total('fetches_total', kind='comments', result='empty') == 2
+    assert any(line.startswith('comments: 0 records written') for line in metrics.summary())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.pipeline` module."""
+
+from bugscraper.pipeline import ScrapePipeline
+
+
+class FakeBugApi(object):
+    def __init__(self):
+        self.failed_ids = set()
+
+    def fetch(self, bug_ids):
+        return [{'id': bug_id} for bug_id in bug_ids if bug_id % 3]
+
+
+class FakeRecordApi(object):
+    def __init__(self):
+        self.failed_ids = set()
+        self.fetched = []
+
+    def fetch(self, bug_id):
+        self.fetched.append(bug_id)
+        return [{'id': bug_id}]
+
+    def fetch_many(self, bug_ids):
+        self.fetched.extend(bug_ids)
+        return {str(bug_id): [{'id': bug_id}] for bug_id in bug_ids}
+
+
+def consume(pipeline, chunks):
+    finished = []
+    for kind, chunk, result in pipeline.run(chunks):
+        if kind == 'bugs':
+            pipeline.submit([bug['id'] for bug in result])
+        else:
+            assert set(result) == set(str(bug_id) for bug_id in chunk)
+            finished.extend(pipeline.complete(kind, chunk))
+        # Chunks fetched or queued when the throttle kicked in still get submitted
+        in_flight = pipeline.results.maxsize + 2 * pipeline.workers
+        assert pipeline.outstanding <= pipeline.max_pending + in_flight * 10
+    return finished
+
+
+def test_pipeline_fans_out_saved_bugs():
+    record_apis = {'comments': FakeRecordApi(), 'history': FakeRecordApi()}
+    pipeline = ScrapePipeline(FakeBugApi(), record_apis, workers=3, batch_size=4, max_pending=20)
+    chunks = [list(range(start, start + 10)) for start in range(0, 200, 10)]
+    finished = consume(pipeline, chunks)
+
+    expected = [bug_id for bug_id in range(200) if bug_id % 3]
+    assert sorted(finished) == expected
+    for api in record_apis.values():
+        assert sorted(api.fetched) == expected
+    assert pipeline.outstanding == 0
+    assert pipeline.pending() == {'comments': [], 'history': []}
+
+
+def test_pipeline_resumes_pending_kinds():
+    record_apis = {'comments': FakeRecordApi(), 'history': FakeRecordApi()}
+    pipeline = ScrapePipeline(FakeBugApi(), record_apis, workers=2)
+    pipeline.submit([1, 2], ['history'])
+    assert pipeline.pending() == {'comments': [], 'history': [1, 2]}
+    finished = consume(pipeline, [[4, 5]])
+
+    assert sorted(finished) == [1, 2, 4, 5]
+    assert sorted(record_apis['comments'].fetched) == [4, 5]
+    assert sorted(record_apis['history'].fetched) == [1, 2, 4, 5]
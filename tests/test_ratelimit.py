@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.ratelimit` module."""
+
+import time
+
+from bugscraper.ratelimit import TokenBucket, get_limiter
+from bugscraper.bugscraper import BugzillaBugApi, BugzillaCommentApi
+
+
+def test_bucket_limits_rate():
+    bucket = TokenBucket(50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # The first token is available at once, the other five take 1/50s each
+    assert time.monotonic() - start >= 0.09
+
+
+def test_bucket_adapts_to_throttling():
+    bucket = TokenBucket(10, burst=5)
+    bucket.feedback(429)
+    assert bucket.rate == 5
+    bucket.feedback(503)
+    assert bucket.rate == 2.5
+    for _ in range(1000):
+        bucket.feedback(200)
+    assert bucket.rate == 10
+
+
+def test_apis_share_limiter_per_host():
+    bug_api = BugzillaBugApi('kde', rate=5)
+    comment_api = BugzillaCommentApi('kde', rate=5)
+    assert bug_api.host == 'bugs.kde.org'
+    assert bug_api.limiter is comment_api.limiter
+    assert bug_api.limiter is get_limiter('bugs.kde.org', 5)
+    assert BugzillaBugApi('kde').limiter is None
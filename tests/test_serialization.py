@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.serialization` module."""
+
+import json
+import pytest
+import requests
+
+from bugscraper.serialization import dumps, loads, response_json
+
+
+def test_round_trip_matches_stdlib():
+    record = {'id': 1, 'summary': 'Crash in Général', 'keywords': [], 'is_open': True, 'cc': None}
+    assert loads(dumps(record)) == record
+    assert json.loads(dumps(record)) == record
+    assert loads(json.dumps(record).encode('utf-8')) == record
+    assert '\n' not in dumps({'text': 'two\nlines'})
+
+
+def test_response_json_errors_like_requests():
+    response = requests.Response()
+    response._content = b'{"bugs": ['
+    with pytest.raises(requests.exceptions.JSONDecodeError):
+        response_json(response)
+    response._content = b'{"bugs": []}'
+    assert response_json(response) == {'bugs': []}
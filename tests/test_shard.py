@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.shard` module."""
+
+import json
+import pytest
+
+from bugscraper.shard import Shard, shard_dirs, merge_shards
+from bugscraper.storage import JsonlBackend
+
+
+def test_shards_partition_ids():
+    shards = [Shard.parse(f'{index}/3') for index in range(3)]
+    for bug_id in range(0, 10000, 7):
+        assert sum(shard.owns(bug_id) for shard in shards) == 1
+    assert shards[1].filter(range(998, 1003)) == [1000, 1001, 1002]
+    with pytest.raises(ValueError):
+        Shard.parse('3/3')
+
+
+def write_bugs(save_dir, bugs):
+    storage = JsonlBackend(save_dir)
+    storage.open('bugs')
+    for year, bug_id in bugs:
+        storage.write('bugs', year, bug_id, {'id': bug_id, 'summary': str(save_dir)})
+    storage.close()
+    with open(save_dir / 'bug_metadata.jsonl', 'w') as mf:
+        for year, bug_id in bugs:
+            mf.write(json.dumps({'bug_id': str(bug_id), 'year': year, 'comment_ids': [], 'edits': 0}) + '\n')
+
+
+def test_merge_shards_without_duplicates(tmp_path):
+    shards = [Shard(0, 2), Shard(1, 2)]
+    for shard in shards:
+        shard.save_dir(tmp_path).mkdir()
+    write_bugs(tmp_path, [(2002, 1), (2003, 1500)])
+    write_bugs(shards[0].save_dir(tmp_path), [(2002, 1), (2002, 2), (2002, 2)])
+    write_bugs(shards[1].save_dir(tmp_path), [(2003, 1500), (2003, 1501)])
+    (shards[0].save_dir(tmp_path) / 'failed_bugs.jsonl').write_text('3\n')
+
+    assert shard_dirs(tmp_path) == [shard.save_dir(tmp_path) for shard in shards]
+    counts = merge_shards(tmp_path, shard_dirs(tmp_path))
+    assert counts['bugs'] == 4
+
+    records = list(JsonlBackend(tmp_path).records('bugs'))
+    assert sorted(bug_id for _, bug_id, _ in records) == [1, 2, 1500, 1501]
+    assert all('shard' in record['summary'] for _, _, record in records)
+    assert len((tmp_path / 'bug_metadata.jsonl').read_text().splitlines()) == 4
+    assert (tmp_path / 'failed_bugs.jsonl').read_text() == '3\n'
+
+
+def test_merge_keeps_metadata_of_kept_records(tmp_path):
+    shard = Shard(0, 2)
+    shard.save_dir(tmp_path).mkdir()
+    write_bugs(tmp_path, [(2020, 1)])
+    storage = JsonlBackend(tmp_path)
+    storage.open('comments')
+    storage.write('comments', 2020, 1, [{'id': 50}, {'id': 51}])
+    storage.close()
+    with open(tmp_path / 'bug_metadata.jsonl', 'a') as mf:
+        mf.write(json.dumps({'bug_id': '1', 'year': 2020, 'comment_ids': ['50', '51'], 'edits': 0}) + '\n')
+    # The shard scraped the bug again without its comments
+    write_bugs(shard.save_dir(tmp_path), [(2020, 1)])
+
+    merge_shards(tmp_path, [shard.save_dir(tmp_path)])
+    metadata = [json.loads(line) for line in (tmp_path / 'bug_metadata.jsonl').read_text().splitlines()]
+    assert [(meta['bug_id'], meta['comment_ids']) for meta in metadata] == [('1', ['50', '51'])]
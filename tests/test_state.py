@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.state` module."""
+
+from datetime import datetime, timezone
+from click.testing import CliRunner
+
+from bugscraper import cli
+from bugscraper.bugscraper import BugSaver
+from bugscraper.state import ScrapeState, Checkpoint
+
+
+def test_scrape_state_roundtrip(tmp_path):
+    state = ScrapeState.load(tmp_path)
+    assert state.last_change_time is None
+
+    state.update([{'id': 3}, {'id': 1}], ('comments', 'history'))
+    state.mark(datetime(2020, 1, 2, 3, 30, tzinfo=timezone.utc))
+    state.clear_pending('comments', [1])
+    state.save(tmp_path)
+
+    loaded = ScrapeState.load(tmp_path)
+    assert loaded.last_change_time == '2020-01-02T03:20:00Z'
+    assert loaded.pending == {'comments': [3], 'history': [1, 3]}
+
+
+def test_checkpoint_resume_truncates_writes(tmp_path):
+    saver = BugSaver(tmp_path)
+    checkpoint = Checkpoint('bugscrape')
+    saver.save([{'id': 1, 'creation_time': '2002-11-14T04:48:24Z'}])
+    checkpoint.add_done(range(1, 11))
+    checkpoint.save(saver, {7})
+
+    # Written after the checkpoint, lost when the run is interrupted
+    saver.save([{'id': 11, 'creation_time': '2002-11-15T04:48:24Z'}])
+    saver.flush()
+
+    resumed = Checkpoint.load(tmp_path, 'bugscrape')
+    saver.truncate(resumed.offsets)
+    assert resumed.done == [[1, 11]]
+    assert resumed.failed == [7]
+    assert resumed.is_done(10) and not resumed.is_done(11)
+    assert len((tmp_path / '2002.jsonl').read_text().splitlines()) == 1
+
+
+def test_checkpoint_resume_truncates_metadata_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(BugSaver, 'metadata_flush_size', 2)
+    saver = BugSaver(tmp_path)
+    checkpoint = Checkpoint('bugscrape')
+    saver.save([{'id': 1, 'creation_time': '2002-11-14T04:48:24Z'}])
+    checkpoint.add_done([1])
+    checkpoint.save(saver, set())
+
+    # Streamed to the log after the checkpoint, then the run is interrupted
+    saver.save([{'id': 2, 'creation_time': '2002-11-15T04:48:24Z'},
+                {'id': 3, 'creation_time': '2002-11-16T04:48:24Z'}])
+    saver.storage.close()
+
+    resumed_saver = BugSaver(tmp_path)
+    assert len(resumed_saver.bug_metadata) == 3
+    resumed_saver.truncate(Checkpoint.load(tmp_path, 'bugscrape').offsets)
+    assert len((tmp_path / '2002.jsonl').read_text().splitlines()) == 1
+    assert list(resumed_saver.bug_metadata.bug_ids) == [1]
+    assert list(BugSaver(tmp_path).bug_metadata.bug_ids) == [1]
+
+
+def test_resume_without_checkpoint_is_refused(tmp_path):
+    args = ['bugscrape', 'kernel', '-s', str(tmp_path), '--fin-id', '10', '--resume']
+    result = CliRunner().invoke(cli.main, args)
+    assert result.exit_code == 2
+    assert 'No checkpoint of bugscrape' in result.output
+    assert not list((tmp_path / 'kernelbugs').glob('*.jsonl'))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `bugscraper.storage` module."""
+
+import os
+import json
+import pytest
+from click.testing import CliRunner
+
+from bugscraper import cli
+from bugscraper.bugscraper import BugSaver, CommentSaver
+from bugscraper.storage import JsonlBackend, Partitioning
+
+
+def test_sqlite_backend_upserts(tmp_path):
+    saver = BugSaver(tmp_path, backend='sqlite')
+    saver.save([{'id': 1, 'creation_time': '2002-11-14T04:48:24Z', 'status': 'NEW'}])
+    saver.save([{'id': 1, 'creation_time': '2002-11-14T04:48:24Z', 'status': 'FIXED'}])
+    saver.flush()
+    saver.save_metadata()
+    rows = [(bug_id, year, json.loads(data))
+            for bug_id, year, data in saver.storage.conn.execute('SELECT bug_id, year, data FROM bugs')]
+    assert rows == [(1, 2002, {'id': 1, 'creation_time': '2002-11-14T04:48:24Z', 'status': 'FIXED'})]
+    saver.storage.close()
+
+    comment_saver = CommentSaver(tmp_path, backend='sqlite')
+    comment_saver.save(0, [{'id': 10}])
+    comment_saver.storage.close()
+    assert len(comment_saver.bug_metadata) == 1
+    assert comment_saver.bug_metadata[0].comment_ids == ['10']
+
+
+@pytest.mark.parametrize('compression', ['none', 'gzip'])
+def test_jsonl_compact_keeps_newest(tmp_path, compression):
+    storage = JsonlBackend(tmp_path, compression)
+    storage.open('bugs')
+    storage.open('comments')
+    for status in ('NEW', 'FIXED'):
+        for bug_id in (5, 3, 9):
+            storage.write('bugs', 2002, bug_id, {'id': bug_id, 'status': f'{status} {bug_id}'})
+    storage.write('bugs', 2002, 3, {'id': 3, 'status': 'VERIFIED'})
+    storage.write('comments', 2002, 3, [{'id': 30}])
+    storage.close()
+    if compression == 'none':
+        with open(tmp_path / '2002.jsonl', 'a') as pf:
+            pf.write('{"id": 4, "sta')
+
+    counts = JsonlBackend(tmp_path).compact()
+    assert counts['bugs'] == (3, 5 if compression == 'none' else 4)
+    assert counts['comments'] == (1, 0)
+    records = list(JsonlBackend(tmp_path).records('bugs'))
+    assert records == [(2002, 5, {'id': 5, 'status': 'FIXED 5'}), (2002, 9, {'id': 9, 'status': 'FIXED 9'}),
+                       (2002, 3, {'id': 3, 'status': 'VERIFIED'})]
+
+
+def test_jsonl_writes_utf8(tmp_path):
+    storage = JsonlBackend(tmp_path)
+    storage.open('bugs')
+    for status in ('NEW', 'FIXED'):
+        storage.write('bugs', 2002, 1, {'id': 1, 'summary': '漢字 é', 'status': status})
+    storage.close()
+    JsonlBackend(tmp_path).compact()
+    lines = (tmp_path / '2002.jsonl').read_bytes().decode('utf-8').splitlines()
+    assert [json.loads(line) for line in lines] == [{'id': 1, 'summary': '漢字 é', 'status': 'FIXED'}]
+
+
+def test_compact_command_sqlite(tmp_path):
+    saver = BugSaver(tmp_path / 'kernelbugs', backend='sqlite')
+    saver.save([{'id': 1, 'creation_time': '2002-11-14T04:48:24Z'},
+                {'id': 2, 'creation_time': '2003-01-02T10:00:00Z'}])
+    saver.flush()
+    saver.save_metadata()
+    saver.storage.close()
+
+    result = CliRunner().invoke(cli.main, ['compact', 'kernel', '-s', str(tmp_path), '--backend', 'sqlite'])
+    assert result.exit_code == 0, result.output
+    assert 'bugs: kept 2, dropped 0' in result.output
+    with open(tmp_path / 'kernelbugs' / 'bug_metadata.jsonl') as mf:
+        assert sorted(json.loads(line)['bug_id'] for line in mf) == ['1', '2']
+
+
+def test_jsonl_opens_partitions_lazily_within_a_cap(tmp_path):
+    storage = JsonlBackend(tmp_path, partitioning=Partitioning('month'), max_open=2)
+    storage.open('bugs')
+    storage.open('comments')
+    for bug_id, created in enumerate(['2019-12-31', '2023-01-05', '2023-02-07', '2024-06-01'], 1):
+        storage.write('bugs', int(created[:4]), bug_id, {'id': bug_id}, int(created[5:7]))
+        storage.write('comments', int(created[:4]), bug_id, [{'id': bug_id * 10}], int(created[5:7]))
+        assert len(storage.fileobjs) <= 2
+    storage.close()
+
+    assert [os.path.basename(path) for _, path in storage.partitions('bugs')] == \
+        ['2019-12.jsonl', '2023-01.jsonl', '2023-02.jsonl', '2024-06.jsonl']
+    assert [bug_id for _, bug_id, _ in JsonlBackend(tmp_path).records('comments')] == [1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        JsonlBackend(tmp_path, partitioning=Partitioning('year'))
+
+
+def test_jsonl_truncate_covers_closed_and_new_files(tmp_path):
+    storage = JsonlBackend(tmp_path, partitioning=Partitioning('id-range', 10), max_open=1)
+    storage.open('bugs')
+    storage.write('bugs', 2002, 1, {'id': 1})
+    storage.write('bugs', 2002, 11, {'id': 11})
+    storage.flush()
+    offsets = storage.offsets()
+    storage.write('bugs', 2002, 2, {'id': 2})
+    storage.write('bugs', 2002, 21, {'id': 21})
+    storage.close()
+
+    storage = JsonlBackend(tmp_path)
+    storage.open('bugs')
+    storage.truncate(offsets)
+    storage.close()
+    assert [bug_id for _, bug_id, _ in JsonlBackend(tmp_path).records('bugs')] == [1, 11]